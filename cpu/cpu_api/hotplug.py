@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+CPU hotplug latency profiler.
+
+Times every CPU offline/online operation and, with the ``cpuhp`` trace
+events enabled, attributes the time of each operation to the hotplug state
+callbacks it ran. The cpuhp_enter/cpuhp_multi_enter and cpuhp_exit events
+are streamed from the global trace pipe, where the kernel merges the CPU
+buffers in timestamp order, and every exit is paired with the latest enter
+of its CPU and state before it, so only the aggregates are kept whatever
+the number of operations:
+
+* wall clock latency of the offline and online operations,
+* per state callback latency histograms,
+* the slowest callback invocations.
+
+Usage::
+
+    profiler = HotplugProfiler()
+    profiler.start()
+    for _ in range(iterations):
+        profiler.offline(1)
+        profiler.online(1)
+    report = profiler.stop()
+"""
+
+import heapq
+import os
+import re
+import sys
+import time
+from avocado.utils import cpu, genio
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, 'trace'))
+from trace_api.tracefs import TRACEFS, TraceReader
+
+__all__ = ['CPUHP_EVENTS', 'Histogram', 'HotplugProfiler']
+
+CPUHP_EVENTS = ['cpuhp_enter', 'cpuhp_multi_enter', 'cpuhp_exit']
+DEFAULT_TOP = 10
+
+# <task>-<pid> [<cpu>] <flags> <ts>: cpuhp_enter: cpu: 0003 target: 233
+# step:  45 (sched_cpu_activate)
+# ... cpuhp_exit: cpu: 0003  state:  45 step:  45 ret: 0
+EVENT = re.compile(r'\s(\d+\.\d+):\s+(cpuhp_\w+):\s+cpu:\s*(\d+)\s+'
+                   r'(?:target|state):\s*(-?\d+)\s+step:\s*(\d+)'
+                   r'(?:\s+\((.*)\)|\s+ret:\s*(-?\d+))?')
+
+
+class Histogram:
+    """Latency histogram with power of two microsecond buckets."""
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, usec):
+        bucket = 1
+        while bucket < usec:
+            bucket <<= 1
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += usec
+        self.max = max(self.max, usec)
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket holding the percentile."""
+        rank = self.count * pct / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return bucket
+        return 0
+
+    def report(self):
+        return {'count': self.count,
+                'mean_us': round(self.total / self.count, 1)
+                if self.count else 0,
+                'p50_us': self.percentile(50),
+                'p99_us': self.percentile(99),
+                'max_us': round(self.max, 1),
+                'histogram_us': dict(('<=%d' % bucket, self.buckets[bucket])
+                                     for bucket in sorted(self.buckets))}
+
+
+class HotplugProfiler:
+    """Time CPU hotplug operations and their state callbacks.
+
+    :param tracefs: tracefs mount point
+    :param top: number of slowest callback invocations reported
+    :param trace: when False only the wall clock of the operations is
+                  measured, without enabling the cpuhp events
+    """
+
+    def __init__(self, tracefs=TRACEFS, top=DEFAULT_TOP, trace=True):
+        self.tracefs = tracefs
+        self.top = top
+        self.trace = trace and os.path.isdir(
+            os.path.join(tracefs, 'events', 'cpuhp'))
+        self.reader = None
+        self.reset()
+
+    def reset(self):
+        """Forget the measures of the previous sweep."""
+        self.operations = {'offline': Histogram(), 'online': Histogram()}
+        self.failures = {'offline': 0, 'online': 0}
+        self.states = {}
+        self.slowest = []
+        self.unpaired = 0
+        self._enters = {}
+        self._seq = 0
+
+    def _enable_events(self, value):
+        for event in CPUHP_EVENTS:
+            genio.write_one_line(os.path.join(self.tracefs, 'events', 'cpuhp',
+                                              event, 'enable'), value)
+
+    def _callback(self, key, enter, exit_ts):
+        """Account one state callback invocation."""
+        start, name, target = enter
+        usec = (exit_ts - start) * 1000000
+        # the teardown callbacks run towards a lower state, down to
+        # CPUHP_TEARDOWN_CPU on the AP and to 0 on the control CPU
+        direction = 'offline' if target < key[1] else 'online'
+        state = '%s %s' % (key[1], name)
+        self.states.setdefault(state, Histogram()).add(usec)
+        self._seq += 1
+        entry = (usec, self._seq, {'state': state, 'cpu': key[0],
+                                   'direction': direction,
+                                   'usec': round(usec, 1)})
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, entry)
+        elif usec > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def _event(self, line):
+        """Pair the enter and exit events of a state callback."""
+        match = EVENT.search(line)
+        if not match:
+            return
+        timestamp, event, cpu_id, target, step, name, _ = match.groups()
+        key = (int(cpu_id), int(step))
+        timestamp = float(timestamp)
+        if event != 'cpuhp_exit':
+            enters = self._enters.setdefault(key, [])
+            enters.append((timestamp, name or '', int(target)))
+            # the control task may migrate while a callback sleeps, the
+            # merged pipe still orders the events by timestamp, but keep
+            # the list sorted whatever the reading order
+            enters.sort()
+            return
+        enters = self._enters.get(key, [])
+        # the callbacks of a state do not nest on a CPU, the exit closes
+        # the latest enter before it, older enters lost their exit
+        before = [enter for enter in enters if enter[0] <= timestamp]
+        if not before:
+            self.unpaired += 1
+            return
+        self.unpaired += len(before) - 1
+        self._callback(key, before[-1], timestamp)
+        self._enters[key] = [enter for enter in enters
+                             if enter[0] > timestamp]
+
+    def start(self):
+        """Start a sweep, tracing the cpuhp events when available."""
+        self.reset()
+        if not self.trace:
+            return
+        genio.write_one_line(os.path.join(self.tracefs, 'trace'), '')
+        self.reader = TraceReader(self.tracefs, pattern='cpuhp_',
+                                  max_lines=100, callback=self._event,
+                                  merged=True)
+        self.reader.start()
+        self._enable_events('1')
+
+    def _timed(self, direction, func, cpu_id):
+        wanted = direction == 'online'
+        # operations on a CPU already in the wanted state are not timed
+        if cpu._get_status(cpu_id) == wanted:
+            return func(cpu_id)
+        start = time.monotonic()
+        status = func(cpu_id)
+        usec = (time.monotonic() - start) * 1000000
+        self.operations[direction].add(usec)
+        if cpu._get_status(cpu_id) != wanted:
+            self.failures[direction] += 1
+        return status
+
+    def offline(self, cpu_id):
+        """Offline cpu_id and time it, return the avocado cpu.offline status."""
+        return self._timed('offline', cpu.offline, cpu_id)
+
+    def online(self, cpu_id):
+        """Online cpu_id and time it, return the avocado cpu.online status."""
+        return self._timed('online', cpu.online, cpu_id)
+
+    def stop(self):
+        """Stop the sweep and return its report."""
+        dropped = 0
+        if self.reader:
+            self._enable_events('0')
+            dropped = self.reader.stop()
+            self.reader = None
+        self.unpaired += sum(len(enters) for enters in
+                             self._enters.values())
+        self._enters = {}
+        return self.report(dropped)
+
+    def report(self, dropped=0):
+        """Return the measures of the sweep as a dict."""
+        states = sorted(self.states.items(), key=lambda item: item[1].total,
+                        reverse=True)
+        return {'operations': dict((direction, hist.report())
+                                   for direction, hist in
+                                   self.operations.items()),
+                'failures': dict(self.failures),
+                'states': dict((state, hist.report())
+                               for state, hist in states),
+                'slowest': [entry for _, _, entry in
+                            sorted(self.slowest, reverse=True)],
+                'unpaired_events': self.unpaired,
+                'dropped_events': dropped}
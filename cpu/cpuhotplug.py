@@ -18,12 +18,20 @@
 Stress test for CPU
 """
 
+import os
+import sys
+import json
 import multiprocessing
 from random import randint
 from avocado import Test
 from avocado.utils import process, cpu, distro, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api.kmsg import KmsgWatcher
+from cpu_api.hotplug import HotplugProfiler
+
 
 pids = []
 totalcpus = int(multiprocessing.cpu_count()) - 1
@@ -33,6 +41,8 @@ errorlog = ['WARNING: CPU:', 'Oops',
             'rcu_sched detected stalls',
             'NMI backtrace for cpu',
             'Call Trace:']
+# scenarios timed in profile mode
+PROFILED = ['cpu_serial_off_on', 'single_cpu_toggle', 'cpu_toggle_one_by_one']
 
 
 def collect_dmesg(object):
@@ -73,17 +83,44 @@ class cpuHotplug(Test):
                 self.cancel("%s is required to continue..." % pkg)
         self.iteration = int(self.params.get('iteration', default='10'))
         self.tests = self.params.get('test', default='all')
-
-    @staticmethod
-    def __error_check():
-        ERROR = []
-        logs = process.system_output("dmesg -Txl 1,2,3,4"
-                                     "").decode("utf-8").splitlines()
-        for error in errorlog:
-            for log in logs:
-                if error in log:
-                    ERROR.append(log)
-        return "\n".join(ERROR)
+        self.profiler = None
+        if self.params.get('profile', default=False):
+            self.profiler = HotplugProfiler(
+                top=self.params.get('top_callbacks', default=10))
+        self.kmsg = KmsgWatcher(errorlog)
+        self.kmsg.start()
+
+    def __error_check(self):
+        return "\n".join(self.kmsg.messages())
+
+    def __offline(self, core):
+        if self.profiler:
+            return self.profiler.offline(core)
+        return cpu.offline(core)
+
+    def __online(self, core):
+        if self.profiler:
+            return self.profiler.online(core)
+        return cpu.online(core)
+
+    def __report_profile(self, method, report):
+        """
+        Log the hotplug latencies of a scenario and save its report
+        """
+        with open(os.path.join(self.outputdir, 'cpuhp_%s.json' % method),
+                  'w') as report_file:
+            json.dump(report, report_file, indent=4)
+        for direction, latency in report['operations'].items():
+            self.log.info("%s: %s ops, p50 %sus, p99 %sus, max %sus",
+                          direction, latency['count'], latency['p50_us'],
+                          latency['p99_us'], latency['max_us'])
+        for slow in report['slowest']:
+            self.log.info("slow %s callback on cpu%s: %s (%sus)",
+                          slow['direction'], slow['cpu'], slow['state'],
+                          slow['usec'])
+        if report['dropped_events']:
+            self.log.warning("%s cpuhp events lost, the per state numbers "
+                             "are partial", report['dropped_events'])
 
     @staticmethod
     def __isSMT():
@@ -132,11 +169,20 @@ class cpuHotplug(Test):
         for method in tests:
             self.log.info("\nTEST: %s\n", method)
             dmesg.clear_dmesg()
+            self.kmsg.reset()
             run_test = 'self.%s()' % method
-            eval(run_test)
+            if self.profiler and method in PROFILED:
+                self.profiler.start()
+                try:
+                    eval(run_test)
+                finally:
+                    report = self.profiler.stop()
+                self.__report_profile(method, report)
+            else:
+                eval(run_test)
             msg = self.__error_check()
             if msg:
-                collect_dmesg()
+                collect_dmesg(self)
                 self.log.info('Test: %s. ERROR Message: %s', run_test, msg)
             self.log.info("\nEND: %s\n", method)
 
@@ -153,20 +199,20 @@ class cpuHotplug(Test):
             if totalcpus != 0:
                 for cpus in range(1, totalcpus):
                     self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
+                    self.__offline(cpus)
             self.log.info("Online CPU's in reverse order %s", totalcpus)
             for cpus in range(totalcpus, -1, -1):
                 self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+                self.__online(cpus)
             self.log.info("Offline CPU's in reverse order %s", totalcpus)
             if totalcpus != 0:
                 for cpus in range(totalcpus, -1, -2):
                     self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
+                    self.__offline(cpus)
             self.log.info("Online CPU's in serial")
             for cpus in range(0, totalcpus):
                 self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+                self.__online(cpus)
 
     def single_cpu_toggle(self):
         """
@@ -178,9 +224,9 @@ class cpuHotplug(Test):
             for _ in range(self.iteration):
                 if totalcpus != 0:
                     self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
+                    self.__offline(cpus)
                 self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+                self.__online(cpus)
 
     def cpu_toggle_one_by_one(self):
         """
@@ -191,9 +237,9 @@ class cpuHotplug(Test):
             for cpus in range(totalcpus):
                 if totalcpus != 0:
                     self.log.info("Offlining cpu%s", cpus)
-                    cpu.offline(cpus)
+                    self.__offline(cpus)
                 self.log.info("Onlining cpu%s", cpus)
-                cpu.online(cpus)
+                self.__online(cpus)
 
     def multiple_cpus_toggle(self):
         """
@@ -294,6 +340,8 @@ class cpuHotplug(Test):
         Sets back SMT to original value as was before the test.
         Sets back cpu states to online
         """
+        if hasattr(self, 'kmsg'):
+            self.kmsg.stop()
         if hasattr(self, 'curr_smt'):
             process.system_output(
                 "ppc64_cpu --smt=off && ppc64_cpu --smt=on && ppc64_cpu --smt=%s"
@@ -15,6 +15,7 @@
 # Author: Pavithra Prakash <pavrampu@linux.vnet.ibm.com>
 
 import os
+import sys
 import time
 from avocado import Test
 from avocado import skipIf
@@ -24,6 +25,13 @@ from avocado.utils import process, cpu
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import dmesg
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api.kmsg import KmsgWatcher
+
+DMESG_ERRORS = ['WARNING: CPU:', 'Oops', 'Segfault', 'soft lockup',
+                'Unable to handle', 'ard LOCKUP']
+
 
 class CpupowerMonitor(Test):
     """
@@ -57,6 +65,13 @@ class CpupowerMonitor(Test):
                 break
         self.log.info("Total Idle states: %d" % self.states_tot)
         self.run_cmd_out("cpupower monitor")
+        # match the messages of every level, like the full dmesg scan did
+        self.kmsg = KmsgWatcher(DMESG_ERRORS, max_level=7)
+        self.kmsg.start()
+
+    def tearDown(self):
+        if hasattr(self, 'kmsg'):
+            self.kmsg.stop()
 
     def run_cmd_out(self, cmd):
         return process.system_output(cmd, shell=True, ignore_status=True,
@@ -114,31 +129,10 @@ class CpupowerMonitor(Test):
                           " ebizzy workload")
         self.log.info("cpus have entered idle states after killing work load")
 
-    def read_line_with_matching_pattern(self, filename, pattern):
-        matching_pattern = []
-        with open(filename, 'r') as file_obj:
-            for line in file_obj.readlines():
-                if pattern in line:
-                    matching_pattern.append(line.rstrip("\n"))
-        return matching_pattern
-
     def dmesg_validation(self):
-        errors_in_dmesg = []
-        pattern = ['WARNING: CPU:', 'Oops', 'Segfault', 'soft lockup',
-                   'Unable to handle', 'ard LOCKUP']
-
-        filename = dmesg.collect_dmesg()
-
-        for failed_pattern in pattern:
-            contents = self.read_line_with_matching_pattern(
-                filename, failed_pattern)
-            if contents:
-                loop_count = 0
-                while loop_count < len(contents):
-                    errors_in_dmesg.append(contents[loop_count])
-                    loop_count = loop_count + 1
-
+        errors_in_dmesg = self.kmsg.messages()
         if errors_in_dmesg:
+            dmesg.collect_dmesg()
             self.fail("Failed : Errors in dmesg : %s" %
                       "\n".join(errors_in_dmesg))
 
@@ -151,9 +145,9 @@ class CpupowerMonitor(Test):
         5. Repeat test for all states.
         """
         dmesg.clear_dmesg()
+        self.kmsg.reset()
         if self.runtime != 0:
             start_time = time.time()
-            dtime_check = self.runtime / 4
             while time.time() - start_time < self.runtime:
                 for i in range(self.states_tot - 1):
                     process.run('cpupower -c all idle-set -d %s' %
@@ -165,9 +159,8 @@ class CpupowerMonitor(Test):
                             "cpus have entered the disabled idle states.")
                     self.log.info("cpus have not entered disabled idle states")
                     process.run('cpupower -c all idle-set -E', shell=True)
-                if ((time.time() - start_time) >= dtime_check):
-                    dtime_check += dtime_check
-                    # Checking dmesg for errors every 1/4 of the time.
+                    # The watched messages are cheap to check, so check
+                    # them after every idle state
                     self.dmesg_validation()
         else:
             for i in range(self.states_tot - 1):
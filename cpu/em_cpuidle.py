@@ -14,6 +14,7 @@
 # Copyright: 2017 IBM
 # Author:Shriya Kulkarni <shriyak@linux.vnet.ibm.com>
 import os
+import sys
 import random
 import subprocess
 import re
@@ -23,6 +24,10 @@ from avocado import skipIf
 from avocado.utils import process, distro, cpu
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import sysfs
+
 IS_POWER_NV = 'PowerNV' in open('/proc/cpuinfo', 'r').read()
 
 
@@ -59,10 +64,11 @@ class cpuidle(Test):
                                            "awk '{print $5}'"
                                            % cpu_num, shell=True).decode("utf-8")
             cpu_idle_states = []
+            idle_states = sysfs.snapshot("/sys/devices/system/cpu/cpu%s/"
+                                         "cpuidle" % cpu_num,
+                                         include=['name'])
             for i in range(1, int(states)):
-                val = process.system_output("cat /sys/devices/system/cpu/"
-                                            "cpu%s/cpuidle/state%s/"
-                                            "name" % (cpu_num, i)).decode("utf-8")
+                val = idle_states.get('state%s' % i, {}).get('name', '')
                 if 'power8' in cpu.get_family():
                     val = self.set_idle_states(val)
                 cpu_idle_states.append(val)
@@ -18,12 +18,17 @@ import json
 import os
 import platform
 import re
+import sys
 
 from avocado import Test
 from avocado.utils import process
 from avocado.utils import build, distro, git
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import repetition
+
 
 class Producer_Consumer(Test):
 
@@ -57,6 +62,15 @@ class Producer_Consumer(Test):
         url = 'https://github.com/gautshen/misc.git'
         pc_url = self.params.get("pc_url", default=url)
         self.workload_iteration = self.params.get("workload_iter", default=5)
+        self.warmup = int(self.params.get("warmup", default=1))
+        self.min_runs = int(self.params.get("min_runs", default=3))
+        self.target_ci = float(self.params.get("target_ci", default=2))
+        self.max_runs = int(self.params.get("max_runs", default=30))
+        self.time_cap = float(self.params.get("time_cap", default=900))
+        self.noise = repetition.NoiseControl(
+            self.params.get("pin_cpus", default=""),
+            self.params.get("governor", default=""),
+            self.params.get("drop_caches", default=False), log=self.log)
         git.get_repo(pc_url, destination_dir=self.workdir)
         self.sourcedir = os.path.join(self.workdir, 'producer_consumer')
         os.chdir(self.sourcedir)
@@ -86,7 +100,6 @@ class Producer_Consumer(Test):
         return extracted_data
 
     def test(self):
-        pro_cons_payload = []
         pro_cons_dir = self.logdir + "/prod_cons_worklaod"
         os.makedirs(pro_cons_dir, exist_ok=True)
         perfstat = self.params.get('perfstat', default='')
@@ -117,7 +130,8 @@ class Producer_Consumer(Test):
         if intermediate_stats:
             args += ' --intermediate-stats'
         cmd = '%s %s/producer_consumer %s' % (perfstat, self.sourcedir, args)
-        for run in range(self.workload_iteration):
+
+        def run_once(run):
             res = process.run(cmd, ignore_status=True, shell=True)
 
             if res.exit_status:
@@ -137,9 +151,10 @@ class Producer_Consumer(Test):
                     cleaned_string = decoded_string.lstrip('\t')
                     payload.write(cleaned_string + '\n')
 
+            result = None
             for line in lines:
                 if line.startswith('Consumer(0) :'):
-                    print(line)
+                    self.log.info(line)
                     pattern = re.compile(r":\s(.*?) iterations")
                     iteration = pattern.findall(line)[0]
                     pattern = re.compile(r"time/iteration: (.*?) ns")
@@ -152,9 +167,29 @@ class Producer_Consumer(Test):
                                               'iter_time': time_iter,
                                               'access_time': time_acc,
                                               'perf_stat': perf_stat})
+                    pro_cons_log = pro_cons_dir + "/pro_cons[" + \
+                        str(run) + "].json"
+                    with open(pro_cons_log, "w") as outfile:
+                        outfile.write(json_object)
+                    result = {'iter_time': float(time_iter),
+                              'access_time': float(time_acc),
+                              'iterations': float(iteration)}
+                    if 'elapsed_time' in perf_stat:
+                        result['elapsed_time'] = perf_stat['elapsed_time']
                     break
-
-            logfile = os.path.join(self.logdir, "time_log.json")
-            pro_cons_log = pro_cons_dir + "/pro_cons[" + str(run) + "].json"
-            with open(pro_cons_log, "w") as outfile:
-                outfile.write(json_object)
+            return result
+
+        # warmup runs are discarded, then the runs go on until the 95%
+        # confidence interval of the mean time per iteration is within
+        # target_ci percent
+        summary = repetition.Repeater(
+            run_once, warmup=self.warmup, min_runs=self.min_runs,
+            max_runs=self.max_runs, target_ci=self.target_ci,
+            runs=int(self.workload_iteration),
+            time_cap=self.time_cap, noise=self.noise, log=self.log).run()
+        repetition.report(summary, log=self.log)
+        self.whiteboard = json.dumps(summary)
+        with open(os.path.join(self.logdir, "time_log.json"), "w") as logfile:
+            json.dump(summary, logfile, indent=2)
+        if not summary['runs']:
+            self.fail("No consumer statistics in the output of %s" % cmd)
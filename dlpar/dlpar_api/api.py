@@ -34,6 +34,7 @@ import time
 from avocado import *
 from avocado.utils import process
 from avocado.utils.ssh import Session
+from dlpar_api.hmc import HmcQuery, HmcStandIn
 __all__ = ['TestException', 'SshMachine', 'TestLog',
            'TestCase', 'DedicatedCpu', 'CpuUnit', 'Memory']
 
@@ -77,7 +78,11 @@ class SshMachine():
             self.machine = config_payload.get('hmc_manageSystem')
 
         self.log = log
-        if machine_type == "hmc" or machine_type == "linux_secondary":
+        standin = config_payload.get('hmc_standin')
+        if machine_type == "hmc" and standin:
+            # canned HMC state, to run the DLPAR loops without an HMC
+            self.sshcnx = HmcStandIn(standin)
+        elif machine_type == "hmc" or machine_type == "linux_secondary":
             self.sshcnx = self.__init_ssh(self.user, self.passwd, self.name)
 
     def __init_ssh(self, hmc_username, hmc_pwd,  hmc_ip):
@@ -179,14 +184,17 @@ class TestCase:
             # Hmc ...
             self.hmc = SshMachine(config_payload, 'hmc', self.log)
             self.log.debug('Login to HMC successful.')
+            self.hmc_query = HmcQuery(self.hmc.sshcnx, self.log)
             # ... and the linux partitions
             if clients == 'primary' or clients == 'both':
                 self.linux_1 = SshMachine(
                     config_payload, 'linux_primary', self.log)
+                self.hmc_query.register(self.linux_1)
                 self.log.debug('Login to 1st linux LPAR successful.')
             if clients == 'secondary' or clients == 'both':
                 self.linux_2 = SshMachine(
                     config_payload, 'linux_secondary', self.log)
+                self.hmc_query.register(self.linux_2)
                 self.log.debug('Login to 2nd linux LPAR successful.')
 
             self.log.check_log('Getting Machine connections.', True)
@@ -216,7 +224,7 @@ class TestCase:
                 ' -t "' + linux_machine[1].partition + '"' + ' -w 0 '
         else:
             self.log.error("Invalid DLPAR flag")
-        self.cmd_result = self.hmc.sshcnx.cmd(cmd)
+        self.cmd_result = self.hmc_query.chhwres(cmd)
         return self.cmd_result
 
     def Dlpar_cpu_validation(self, flag, linux_machine, quantity,
@@ -374,11 +382,8 @@ class TestCase:
 
     def get_cpu_option(self, linux_machine, option):
         """Just to help getting a cpu option from hmc."""
-
-        o_cmd = 'lshwres -m ' + linux_machine.machine + \
-                ' --level lpar -r proc --filter lpar_names="' + \
-                linux_machine.partition + '" -F ' + option
-        opt_value = self.hmc.sshcnx.cmd(o_cmd).stdout_text.strip()
+        opt_value = self.hmc_query.lpar_attr(linux_machine.machine, 'proc',
+                                             linux_machine.partition, option)
         d_msg = option + ": " + opt_value + " for partition " + \
             linux_machine.partition
         self.log.debug(d_msg)
@@ -386,10 +391,8 @@ class TestCase:
 
     def get_mem_option(self, linux_machine, option):
         """Just to help getting a memory option from hmc."""
-        o_cmd = 'lshwres -m ' + linux_machine.machine + \
-                ' --level lpar -r mem --filter lpar_names="' + \
-                linux_machine.partition + '" -F ' + option
-        opt_value = self.hmc.sshcnx.cmd(o_cmd).stdout_text.strip()
+        opt_value = self.hmc_query.lpar_attr(linux_machine.machine, 'mem',
+                                             linux_machine.partition, option)
         d_msg = option + ": " + opt_value + " for partition " + \
             linux_machine.partition
         self.log.debug(d_msg)
@@ -397,9 +400,8 @@ class TestCase:
 
     def get_lmb_value(self, linux_machine, option):
         """to get lmb size of a managed system"""
-        o_cmd = 'lshwres -r mem -m ' + linux_machine.machine + \
-                ' --level sys -F ' + option
-        opt_value = self.hmc.sshcnx.cmd(o_cmd).stdout_text.strip()
+        opt_value = self.hmc_query.sys_attr(linux_machine.machine, 'mem',
+                                            option)
         d_msg = option + ": " + opt_value + " for CEC " + \
             linux_machine.machine
         self.log.debug(d_msg)
@@ -870,10 +872,8 @@ class Memory(TestCase):
         self.log.debug("Machine: %s" % linux_machine.name)
 
         # Getting memory configuration
-        m_cmd = 'lshwres -m ' + linux_machine.machine + \
-                ' --level sys -r mem -F curr_avail_sys_mem'
-        curr_avail_sys_mem = int(
-            self.hmc.sshcnx.cmd(m_cmd).stdout_text.strip())
+        curr_avail_sys_mem = int(self.get_lmb_value(linux_machine,
+                                                    'curr_avail_sys_mem'))
         curr_max_mem = int(self.get_mem_option(linux_machine, 'curr_max_mem'))
         curr_mem = int(self.get_mem_option(linux_machine, 'curr_mem'))
         # Check if the system support the memory units to remove
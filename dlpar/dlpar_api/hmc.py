@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+HMC query layer of the DLPAR test suite API.
+
+Every ``lshwres`` is a round trip of seconds to the HMC, and the DLPAR
+validations read several attributes of the same partitions in a row.
+:class:`HmcQuery` reads all the attributes of all the partitions under
+test with one ``lshwres`` per resource, sends the independent queries
+together in one SSH command, and serves the following reads from a cache
+that every ``chhwres`` invalidates.
+
+:class:`HmcStandIn` answers the ``lshwres``/``chhwres`` commands the suite
+sends from a canned partition state instead of a real HMC, so the DLPAR
+loops can be benchmarked and tested without one.
+"""
+
+import csv
+import json
+import shlex
+import time
+from avocado.utils import process
+
+__all__ = ['SEPARATOR', 'parse_attrs', 'HmcQuery', 'HmcStandIn']
+
+# printed between the outputs of the queries sent in one command
+SEPARATOR = '--- dlpar query ---'
+
+
+def parse_attrs(line):
+    """Parse one ``lshwres`` line like ``lpar_name=p1,curr_procs=2``.
+
+    Values holding commas come quoted, like ``"lpar_names=p1,p2"``.
+    """
+    attrs = {}
+    for field in next(csv.reader([line.strip()])):
+        name, sep, value = field.partition('=')
+        if sep:
+            attrs[name] = value
+    return attrs
+
+
+class HmcQuery:
+    """Cached and batched ``lshwres`` queries.
+
+    :param sshcnx: HMC connection, with a ``cmd()`` returning a CmdResult
+    :param log: test case log
+    """
+
+    def __init__(self, sshcnx, log):
+        self.sshcnx = sshcnx
+        self.log = log
+        self.partitions = {}
+        self.cache = {}
+        self.round_trips = 0
+
+    def register(self, linux_machine):
+        """Add a partition to the ones every query reads."""
+        self.partitions.setdefault(linux_machine.machine, set()).add(
+            linux_machine.partition)
+        self.cache.pop(linux_machine.machine, None)
+
+    def cmd(self, command):
+        """Send a command to the HMC."""
+        self.round_trips += 1
+        return self.sshcnx.cmd(command)
+
+    def query_many(self, commands):
+        """Send independent commands in one round trip.
+
+        :return: list of the stdout of every command
+        """
+        if len(commands) == 1:
+            return [self.cmd(commands[0]).stdout_text]
+        joined = (" ; echo '%s' ; " % SEPARATOR).join(commands)
+        output = self.cmd(joined).stdout_text
+        outputs = output.split('%s\n' % SEPARATOR)
+        if len(outputs) != len(commands):
+            # the shell refused the list, fall back to one by one
+            self.log.debug('HMC did not run the query list, %d outputs for '
+                           '%d queries', len(outputs), len(commands))
+            return [self.cmd(command).stdout_text for command in commands]
+        return outputs
+
+    def fetch(self, machine):
+        """Read the proc and mem attributes of the registered partitions
+        and the mem attributes of the system in one round trip.
+        """
+        names = ','.join(sorted(self.partitions.get(machine, [])))
+        lpar_filter = ' --filter "lpar_names=%s"' % names if names else ''
+        commands = ['lshwres -m %s --level lpar -r proc%s' %
+                    (machine, lpar_filter),
+                    'lshwres -m %s --level lpar -r mem%s' %
+                    (machine, lpar_filter),
+                    'lshwres -m %s --level sys -r mem' % machine]
+        proc, mem, sys_mem = self.query_many(commands)
+        entry = {'proc': {}, 'mem': {}, 'sys': {}}
+        for resource, output in (('proc', proc), ('mem', mem)):
+            for line in output.splitlines():
+                attrs = parse_attrs(line)
+                if 'lpar_name' in attrs:
+                    entry[resource][attrs['lpar_name']] = attrs
+        lines = sys_mem.strip().splitlines()
+        entry['sys'] = parse_attrs(lines[0]) if lines else {}
+        self.cache[machine] = entry
+        return entry
+
+    def _entry(self, machine):
+        if machine not in self.cache:
+            self.fetch(machine)
+        return self.cache[machine]
+
+    def lpar_attr(self, machine, resource, partition, option):
+        """Return one proc or mem attribute of a partition."""
+        attrs = self._entry(machine)[resource].get(partition, {})
+        if option in attrs:
+            return attrs[option]
+        # attributes lshwres only prints when asked for
+        o_cmd = 'lshwres -m %s --level lpar -r %s --filter lpar_names="%s" ' \
+                '-F %s' % (machine, resource, partition, option)
+        return self.cmd(o_cmd).stdout_text.strip()
+
+    def sys_attr(self, machine, resource, option):
+        """Return one attribute of the managed system."""
+        attrs = self._entry(machine)['sys']
+        if resource == 'mem' and option in attrs:
+            return attrs[option]
+        o_cmd = 'lshwres -r %s -m %s --level sys -F %s' % \
+            (resource, machine, option)
+        return self.cmd(o_cmd).stdout_text.strip()
+
+    def invalidate(self, machine=None):
+        """Drop the cached attributes, of one machine or all."""
+        if machine:
+            self.cache.pop(machine, None)
+        else:
+            self.cache = {}
+
+    def chhwres(self, command):
+        """Run a chhwres and invalidate the cache it changes."""
+        try:
+            return self.cmd(command)
+        finally:
+            self.invalidate()
+
+
+class HmcStandIn:
+    """Local HMC stand-in replaying lshwres/chhwres on a canned state.
+
+    The state file is JSON like::
+
+        {"delay": 0.5,
+         "systems": {"<managed system>": {
+             "sys": {"mem": {"curr_avail_sys_mem": "8192",
+                             "mem_region_size": "256"}},
+             "lpars": {"<partition>": {
+                 "proc": {"curr_proc_mode": "ded", "curr_procs": "2", ...},
+                 "mem": {"curr_mem": "4096", "curr_max_mem": "8192", ...}
+             }}}}}
+
+    :param path: JSON state file
+    """
+
+    def __init__(self, path):
+        with open(path) as state_file:
+            self.state = json.load(state_file)
+        self.delay = float(self.state.get('delay', 0))
+        self.commands = []
+
+    @staticmethod
+    def _options(args):
+        options = {}
+        for index, arg in enumerate(args):
+            if arg.startswith('-'):
+                following = args[index + 1] if index + 1 < len(args) else ''
+                options[arg] = '' if following.startswith('-') else following
+        return options
+
+    def _lshwres(self, options):
+        system = self.state['systems'][options['-m']]
+        resource = options['-r']
+        fields = options.get('-F')
+        if options.get('--level') == 'sys':
+            rows = [system['sys'].get(resource, {})]
+        else:
+            names = options.get('--filter', '').partition('=')[2]
+            names = names.strip('"').split(',') if names else \
+                sorted(system['lpars'])
+            rows = [dict(system['lpars'][name][resource], lpar_name=name)
+                    for name in names if name in system['lpars']]
+        lines = []
+        for row in rows:
+            if fields:
+                lines.append(','.join(row.get(field, 'null')
+                                      for field in fields.split(',')))
+            else:
+                lines.append(','.join('"%s=%s"' % (name, value)
+                                      if ',' in value else
+                                      '%s=%s' % (name, value)
+                                      for name, value in sorted(row.items())))
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _add(attrs, name, quantity, limit=None):
+        """Add quantity to an attribute, return an error past its limit."""
+        value = float(attrs[name]) + quantity
+        if value < 0 or (limit and value > float(attrs[limit])):
+            return 'HSCL294C The partition %s %s would be out of range' % \
+                (name, value)
+        attrs[name] = ('%d' % value if value == int(value) else
+                       str(round(value, 2)))
+        return ''
+
+    def _chhwres(self, options):
+        system = self.state['systems'][options['-m']]
+        operation = options['-o']
+        source = system['lpars'][options['-p']]
+        target = system['lpars'].get(options.get('-t'))
+        sign = -1 if operation in ('r', 'm') else 1
+        if '--procs' in options or '--procunits' in options:
+            name, limit = ('curr_procs', 'curr_max_procs') \
+                if '--procs' in options else \
+                ('curr_proc_units', 'curr_max_proc_units')
+            quantity = float(options.get('--procs') or
+                             options['--procunits'])
+            error = self._add(source['proc'], name, sign * quantity, limit)
+            if not error and target:
+                error = self._add(target['proc'], name, quantity, limit)
+            return error
+        quantity = float(options['-q'])
+        error = self._add(source['mem'], 'curr_mem', sign * quantity,
+                          'curr_max_mem')
+        if not error and target:
+            error = self._add(target['mem'], 'curr_mem', quantity,
+                              'curr_max_mem')
+        elif not error:
+            self._add(system['sys']['mem'], 'curr_avail_sys_mem',
+                      -sign * quantity)
+        return error
+
+    def _run(self, command):
+        args = shlex.split(command)
+        if not args:
+            return ''
+        options = self._options(args[1:])
+        if args[0] == 'echo':
+            return ' '.join(args[1:])
+        if args[0] == 'lshwres':
+            return self._lshwres(options)
+        if args[0] == 'chhwres':
+            return self._chhwres(options)
+        return '%s: command not found' % args[0]
+
+    def cmd(self, command):
+        """Run the HMC command list and return its CmdResult."""
+        self.commands.append(command)
+        time.sleep(self.delay)
+        outputs = []
+        for part in command.split(';'):
+            output = self._run(part)
+            if output:
+                outputs.append(output + '\n')
+        return process.CmdResult(command, ''.join(outputs).encode(), b'', 0)
+
+    def cleanup_master(self):
+        """Nothing to clean, for the Session interface."""
+
+    def connect(self):
+        """Always connected, for the Session interface."""
+        return True
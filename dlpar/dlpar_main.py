@@ -29,7 +29,7 @@ list_payload = ["cfg_cpu_per_proc", "hmc_manageSystem", "hmc_user",
                 "target_user", "target_passwd", "ded_quantity_to_test",
                 "sleep_time", "iterations", "vir_quantity_to_test",
                 "cpu_quantity_to_test", "mem_quantity_to_test",
-                "mem_linux_machine"]
+                "mem_linux_machine", "hmc_standin"]
 
 
 IS_POWER_VM = 'pSeries' in open('/proc/cpuinfo', 'r').read()
@@ -205,9 +205,16 @@ class DlparTests(Test):
             self.data = self.params.get(i, default='')
             self.list_data.append(self.data)
 
-        # Get HMC IP
-        self.hmc_ip = wait.wait_for(
-            lambda: self.get_mcp_component("HMCIPAddr"), timeout=30)
+        # A canned HMC state replaces the HMC, see README.md
+        standin = self.params.get('hmc_standin', default='')
+        if standin:
+            self.list_data[list_payload.index('hmc_standin')] = \
+                self.get_data(standin) or standin
+            self.hmc_ip = 'standin'
+        else:
+            # Get HMC IP
+            self.hmc_ip = wait.wait_for(
+                lambda: self.get_mcp_component("HMCIPAddr"), timeout=30)
 
         # Primary lpar details
         self.pri_partition = self.get_partition_name("Partition Name")
@@ -21,8 +21,8 @@
 
 import os
 import re
+import sys
 import shutil
-import platform
 import time
 from avocado import Test
 from avocado.utils import build, distro, genio, dmesg
@@ -33,6 +33,10 @@ from avocado.utils.service import ServiceManager
 
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api.build_cache import BuildCache
+
 # Default cache directory for LTP compilation
 LTP_CACHE_BASE = "/var/cache/avocado/ltp"
 
@@ -50,64 +54,28 @@ class LTP(Test):
     failed_tests = list()
     mem_tests = ['-f mm', '-f hugetlb']
 
-    def _get_cache_dir(self):
+    def _get_cache(self, tarball):
         """
-        Get the cache directory path for LTP installation.
-        Uses architecture and LTP version to create unique cache paths.
+        Get the build cache entry of the LTP installation, keyed by the
+        LTP tarball, the runner, the compiler and the architecture.
+        :param tarball: LTP source tarball
         """
-        arch = platform.machine()
-        ltp_version = self.params.get('ltp_version', default='master')
         cache_base = self.params.get('ltp_cache_dir', default=LTP_CACHE_BASE)
-        cache_dir = os.path.join(cache_base, f"ltp-{ltp_version}-{arch}")
-        return cache_dir
+        runner = 'kirk' if self.use_kirk else 'runltp'
+        return BuildCache('ltp', [tarball], flags=runner, cache_dir=cache_base,
+                          enabled=self.enable_cache)
 
-    def _is_cache_valid(self, cache_dir):
+    def _is_cache_valid(self, cache):
         """
-        Check if the cached LTP installation is valid and not expired.
-        :param cache_dir: Path to the cached LTP installation
+        Check if the cached LTP installation is complete.
+        :param cache: build cache entry of the LTP installation
         :return: True if cache is valid, False otherwise
         """
-        marker_file = os.path.join(cache_dir, '.ltp_build_marker')
-        if not os.path.exists(marker_file):
-            return False
-        # Check if the installation is complete
-        ltpbin_dir = os.path.join(cache_dir, 'bin')
-        if not os.path.exists(ltpbin_dir):
+        if not cache.lookup():
             return False
         # Check runner existence based on use_kirk setting
-        if self.use_kirk:
-            runner_path = os.path.join(ltpbin_dir, 'kirk')
-        else:
-            runner_path = os.path.join(ltpbin_dir, 'runltp')
-        if not os.path.exists(runner_path):
-            return False
-        # Check cache age
-        cache_max_age_days = self.params.get('ltp_cache_max_age_days', default=7)
-        try:
-            with open(marker_file, 'r') as f:
-                timestamp = float(f.read().strip())
-            age_seconds = time.time() - timestamp
-            age_days = age_seconds / (24 * 3600)
-            if age_days > cache_max_age_days:
-                self.log.info(f"Cache is {age_days:.1f} days old, exceeds max age of {cache_max_age_days} days")
-                return False
-            self.log.info(f"Using cached LTP installation ({age_days:.1f} days old)")
-            return True
-        except (IOError, ValueError) as e:
-            self.log.warning(f"Failed to read cache marker: {e}")
-            return False
-
-    def _create_cache_marker(self, cache_dir):
-        """
-        Create a marker file with timestamp to track cache age.
-        :param cache_dir: Path to the cached LTP installation
-        """
-        marker_file = os.path.join(cache_dir, '.ltp_build_marker')
-        try:
-            with open(marker_file, 'w') as f:
-                f.write(str(time.time()))
-        except IOError as e:
-            self.log.warning(f"Failed to create cache marker: {e}")
+        runner = 'kirk' if self.use_kirk else 'runltp'
+        return os.path.exists(os.path.join(cache.path, 'bin', runner))
 
     @staticmethod
     def mount_point(mount_dir):
@@ -191,11 +159,22 @@ class LTP(Test):
             if not smg.check_installed(package) and not smg.install(package):
                 self.cancel('%s is needed for the test to be run' % package)
 
+        url = self.params.get(
+            'url', default='https://github.com/linux-test-project/ltp/archive/master.zip')
+        match = next((ext for ext in [".zip", ".tar"] if ext in url), None)
+        tarball = ''
+        if match:
+            tarball = self.fetch_asset(
+                "ltp-master%s" % match, locations=[url], expire='7d')
+        else:
+            self.cancel("Provided LTP Url is not valid")
+
         # Check if we can use cached compilation
-        cache_dir = self._get_cache_dir()
+        cache = self._get_cache(tarball)
+        cache_dir = cache.path
         use_cache = (self.enable_cache and
                      not self.force_rebuild and
-                     self._is_cache_valid(cache_dir))
+                     self._is_cache_valid(cache))
         if use_cache:
             self.log.info(f"Reusing cached LTP installation from {cache_dir}")
             self.ltpbin_dir = os.path.join(cache_dir, 'bin')
@@ -212,20 +191,12 @@ class LTP(Test):
             self.log.info(f"Building fresh LTP installation in cache: {cache_dir}")
             # Ensure cache directory exists
             os.makedirs(cache_dir, exist_ok=True)
+            cache.invalidate()
             self.ltpbin_dir = os.path.join(cache_dir, 'bin')
         else:
             self.ltpbin_dir = None
 
         dmesg.clear_dmesg()
-        url = self.params.get(
-            'url', default='https://github.com/linux-test-project/ltp/archive/master.zip')
-        match = next((ext for ext in [".zip", ".tar"] if ext in url), None)
-        tarball = ''
-        if match:
-            tarball = self.fetch_asset(
-                "ltp-master%s" % match, locations=[url], expire='7d')
-        else:
-            self.cancel("Provided LTP Url is not valid")
         if self.enable_cache:
             # Store source in cache directory
             self.ltpdir = os.path.join(cache_dir, 'src')
@@ -268,7 +239,7 @@ class LTP(Test):
         build.make(ltp_dir, extra_args='install')
         # Create cache marker after successful installation
         if self.enable_cache:
-            self._create_cache_marker(cache_dir)
+            cache.mark()
             self.log.info(f"LTP compiled and cached at {cache_dir}")
 
         # Verify the appropriate runner is installed
@@ -16,12 +16,19 @@
 # Author: Aneesh Kumar K.V <anesh.kumar@linux.vnet.ibm.com>
 #
 
+import hashlib
 import os
 import multiprocessing
+import sys
 from avocado import Test
 from avocado.utils import process, build, archive, distro, memory, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import stressng
+from misc_api.baseline import STORE_PATH
+
 
 class Stressng(Test):
 
@@ -30,6 +37,12 @@ class Stressng(Test):
     :param stressor: Which streess-ng stressor to run (default is "mmapfork")
     :param timeout: Timeout for each run (default 300)
     :param workers: How many workers to create for each run (default 0)
+    :param baseline: 'check' to compare the bogo-ops/s of every stressor
+                     with the baseline of the kernel and platform, saving
+                     one when there is none, 'update' to save the results
+                     as the new baseline, 'off' to only log them
+    :param tolerance: accepted bogo-ops/s drop against the baseline, in
+                      percent
     :source: git://kernel.ubuntu.com/cking/stress-ng.git
 
     :avocado: tags=cpu,memory,io,fs,privileged
@@ -54,6 +67,12 @@ class Stressng(Test):
         self.parallel = self.params.get('parallel', default=True)
         self.common_args = self.params.get('common_args', default='')
         self.iteration = self.params.get('iteration', default=1)
+        self.baseline = self.params.get('baseline', default='check')
+        self.tolerance = float(self.params.get('tolerance', default=10))
+        self.results_store = self.params.get('results_store',
+                                             default=STORE_PATH)
+        self.runs = 0
+        self.regressions = []
 
         deps = ['gcc', 'make']
         if detected_distro.name in ['Ubuntu', 'debian']:
@@ -89,6 +108,28 @@ class Stressng(Test):
         build.make(sourcedir, extra_args='install')
         dmesg.clear_dmesg()
 
+    def run_stressng(self, cmd):
+        """
+        Runs stress-ng and tracks the bogo-ops/s of its stressors
+
+        :param cmd: stress-ng command line
+        """
+        self.runs += 1
+        yaml_file = os.path.join(self.outputdir,
+                                 'stress-ng-%d.yaml' % self.runs)
+        # runs are compared with the runs of the same options
+        config = hashlib.sha1(' '.join(cmd.split()).encode()).hexdigest()[:8]
+        process.run('%s --yaml %s' % (cmd, yaml_file), ignore_status=True,
+                    sudo=True)
+        try:
+            results = stressng.load_metrics(yaml_file)
+        except ValueError as details:
+            self.log.warning("No stress-ng metrics: %s", details)
+            return
+        self.regressions.extend(stressng.check(
+            results, self.baseline, self.tolerance, config=config,
+            test=self.name, path=self.results_store))
+
     def test(self):
         args = []
         cmdline = ''
@@ -149,7 +190,7 @@ class Stressng(Test):
             args.append('--verify ')
         if self.syslog:
             args.append('--syslog ')
-        if self.metrics:
+        if self.metrics or self.baseline != 'off':
             args.append('--metrics ')
         if self.times:
             args.append('--times ')
@@ -160,7 +201,7 @@ class Stressng(Test):
             if self.ttimeout:
                 cmd += ' --timeout %s ' % self.ttimeout
             for _ in range(self.iteration):
-                process.run(cmd, ignore_status=True, sudo=True)
+                self.run_stressng(cmd)
         else:
             if self.ttimeout:
                 timeout = ' --timeout %s ' % self.ttimeout
@@ -170,8 +211,7 @@ class Stressng(Test):
                     stress_cmd = ' --%s %s %s %s ' % (stressor, self.workers, timeout,
                                                       stressor_params)
                     for _ in range(self.iteration):
-                        process.run("%s %s" % (cmd, stress_cmd),
-                                    ignore_status=True, sudo=True)
+                        self.run_stressng("%s %s" % (cmd, stress_cmd))
             if self.ttimeout and self.v_stressors:
                 timeout = ' --timeout %s ' % str(
                     int(self.ttimeout) + int(memory.meminfo.MemTotal.g))
@@ -181,13 +221,18 @@ class Stressng(Test):
                     stress_cmd = ' --%s %s %s %s ' % (stressor, self.workers, timeout,
                                                       stressor_params)
                     for _ in range(self.iteration):
-                        process.run("%s %s" % (cmd, stress_cmd),
-                                    ignore_status=True, sudo=True)
+                        self.run_stressng("%s %s" % (cmd, stress_cmd))
         error = dmesg.collect_errors_dmesg(['WARNING: CPU:', 'Oops',
                                             'Segfault', 'soft lockup',
                                             'Unable to handle', 'ard LOCKUP'])
         if len(error):
             self.fail("Test failed with errors %s in dmesg" % error)
+        if self.regressions:
+            self.fail("%d stress-ng throughput metrics regressed beyond %s%% "
+                      "of the baseline: %s" % (
+                          len(self.regressions), self.tolerance,
+                          ", ".join(sorted(set(reg['stressor'] for reg in
+                                               self.regressions)))))
 
     def tearDown(self):
         if hasattr(self, 'loop_dev') and os.path.exists(self.loop_dev):
@@ -20,6 +20,7 @@
 
 
 import os
+import sys
 import multiprocessing
 
 from avocado import Test
@@ -30,6 +31,10 @@ from avocado.utils import memory
 from avocado.utils import process
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api.build_cache import BuildCache
+
 
 class Stress(Test):
 
@@ -58,6 +63,15 @@ class Stress(Test):
         stress_version = os.path.basename(tarball.split('.tar.')[0])
         self.sourcedir = os.path.join(self.workdir, stress_version)
         os.chdir(self.sourcedir)
+        cache = BuildCache('stress', [tarball],
+                           enabled=self.params.get('build_cache',
+                                                   default=True))
+        cache.build(self.sourcedir, self.build_stress)
+
+    def build_stress(self):
+        """
+        Configure and build 'stress' in the source directory.
+        """
         process.run('./configure')
         build.make(self.sourcedir)
 
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Chunk scheduler of disktest.
+
+disktest checks one file, a chunk, per process. The space of the targets,
+mountpoints of one or several disks, is cut into chunks sized so that the
+chunks written at the same time do not fit in the free memory, and their
+verification reads the disk rather than the page cache, and
+:class:`ChunkScheduler` keeps a number of disktest processes running on
+them, one chunk after another, spread over the targets. Their output is
+read as it comes, logged, and scanned for the signature check failures to
+report the first corrupted offset of every chunk along with its
+throughput.
+"""
+
+import math
+import os
+import re
+import selectors
+import subprocess
+import time
+
+__all__ = ['SECTOR_SIZE', 'chunk_size', 'target_space_mb', 'plan',
+           'parse_line', 'ChunkScheduler']
+
+SECTOR_SIZE = 512
+BLOCK_SIZE = 4096
+# share of the free space of a target the chunks use
+SPACE_USAGE = 0.95
+# corruption lines of a chunk copied to the test log, all go to its log
+LOGGED_ERRORS = 10
+
+SECTOR_ERROR = re.compile(r'^\d+: Block \d+ \(from \d+ to \d+\) sector '
+                          r'([0-9a-f]+) ')
+READ_ERROR = re.compile(r'^\d+: read failed: block (\d+) ')
+WROTE = re.compile(r'^\d+: Wrote (\d+) MB to \S+ \((\d+) seconds\)')
+
+
+def target_space_mb(target):
+    """Return the space of target disktest may use, in MB."""
+    stat = os.statvfs(target)
+    return int(stat.f_bavail * stat.f_frsize * SPACE_USAGE) // (1024 * 1024)
+
+
+def chunk_size(space_mb, memory_mb, jobs):
+    """Return the size of the chunks in MB.
+
+    :param space_mb: space of all the targets
+    :param memory_mb: free memory, the chunks written at the same time are
+                      together at least as big so that they can not all
+                      stay in the page cache
+    :param jobs: number of chunks checked at the same time
+    """
+    size = math.ceil(memory_mb / float(jobs))
+    # every job gets at least one chunk
+    return max(min(size, space_mb // jobs), 1)
+
+
+def plan(targets, chunk_mb):
+    """Cut the targets in chunks.
+
+    :param targets: dict of target directory to its space in MB
+    :return: list of (target, index) of the chunks, taking the targets in
+             turn so that the chunks checked at the same time are spread
+             over all of them
+    """
+    per_target = [[(target, index) for index in range(space // chunk_mb)]
+                  for target, space in sorted(targets.items())]
+    chunks = []
+    for row in range(max([len(column) for column in per_target] or [0])):
+        chunks.extend(column[row] for column in per_target
+                      if row < len(column))
+    return chunks
+
+
+def parse_line(line):
+    """Parse one line of disktest output.
+
+    :return: ('corruption', offset in bytes in the chunk), ('wrote',
+             seconds) or (None, None)
+    """
+    match = SECTOR_ERROR.match(line)
+    if match:
+        return 'corruption', int(match.group(1), 16) * SECTOR_SIZE
+    match = READ_ERROR.match(line)
+    if match:
+        return 'corruption', int(match.group(1)) * BLOCK_SIZE
+    match = WROTE.match(line)
+    if match:
+        return 'wrote', int(match.group(2))
+    return None, None
+
+
+class ChunkScheduler:
+    """Run disktest on chunks, a number of them at the same time.
+
+    :param binary: disktest binary
+    :param chunks: list of (target, index) of the chunks, see :func:`plan`
+    :param chunk_mb: size of the chunks
+    :param jobs: number of chunks checked at the same time
+    :param log: test log
+    :param log_path: file all the disktest output is appended to
+    :param args: disktest options besides the size and the file
+    """
+
+    def __init__(self, binary, chunks, chunk_mb, jobs, log, log_path,
+                 args='-i -S'):
+        self.binary = binary
+        self.pending = list(chunks)
+        self.chunk_mb = chunk_mb
+        self.jobs = jobs
+        self.log = log
+        self.log_path = log_path
+        self.args = args.split()
+        self.results = []
+        # last partial line read of every process, by pid
+        self.partial = {}
+
+    def _start(self, selector, target, index):
+        path = os.path.join(target, 'testfile.%d' % index)
+        cmd = [self.binary, '-m', str(self.chunk_mb), '-f', path] + self.args
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        self.partial[proc.pid] = b''
+        result = {'target': target, 'chunk': index, 'file': path,
+                  'mb': self.chunk_mb, 'pid': proc.pid,
+                  'start': time.monotonic(), 'status': None,
+                  'seconds': None, 'mb_s': None, 'write_seconds': None,
+                  'corruptions': 0, 'first_corruption': None}
+        self.log.debug("Testing chunk %s of %s (pid %s)", index, target,
+                       proc.pid)
+        selector.register(proc.stdout, selectors.EVENT_READ, (proc, result))
+
+    def _line(self, result, line, log_file):
+        log_file.write(line)
+        kind, value = parse_line(line)
+        if kind == 'wrote':
+            result['write_seconds'] = value
+        elif kind == 'corruption':
+            result['corruptions'] += 1
+            if result['first_corruption'] is None or \
+                    value < result['first_corruption']:
+                result['first_corruption'] = value
+            if result['corruptions'] <= LOGGED_ERRORS:
+                self.log.error("%s: %s", result['file'], line.rstrip())
+        else:
+            self.log.debug("%s: %s", result['file'], line.rstrip())
+
+    def _finish(self, proc, result):
+        result['status'] = proc.wait()
+        seconds = time.monotonic() - result.pop('start')
+        result['seconds'] = round(seconds, 2)
+        if seconds:
+            result['mb_s'] = round(result['mb'] / seconds, 2)
+        self.log.info("Chunk %s of %s: status %s, %s MB in %.1fs, %s "
+                      "corruption(s)", result['chunk'], result['target'],
+                      result['status'], result['mb'], seconds,
+                      result['corruptions'])
+        self.results.append(result)
+
+    def run(self):
+        """Check all the chunks.
+
+        :return: list of the chunk results, with the 'target', 'chunk'
+                 index, 'file', 'mb', disktest 'pid' and exit 'status',
+                 the 'seconds' and 'mb_s' of the whole check, the
+                 'write_seconds' of the initialization, the number of
+                 'corruptions' lines and the 'first_corruption' offset in
+                 the chunk
+        """
+        selector = selectors.DefaultSelector()
+        running = 0
+        with open(self.log_path, 'a') as log_file:
+            while self.pending or running:
+                while self.pending and running < self.jobs:
+                    self._start(selector, *self.pending.pop(0))
+                    running += 1
+                for key, _ in selector.select():
+                    proc, result = key.data
+                    data = os.read(key.fileobj.fileno(), 65536)
+                    lines = (self.partial[proc.pid] + data).split(b'\n')
+                    self.partial[proc.pid] = lines.pop() if data else b''
+                    for line in lines:
+                        if line:
+                            self._line(result, line.decode(
+                                errors='replace') + '\n', log_file)
+                    if data:
+                        continue
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+                    self._finish(proc, result)
+                    running -= 1
+        selector.close()
+        return self.results
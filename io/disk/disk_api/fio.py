@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+fio JSON results.
+
+Parses the ``--output-format=json+`` output of fio into, for every job and
+data direction, the bandwidth, IOPS, completion and submission latency
+percentiles and the latency histograms, and flattens them into the
+metrics compared against a baseline.
+
+The clones of a job run with ``numjobs`` and without ``group_reporting``
+are merged: their bandwidth and IOPS add up, their histograms are summed
+and the worst of their percentiles is kept.
+
+Sweeps characterize a device over a matrix of block size, queue depth,
+job count and read/write mix: every cell is a job generated by
+:func:`cell_job`, which fio stops as soon as its IOPS or bandwidth reach
+a steady state instead of after a fixed runtime, and :func:`knee` picks
+the best IOPS within a p99 latency budget and the smallest queue depth
+reaching nearly as much, the knee of the curve.
+"""
+
+import itertools
+import json
+
+__all__ = ['DIRECTIONS', 'LOWER_IS_BETTER', 'load_output', 'summarize',
+           'metrics', 'sweep_cells', 'cell_name', 'cell_job', 'cell_result',
+           'knee']
+
+DIRECTIONS = ('read', 'write', 'trim')
+PERCENTILES = {'50.000000': 'p50', '90.000000': 'p90', '99.000000': 'p99',
+               '99.900000': 'p99.9'}
+# suffixes of the metrics for which lower is better
+LOWER_IS_BETTER = ('_us',)
+# share of the best IOPS of a sweep group the knee reaches
+KNEE_RATIO = 0.95
+
+
+def load_output(path):
+    """Return the fio JSON output of path.
+
+    fio prints its warnings on the same output, before the JSON.
+    """
+    with open(path) as output_file:
+        text = output_file.read()
+    start = text.find('{')
+    if start < 0:
+        raise ValueError('no JSON in fio output %s' % path)
+    return json.loads(text[start:])
+
+
+def _latency(stats, name):
+    """Return the name latency stats of a direction, in microseconds.
+
+    fio 3 reports them in nanoseconds as name_ns, older versions in
+    microseconds as name.
+    """
+    if '%s_ns' % name in stats:
+        lat, scale = stats['%s_ns' % name], 1000.0
+    elif name in stats:
+        lat, scale = stats[name], 1.0
+    else:
+        return None, {}
+    summary = {'mean': round(lat.get('mean', 0) / scale, 2),
+               'max': round(lat.get('max', 0) / scale, 2)}
+    for pct, label in PERCENTILES.items():
+        if pct in lat.get('percentile', {}):
+            summary[label] = round(lat['percentile'][pct] / scale, 2)
+    # json+ bins of every latency seen, summed in power of two buckets
+    hist = {}
+    for value, count in lat.get('bins', {}).items():
+        bucket = 1
+        while bucket < float(value) / scale:
+            bucket <<= 1
+        hist[bucket] = hist.get(bucket, 0) + count
+    return summary, hist
+
+
+def _merge(total, stats):
+    """Merge the stats of a job clone into total."""
+    ios = total['total_ios'] + stats['total_ios']
+    for name in ('bw_kib', 'iops', 'io_bytes', 'total_ios'):
+        total[name] += stats[name]
+    for name in ('clat_us', 'slat_us', 'lat_us'):
+        mine, theirs = total[name], stats[name]
+        for label, value in theirs.items():
+            if label == 'mean':
+                mine['mean'] = round((mine.get('mean', 0) *
+                                      (ios - stats['total_ios']) +
+                                      value * stats['total_ios']) /
+                                     ios, 2) if ios else 0
+            else:
+                mine[label] = max(mine.get(label, 0), value)
+    for bucket, count in stats['clat_hist_us'].items():
+        total['clat_hist_us'][bucket] = \
+            total['clat_hist_us'].get(bucket, 0) + count
+
+
+def summarize(output):
+    """Summarize the jobs of a fio JSON output.
+
+    :return: dict of job name to dict of direction to its 'bw_kib',
+             'iops', 'io_bytes', 'clat_us', 'slat_us' and 'lat_us'
+             percentiles and 'clat_hist_us' histogram, plus the job
+             'latency_buckets' of fio, its number of 'clones', its
+             'runtime_ms' and, with a steady state criterion, whether it
+             was reached as 'steady'
+    """
+    jobs = {}
+    for job in output.get('jobs', []):
+        name = job.get('jobname', 'job')
+        summary = jobs.setdefault(name, {'latency_buckets': {},
+                                         'clones': 0, 'runtime_ms': 0})
+        summary['clones'] += 1
+        runtime = job.get('job_runtime') or max(
+            job.get(direction, {}).get('runtime', 0)
+            for direction in DIRECTIONS)
+        summary['runtime_ms'] = max(summary['runtime_ms'], runtime)
+        if 'steadystate' in job:
+            summary['steady'] = bool(job['steadystate'].get('attained'))
+        for unit in ('ns', 'us', 'ms'):
+            buckets = summary['latency_buckets'].setdefault(unit, {})
+            for bucket, pct in job.get('latency_%s' % unit, {}).items():
+                buckets[bucket] = buckets.get(bucket, 0) + pct
+        for direction in DIRECTIONS:
+            stats = job.get(direction)
+            if not stats or not stats.get('io_bytes'):
+                continue
+            clat, hist = _latency(stats, 'clat')
+            slat, _ = _latency(stats, 'slat')
+            lat, _ = _latency(stats, 'lat')
+            current = {'bw_kib': stats.get('bw', 0),
+                       'iops': round(stats.get('iops', 0), 2),
+                       'io_bytes': stats['io_bytes'],
+                       'total_ios': stats.get('total_ios', 0),
+                       'clat_us': clat or {}, 'slat_us': slat or {},
+                       'lat_us': lat or {}, 'clat_hist_us': hist}
+            if direction in summary:
+                _merge(summary[direction], current)
+            else:
+                summary[direction] = current
+    for summary in jobs.values():
+        # percentages of the IOs, averaged over the clones
+        for buckets in summary['latency_buckets'].values():
+            for bucket, pct in buckets.items():
+                buckets[bucket] = round(pct / summary['clones'], 2)
+    return jobs
+
+
+def metrics(jobs):
+    """Return the compared metrics of summarized jobs.
+
+    :return: flat dict like {'file1.read.bw_kib': 1234,
+             'file1.read.iops': 308.5, 'file1.read.clat_p99_us': 86.0}
+    """
+    flat = {}
+    for name, job in jobs.items():
+        for direction in DIRECTIONS:
+            stats = job.get(direction)
+            if not stats:
+                continue
+            prefix = '%s.%s.' % (name, direction)
+            flat[prefix + 'bw_kib'] = stats['bw_kib']
+            flat[prefix + 'iops'] = stats['iops']
+            if 'p99' in stats['clat_us']:
+                flat[prefix + 'clat_p99_us'] = stats['clat_us']['p99']
+    return flat
+
+
+def sweep_cells(rws, block_sizes, iodepths, numjobs):
+    """Return the cells of a sweep matrix.
+
+    :param rws: fio rw modes, a mix is given as 'randrw:70' for 70% reads
+    :param block_sizes: fio block sizes like '4k'
+    :param iodepths: queue depths
+    :param numjobs: job counts
+    :return: list of dicts with the 'rw', 'rwmixread', 'bs', 'iodepth'
+             and 'numjobs' of every cell
+    """
+    cells = []
+    for rw_mix, bs, depth, jobs in itertools.product(rws, block_sizes,
+                                                     iodepths, numjobs):
+        mode, _, mix = str(rw_mix).partition(':')
+        cells.append({'rw': mode, 'rwmixread': int(mix) if mix else None,
+                      'bs': str(bs), 'iodepth': int(depth),
+                      'numjobs': int(jobs)})
+    return cells
+
+
+def _workload(cell):
+    if cell['rwmixread'] is None:
+        return cell['rw']
+    return '%s%d' % (cell['rw'], cell['rwmixread'])
+
+
+def cell_name(cell):
+    """Return a name like 'randrw70-4k-qd16-j4' for a sweep cell."""
+    return '%s-%s-qd%d-j%d' % (_workload(cell), cell['bs'], cell['iodepth'],
+                               cell['numjobs'])
+
+
+def cell_job(cell, options):
+    """Return the fio job file of a sweep cell.
+
+    :param options: dict of the global fio options, like the ioengine,
+                    the size, the runtime limit and the steadystate
+                    criterion
+    """
+    lines = ['[global]']
+    lines += ['%s=%s' % (name, value) for name, value in
+              sorted(options.items()) if value not in (None, '')]
+    # one report per cell, the steady state is detected on the group
+    lines += ['group_reporting=1', '', '[%s]' % cell_name(cell),
+              'rw=%s' % cell['rw'], 'bs=%s' % cell['bs'],
+              'iodepth=%d' % cell['iodepth'],
+              'numjobs=%d' % cell['numjobs']]
+    if cell['rwmixread'] is not None:
+        lines.append('rwmixread=%d' % cell['rwmixread'])
+    return '\n'.join(lines) + '\n'
+
+
+def cell_result(cell, jobs):
+    """Return the totals of a sweep cell from its summarized jobs.
+
+    :return: the cell with its total 'iops' and 'bw_kib', the worst
+             'clat_p99_us' of its directions, its 'runtime_ms' and
+             'steady' state
+    """
+    result = dict(cell, name=cell_name(cell), iops=0, bw_kib=0,
+                  clat_p99_us=None, runtime_ms=0, steady=None)
+    for job in jobs.values():
+        result['runtime_ms'] = max(result['runtime_ms'], job['runtime_ms'])
+        if 'steady' in job:
+            result['steady'] = job['steady']
+        for direction in DIRECTIONS:
+            stats = job.get(direction)
+            if not stats:
+                continue
+            result['iops'] = round(result['iops'] + stats['iops'], 2)
+            result['bw_kib'] += stats['bw_kib']
+            p99 = stats['clat_us'].get('p99')
+            if p99 is not None:
+                result['clat_p99_us'] = max(result['clat_p99_us'] or 0, p99)
+    return result
+
+
+def knee(results, max_p99=None):
+    """Summarize a sweep by workload and block size.
+
+    :param results: cell results, from :func:`cell_result`
+    :param max_p99: p99 completion latency budget in microseconds, cells
+                    above it are not candidates, no budget when None
+    :return: dict of 'workload bs' to the 'best' cell, the most IOPS
+             within the budget, the 'knee' cell, the smallest queue depth
+             reaching :data:`KNEE_RATIO` of the best IOPS, and the number
+             of 'cells' and of cells 'within_p99'
+    """
+    groups = {}
+    for result in results:
+        groups.setdefault('%s %s' % (_workload(result), result['bs']),
+                          []).append(result)
+    summary = {}
+    for group, cells in sorted(groups.items()):
+        cells.sort(key=lambda cell: (cell['iodepth'] * cell['numjobs'],
+                                     cell['numjobs']))
+        within = [cell for cell in cells if max_p99 is None or
+                  (cell['clat_p99_us'] is not None and
+                   cell['clat_p99_us'] <= max_p99)]
+        best = max(within, key=lambda cell: cell['iops']) if within else None
+        knee_cell = None
+        if best:
+            knee_cell = next(cell for cell in within
+                             if cell['iops'] >= KNEE_RATIO * best['iops'])
+        summary[group] = {'best': best, 'knee': knee_cell,
+                          'cells': len(cells), 'within_p99': len(within)}
+    return summary
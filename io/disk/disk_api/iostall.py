@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+I/O stall meter of the path failover tests.
+
+:class:`IoProbe` keeps issuing small timestamped O_DIRECT reads, and
+optionally writes back what it read, to a device from a thread while a
+test fails and reinstates its paths. :meth:`IoProbe.window` reports what
+the applications saw between two instants: the longest time without any
+I/O completing, the I/O errors, and how long after an event the I/O was
+flowing again.
+
+Usage::
+
+    probe = IoProbe('/dev/mapper/mpatha')
+    probe.start()
+    since = probe.mark()
+    multipath.fail_path('sdb')
+    probe.wait_io(time.monotonic())
+    self.log.info(probe.window(since))
+    probe.stop()
+"""
+
+import mmap
+import os
+import threading
+import time
+
+__all__ = ['IoProbe']
+
+
+class IoProbe(threading.Thread):
+    """Background O_DIRECT I/O on a device, timestamped.
+
+    :param device: block device, like /dev/mapper/mpatha
+    :param block_size: size of every I/O, a multiple of the logical block
+                       size of the device
+    :param span_mb: the I/Os go round the first span_mb of the device
+    :param write: write back every block read, the data is preserved but
+                  the device must not be in use
+    :param interval: pause between two I/Os in seconds
+    """
+
+    def __init__(self, device, block_size=4096, span_mb=1024, write=False,
+                 interval=0.01):
+        super().__init__(name='io-probe %s' % device, daemon=True)
+        self.device = device
+        self.block_size = block_size
+        self.span_mb = span_mb
+        self.write = write
+        self.interval = interval
+        self.error = None
+        # (start, end, error) of every I/O, monotonic seconds
+        self.ios = []
+        self.done = threading.Condition()
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def mark():
+        """Return the current instant, to start a window at."""
+        return time.monotonic()
+
+    def _io(self, fd, buf, offset):
+        os.preadv(fd, [buf], offset)
+        if self.write:
+            os.pwritev(fd, [buf], offset)
+
+    def run(self):
+        flags = (os.O_RDWR if self.write else os.O_RDONLY) | os.O_DIRECT
+        try:
+            fd = os.open(self.device, flags)
+        except OSError as details:
+            self.error = str(details)
+            return
+        # O_DIRECT needs an aligned buffer, mmap gives a page aligned one
+        buf = mmap.mmap(-1, self.block_size)
+        try:
+            size = os.lseek(fd, 0, os.SEEK_END)
+            blocks = max(min(size, self.span_mb * 1024 * 1024) //
+                         self.block_size, 1)
+            count = 0
+            while not self.stopped.is_set():
+                offset = (count % blocks) * self.block_size
+                count += 1
+                start = time.monotonic()
+                error = None
+                try:
+                    self._io(fd, buf, offset)
+                except OSError as details:
+                    error = details.strerror or str(details)
+                with self.done:
+                    self.ios.append((start, time.monotonic(), error))
+                    self.done.notify_all()
+                self.stopped.wait(self.interval)
+        finally:
+            buf.close()
+            os.close(fd)
+
+    def stop(self, timeout=60):
+        """Stop the I/Os.
+
+        :return: False when an I/O is still hung after timeout
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join(timeout)
+        return not self.is_alive()
+
+    def wait_io(self, since, timeout=60):
+        """Wait for an I/O started after since to complete without error.
+
+        :return: True when one did within timeout
+        """
+        end = time.monotonic() + timeout
+        with self.done:
+            while True:
+                if any(start >= since and not error
+                       for start, _, error in reversed(self.ios[-100:])):
+                    return True
+                left = end - time.monotonic()
+                if left <= 0 or not self.is_alive():
+                    return False
+                self.done.wait(left)
+
+    def window(self, since, until=None):
+        """Summarize the I/Os between two instants.
+
+        :param since: start of the window, usually the instant of the
+                      path event
+        :param until: end of the window, now by default
+        :return: dict with the number of 'ios' and 'errors' completed in
+                 the window, the 'max_stall' in seconds, the longest time
+                 without a successful I/O completing, the 'recovery' in
+                 seconds, from since to the first successful I/O after the
+                 last error or the longest stall, None when the I/O did not
+                 recover, and the 'error_messages'
+        """
+        until = time.monotonic() if until is None else until
+        with self.done:
+            ios = [io for io in self.ios if since <= io[1] <= until]
+        oks = [end for _, end, error in ios if not error]
+        errors = [(end, error) for _, end, error in ios if error]
+        stall, stall_end, previous = 0.0, None, since
+        for end in oks:
+            if end - previous > stall:
+                stall, stall_end = end - previous, end
+            previous = end
+        recovery = None
+        if errors:
+            last_error = errors[-1][0]
+            recovery = next((end - since for end in oks if end > last_error),
+                            None)
+        elif stall_end is not None:
+            recovery = stall_end - since
+        # no I/O completing at the end, hung or failing, stalls too
+        stall = max(stall, until - previous)
+        return {'ios': len(ios), 'errors': len(errors),
+                'max_stall': round(stall, 3),
+                'recovery': None if recovery is None else round(recovery, 3),
+                'error_messages': sorted(set(error for _, error in errors))}
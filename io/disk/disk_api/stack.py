@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Storage stack provisioner of the disk tests.
+
+A stack is described by its layers: the disks, an optional md raid on
+them, an optional LVM logical volume on top, and an optional filesystem
+mounted with its options. :class:`StorageStack` builds it, tears it down
+and waits for udev to settle after every layer change instead of sleeping
+and polling.
+
+Consecutive tests on the same stack do not need to rebuild it: with
+``reuse`` the stack is left built when a test ends, its description and
+the identity of its disks are saved with a signature, and the next test
+asking for the same stack finds it and checks it is still in place
+instead of wiping the disks and building it again. Asking for another
+stack tears down the saved one first. The mountpoint is not part of the
+signature: a kept filesystem is unmounted when its test ends, the tests
+mounting it in their own work directories, and the next test mounts it
+on its own mountpoint.
+
+Building a stack never discards the blocks of the disks: a benchmark
+reading unmapped blocks right after a discard would report inflated
+numbers. With ``discard`` the disks are discarded when a test releases a
+stack it does not keep.
+
+Usage::
+
+    stack = StorageStack(self.disk, self.dir, raid_level='0', lv=True,
+                         fs='ext4', reuse=True)
+    self.target = stack.build()
+    ...
+    self.err_mesg.extend(stack.release())
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from avocado.utils import disk
+from avocado.utils import lv_utils
+from avocado.utils import process
+from avocado.utils import softwareraid
+from avocado.utils.partition import Partition, PartitionError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from misc_api import sysfs
+
+__all__ = ['RAID_NAME', 'VG_NAME', 'LV_NAME', 'STATE_FILE', 'StackError',
+           'udev_settle', 'wipe', 'StorageStack']
+
+LOG = logging.getLogger('avocado.test')
+
+RAID_NAME = '/dev/md/sraid'
+VG_NAME = 'avocado_vg'
+LV_NAME = 'avocado_lv'
+STATE_FILE = '/var/cache/avocado/storage_stack.json'
+SETTLE_TIMEOUT = 60
+
+
+class StackError(Exception):
+    """A layer of the stack could not be built."""
+
+
+def udev_settle(timeout=SETTLE_TIMEOUT):
+    """Wait for udev to process the events of the last device changes."""
+    process.system('udevadm settle --timeout=%d' % timeout,
+                   ignore_status=True, shell=True)
+
+
+def _sys_block(device):
+    return '/sys/class/block/%s' % os.path.basename(os.path.realpath(device))
+
+
+def _wipe_one(device, discard):
+    """Wipe the signatures of device and discard its blocks when it can."""
+    if process.system('wipefs -af %s' % device, ignore_status=True,
+                      shell=True):
+        return 'failed to wipe %s' % device
+    if discard and int(sysfs.read(os.path.join(
+            _sys_block(device), 'queue', 'discard_max_bytes'),
+            default='0') or 0):
+        # forgetting the old data also drops what the device would have
+        # to garbage collect during the test
+        process.system('blkdiscard %s' % device, ignore_status=True,
+                       shell=True)
+    return None
+
+
+def wipe(devices, discard=True):
+    """Wipe devices in parallel.
+
+    :param discard: also discard the blocks of the devices supporting it
+    :return: list of the errors
+    """
+    with ThreadPoolExecutor(max_workers=max(len(devices), 1)) as pool:
+        errors = list(pool.map(lambda device: _wipe_one(device, discard),
+                               devices))
+    udev_settle()
+    return [error for error in errors if error]
+
+
+class StorageStack:
+    """Disks, md raid, logical volume and filesystem of a disk test.
+
+    :param disks: disk paths, a list or a space separated string
+    :param mountpoint: directory the filesystem is mounted on
+    :param raid_level: md raid level, no raid when empty
+    :param lv: create a logical volume on the disks or the raid
+    :param fs: filesystem type, no filesystem when empty
+    :param fs_args: mkfs arguments
+    :param mnt_args: mount arguments
+    :param reuse: keep the stack built for the next test asking for the
+                  same one, and use the one the previous test kept
+    :param discard: discard the blocks of the disks when the test releases
+                    the stack, never when building it
+    :param state_file: where a kept stack is described
+    """
+
+    def __init__(self, disks, mountpoint=None, raid_level=None, lv=False,
+                 fs='', fs_args='', mnt_args='', reuse=False, discard=False,
+                 state_file=STATE_FILE):
+        self.disks = disks.split() if isinstance(disks, str) else list(disks)
+        self.mountpoint = mountpoint
+        self.raid_level = str(raid_level) if raid_level else None
+        self.lv = bool(lv)
+        self.fs = fs or ''
+        self.fs_args = fs_args or ''
+        self.mnt_args = mnt_args or ''
+        self.reuse = reuse
+        self.discard = discard
+        self.state_file = state_file
+        self.target = self.disks[0] if self.disks else None
+        self.reused = False
+        self.built = False
+
+    def spec(self):
+        """Return the description of the stack."""
+        return {'disks': self.disks, 'mountpoint': self.mountpoint,
+                'raid_level': self.raid_level, 'lv': self.lv, 'fs': self.fs,
+                'fs_args': self.fs_args, 'mnt_args': self.mnt_args}
+
+    @staticmethod
+    def _identity(device):
+        """Return what tells a disk from another one behind the same path."""
+        path = _sys_block(device)
+        return {'device': os.path.realpath(device),
+                'size': sysfs.read(os.path.join(path, 'size')),
+                'serial': sysfs.read(os.path.join(path, 'device', 'wwid')) or
+                sysfs.read(os.path.join(path, 'device', 'serial'))}
+
+    def signature(self):
+        """Return the signature of the stack and of its disks, whatever
+        its mountpoint."""
+        spec = self.spec()
+        del spec['mountpoint']
+        text = json.dumps([spec] + [self._identity(device)
+                                    for device in self.disks],
+                          sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as state:
+                return json.load(state)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, 'w') as state:
+            json.dump({'signature': self.signature(), 'spec': self.spec(),
+                       'target': self.target}, state, indent=2)
+
+    def _in_place(self, target):
+        """Check the layers of a kept stack are still there."""
+        if self.raid_level and not os.path.exists(RAID_NAME):
+            return False
+        if self.lv and not lv_utils.lv_check(VG_NAME, LV_NAME):
+            return False
+        return os.path.exists(target)
+
+    def _remount(self, target):
+        """Mount the filesystem of a kept stack on the mountpoint.
+
+        :return: False when it can not be mounted
+        """
+        # a test which could not release the stack left it mounted on its
+        # own mountpoint
+        if disk.is_disk_mounted(target):
+            process.system('umount %s' % target, ignore_status=True,
+                           shell=True)
+        try:
+            Partition(target, mountpoint=self.mountpoint).mount(
+                args=self.mnt_args)
+        except PartitionError as details:
+            LOG.warning('mounting the kept %s on %s failed: %s', target,
+                        self.mountpoint, details)
+            return False
+        return True
+
+    def build(self):
+        """Build the stack, or take over the one kept for it.
+
+        :return: the top device of the stack
+        :raise StackError: when a layer can not be built
+        """
+        state = self._load_state()
+        if state and self.reuse and state['signature'] == self.signature() \
+                and self._in_place(state['target']) \
+                and (not self.fs or self._remount(state['target'])):
+            LOG.info('Reusing the storage stack %s on %s', state['signature'],
+                     ' '.join(self.disks))
+            self.target = state['target']
+            self.reused = self.built = True
+            self._save_state()
+            return self.target
+        if state:
+            LOG.info('Tearing down the storage stack kept on %s',
+                     ' '.join(state['spec']['disks']))
+            kept = StorageStack(state_file=self.state_file,
+                                **state['spec'])
+            for error in kept.teardown(discard=False):
+                LOG.warning(error)
+        # leftovers of a test which could not clean up
+        errors = self.teardown(discard=False)
+        if errors:
+            raise StackError('; '.join(errors))
+        self.target = self.disks[0]
+        if self.raid_level:
+            LOG.info('Creating md raid %s on %s', self.raid_level,
+                     ' '.join(self.disks))
+            softwareraid.SoftwareRaid(RAID_NAME, self.raid_level, self.disks,
+                                      '1.2').create()
+            udev_settle()
+            if not os.path.exists(RAID_NAME):
+                raise StackError('failed to create raid %s' % RAID_NAME)
+            self.target = RAID_NAME
+        if self.lv:
+            LOG.info('Creating logical volume on %s', self.target)
+            lv_size = lv_utils.get_device_total_space(self.target) / 2330168
+            lv_utils.vg_create(VG_NAME, self.target, force=True)
+            lv_utils.lv_create(VG_NAME, LV_NAME, lv_size)
+            udev_settle()
+            self.target = '/dev/%s/%s' % (VG_NAME, LV_NAME)
+        if self.fs:
+            LOG.info('Creating %s on %s', self.fs, self.target)
+            part = Partition(self.target, mountpoint=self.mountpoint)
+            part.mkfs(self.fs, args=self.fs_args)
+            try:
+                part.mount(args=self.mnt_args)
+            except PartitionError as details:
+                raise StackError('mounting %s on %s failed: %s'
+                                 % (self.target, self.mountpoint, details))
+        self.built = True
+        if self.reuse:
+            self._save_state()
+        return self.target
+
+    def release(self):
+        """End the use of the stack by a test.
+
+        A reusable stack is kept for the next test, unmounted as the
+        mountpoint of the test may go away with it, others are torn down.
+
+        :return: list of the teardown errors
+        """
+        if self.reuse and self.built:
+            LOG.info('Keeping the storage stack on %s for the next test',
+                     ' '.join(self.disks))
+            if self.fs and self.mountpoint and \
+                    disk.is_dir_mounted(self.mountpoint):
+                process.system('umount %s' % self.mountpoint,
+                               ignore_status=True, shell=True)
+                if disk.is_dir_mounted(self.mountpoint):
+                    return ['failed to unmount %s' % self.mountpoint]
+            return []
+        return self.teardown()
+
+    def teardown(self, discard=None):
+        """Unmount, remove the logical volume and the raid, wipe the disks.
+
+        Every layer is looked for, whether this stack built it or not.
+
+        :param discard: discard the blocks of the disks, the discard of the
+                        stack when None
+
+        :return: list of the errors
+        """
+        errors = []
+        devices = ['/dev/%s/%s' % (VG_NAME, LV_NAME), RAID_NAME] + self.disks
+        if self.mountpoint and disk.is_dir_mounted(self.mountpoint):
+            process.system('umount %s' % self.mountpoint, ignore_status=True,
+                           shell=True)
+        for device in devices:
+            if os.path.exists(device) and disk.is_disk_mounted(device):
+                process.system('umount %s' % device, ignore_status=True,
+                               shell=True)
+        udev_settle()
+        for device in devices:
+            if os.path.exists(device) and disk.is_disk_mounted(device):
+                errors.append('failed to unmount %s' % device)
+        if errors:
+            return errors
+        # without LVM installed there is no volume group to look for
+        if shutil.which('lvm'):
+            if lv_utils.lv_check(VG_NAME, LV_NAME):
+                lv_utils.lv_remove(VG_NAME, LV_NAME)
+            if lv_utils.vg_check(VG_NAME):
+                lv_utils.vg_remove(VG_NAME)
+            udev_settle()
+            if lv_utils.vg_check(VG_NAME):
+                errors.append('failed to remove vg %s' % VG_NAME)
+        raid = softwareraid.SoftwareRaid(RAID_NAME, self.raid_level or '0',
+                                         self.disks, '1.2')
+        # the wipe of the disks below erases the superblock of a stopped one
+        if os.path.exists(RAID_NAME):
+            # the LVM label left on the raid would come back with it
+            process.system('wipefs -af %s' % RAID_NAME, ignore_status=True,
+                           shell=True)
+            raid.stop()
+            raid.clear_superblock()
+            udev_settle()
+            if os.path.exists(RAID_NAME):
+                errors.append('failed to delete raid %s' % RAID_NAME)
+        errors.extend(wipe(self.disks, self.discard if discard is None
+                           else discard))
+        if not errors and os.path.exists(self.state_file):
+            state = self._load_state()
+            if not state or state['spec']['disks'] == self.disks:
+                os.remove(self.state_file)
+        self.built = False
+        return errors
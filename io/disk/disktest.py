@@ -23,22 +23,20 @@ Disktest test
 """
 
 import glob
+import json
+import multiprocessing
 import os
 import shutil
-import time
 
 from avocado import Test
 from avocado.utils import build
 from avocado.utils import memory
 from avocado.utils import dmesg
-from avocado.utils import process, distro
+from avocado.utils import distro
 from avocado.utils import disk
-from avocado.utils import lv_utils
-from avocado.utils import wait
-from avocado.utils.partition import Partition
-from avocado.utils import softwareraid
 from avocado.utils.software_manager.manager import SoftwareManager
-from avocado.utils.partition import PartitionError
+from disk_api import chunks
+from disk_api.stack import STATE_FILE, StackError, StorageStack
 
 
 class Disktest(Test):
@@ -58,9 +56,12 @@ class Disktest(Test):
         :param disk: Disk to be used in test.
         :param dir: Directory of used in test. When the target does not exist,
                     it's created.
-        :param gigabytes: Disk space that will be used for the test to run.
-        :param chunk_mb: Size of the portion of the disk used to run the test.
-                         Cannot be smaller than the total amount of RAM.
+        :param jobs: Number of chunks tested at the same time, the number
+                     of CPUs by default.
+        :param chunk_mb: Size of the portion of the disk used by one
+                         disktest process. By default the chunks tested at
+                         the same time are together as big as the available
+                         RAM, so that they are read back from the disk.
         """
         self.err_mesg = []
         smm = SoftwareManager()
@@ -70,15 +71,14 @@ class Disktest(Test):
         # Log of all the disktest processes
         self.disk_log = os.path.abspath(os.path.join(self.outputdir,
                                                      "log.txt"))
-        self.fs_create = False
+        self.stacks = []
+        self.targets = []
         self.raid_needed = self.params.get('raid', default=False)
-        self.raid_create = False
         device = self.params.get('disk', default=None)
         self.dir = self.params.get('dir', default=None)
         if not self.dir:
             self.dir = self.workdir
         self.fstype = self.params.get('fs', default='ext4')
-        self.raid_name = '/dev/md/sraid'
 
         if self.fstype == 'btrfs':
             if detected_distro.name == 'Ubuntu':
@@ -92,9 +92,12 @@ class Disktest(Test):
                                 RHEL 7.4 onwards")
 
         if device is not None:
-            self.disk = disk.get_absolute_disk_path(device)
-            if self.disk not in disk.get_all_disk_paths():
-                self.cancel("Missing disk %s in OS" % self.disk)
+            self.disks = [disk.get_absolute_disk_path(dev)
+                          for dev in device.split()]
+            for dev in self.disks:
+                if dev not in disk.get_all_disk_paths():
+                    self.cancel("Missing disk %s in OS" % dev)
+            self.disk = ' '.join(self.disks)
         else:
             self.cancel("Please Provide valid device name")
 
@@ -103,102 +106,54 @@ class Disktest(Test):
                and not smm.install("mdadm"):
                 self.cancel('mdadm is needed for the test to be run')
 
-        self.vgname = 'avocado_vg'
-        self.lvname = 'avocado_lv'
-        self.target = self.disk
-        self.part_obj = Partition(self.disk, mountpoint=self.dir)
-        self.sw_raid = softwareraid.SoftwareRaid(self.raid_name, '0',
-                                                 self.disk.split(), '1.2')
-
         self._init_params()
         self._compile_disktest()
 
     def _init_params(self):
         """
-        Retrieves and checks the test params
+        Builds the storage stacks and plans the chunks
         """
-        gigabytes = lv_utils.get_device_total_space(self.target) // 1073741824
-        memory_mb = memory.meminfo.MemTotal.m
-        self.log.info("memory_mb=%s" % memory_mb)
-        self.chunk_mb = gigabytes * 950
-
-        self.no_chunks = 1024 * gigabytes // self.chunk_mb
-        if self.no_chunks == 0:
-            self.cancel("Free disk space is lower than chunk size (%s, %s)"
-                        % (1024 * gigabytes, self.chunk_mb))
-
-        self.log.info("Test will use %s chunks %sMB each in %sMB RAM using %s "
-                      "GB of disk space on %s dir (%s).", self.no_chunks,
-                      self.chunk_mb, memory_mb,
-                      self.no_chunks * self.chunk_mb, len(self.dir),
-                      self.dir)
-
         dmesg.clear_dmesg()
-        self.pre_cleanup()
-        if self.raid_needed:
-            self.create_raid(self.target, self.raid_name)
-            self.raid_create = True
-            self.target = self.raid_name
-
-        if self.fstype:
-            self.create_fs(self.target, self.dir, self.fstype)
-            self.fs_create = True
-
-    def create_raid(self, l_disk, l_raid_name):
-        """
-        creates a softwareraid with given raid name on given disk
-
-        :param l_disk: disk name on which raid will be created
-        :l_raid_name: name of the softwareraid
-        :return: None
-        """
-        self.log.info("creating softwareraid on {}" .format(l_disk))
-        self.sw_raid = softwareraid.SoftwareRaid(l_raid_name, '0',
-                                                 l_disk.split(), '1.2')
-        self.sw_raid.create()
-
-    def create_fs(self, l_disk, mountpoint, fstype):
-        """
-        umounts the given disk if mounted then creates a filesystem on it
-        and then mounts it on given directory
-
-        :param l_disk: disk name on which fs will be created
-        :param mountpoint: directory name on which the disk will be mounted
-        :param fstype: filesystem type like ext4,xfs,btrfs etc
-        :returns: None
-        """
-        self.part_obj = Partition(l_disk, mountpoint=mountpoint)
-        self.part_obj.unmount()
-        self.part_obj.mkfs(fstype)
-        try:
-            self.part_obj.mount()
-        except PartitionError:
-            self.fail("Mounting disk %s on directory %s failed"
-                      % (l_disk, mountpoint))
-
-    def pre_cleanup(self):
-        """
-        cleanup the disk and directory before test starts on it
-        """
-        self.log.info("Pre_cleaning of disk and directories...")
-        disk_list = ['/dev/mapper/avocado_vg-avocado_lv', self.raid_name,
-                     self.disk]
-        for disk1 in disk_list:
-            self.delete_fs(disk1)
-        self.log.info("checking ...lv/vg existence...")
-        if lv_utils.lv_check(self.vgname, self.lvname):
-            self.log.info("found lv existence... deleting it")
-            self.delete_lv()
-        elif lv_utils.vg_check(self.vgname):
-            self.log.info("found vg existence ... deleting it")
-            lv_utils.vg_remove(self.vgname)
-        self.log.info("checking for softwareraid existence...")
-        if self.sw_raid.exists():
-            self.log.info("found softwareraid existence... deleting it")
-            self.delete_raid()
+        if self.raid_needed or len(self.disks) == 1:
+            layouts = [(self.disks, self.dir, STATE_FILE)]
         else:
-            self.log.info("No softwareraid detected ")
-        self.log.info("\n End of pre_cleanup")
+            # one filesystem per disk, all of them tested at the same time
+            layouts = [([dev], os.path.join(self.dir, os.path.basename(dev)),
+                        '%s.%s' % (STATE_FILE, os.path.basename(dev)))
+                       for dev in self.disks]
+        for disks, mountpoint, state_file in layouts:
+            if not os.path.exists(mountpoint):
+                os.makedirs(mountpoint)
+            stack = StorageStack(
+                disks, mountpoint,
+                raid_level='0' if self.raid_needed else None, fs=self.fstype,
+                reuse=self.params.get('reuse_stack', default=False),
+                discard=self.params.get('discard', default=False),
+                state_file=state_file)
+            self.stacks.append(stack)
+            try:
+                stack.build()
+            except StackError as details:
+                self.fail("Storage stack setup failed: %s" % details)
+            self.targets.append(mountpoint)
+
+        self.jobs = self.params.get('jobs', default=None) or \
+            multiprocessing.cpu_count()
+        space = {target: chunks.target_space_mb(target)
+                 for target in self.targets}
+        memory_mb = memory.meminfo.MemAvailable.m
+        self.chunk_mb = self.params.get('chunk_mb', default=None) or \
+            chunks.chunk_size(sum(space.values()), memory_mb, self.jobs)
+        self.chunks = chunks.plan(space, self.chunk_mb)
+        if not self.chunks:
+            self.cancel("Free disk space is lower than chunk size (%s, %s)"
+                        % (sum(space.values()), self.chunk_mb))
+
+        self.log.info("Test will use %s chunks %sMB each, %s at a time, in "
+                      "%sMB available RAM using %sMB of disk space on %s",
+                      len(self.chunks), self.chunk_mb, self.jobs, memory_mb,
+                      len(self.chunks) * self.chunk_mb,
+                      ", ".join(self.targets))
 
     def _compile_disktest(self):
         """
@@ -210,157 +165,36 @@ class Disktest(Test):
                    env={"CFLAGS": "-O2 -Wall -D_FILE_OFFSET_BITS=64 "
                                   "-D _GNU_SOURCE"})
 
-    def one_disk_chunk(self, disk, chunk):
-        """
-        Tests one part of the disk by spawning a disktest instance.
-
-        :param disk: Directory (usually a mountpoint).
-        :param chunk: Portion of the disk used.
-        :returns: Returns process ID and process
-        """
-        cmd = ("%s/disktest -m %d -f %s/testfile.%d -i -S >> \"%s\" 2>&1" %
-               (self.teststmpdir, self.chunk_mb, disk, chunk, self.disk_log))
-        proc = process.SubProcess(cmd, shell=True, verbose=False)
-        pid = proc.start()
-        return pid, proc
-
-    def delete_raid(self):
-        """
-        it checks for existing of raid and deletes it if exists
-        """
-        self.log.info("deleting Sraid %s" % self.raid_name)
-
-        def is_raid_deleted():
-            self.sw_raid.stop()
-            self.sw_raid.clear_superblock()
-            self.log.info("checking for raid metadata")
-            cmd = "wipefs -af %s" % self.disk
-            process.system(cmd, shell=True, ignore_status=True)
-            if self.sw_raid.exists():
-                return False
-            return True
-        self.log.info("checking lvm_metadata on %s" % self.raid_name)
-        cmd = 'blkid -o value -s TYPE %s' % self.raid_name
-        out = process.system_output(cmd, shell=True,
-                                    ignore_status=True).decode("utf-8")
-        if out == 'LVM2_member':
-            cmd = "wipefs -af %s" % self.raid_name
-            process.system(cmd, shell=True, ignore_status=True)
-        if wait.wait_for(is_raid_deleted, timeout=10):
-            self.log.info("software raid  %s deleted" % self.raid_name)
-        else:
-            self.err_mesg.append("failed to delete sraid %s" % self.raid_name)
-
-    def delete_lv(self):
-        """
-        checks if lv/vg exists and delete them along with its metadata
-        if exists.
-        """
-        def is_lv_deleted():
-            lv_utils.lv_remove(self.vgname, self.lvname)
-            time.sleep(5)
-            lv_utils.vg_remove(self.vgname)
-            if lv_utils.lv_check(self.vgname, self.lvname):
-                return False
-            return True
-        if wait.wait_for(is_lv_deleted, timeout=10):
-            self.log.info("lv %s deleted" % self.lvname)
-        else:
-            self.err_mesg.append("failed to delete lv %s" % self.lvname)
-        # checking and deleting if lvm_meta_data exists after lv removed
-        cmd = 'blkid -o value -s TYPE %s' % self.disk
-        out = process.system_output(cmd, shell=True,
-                                    ignore_status=True).decode("utf-8")
-        if out == 'LVM2_member':
-            cmd = "wipefs -af %s" % self.disk
-            process.system(cmd, shell=True, ignore_status=True)
-
-    def delete_fs(self, l_disk):
-        """
-        checks for disk/dir mount, unmount if mounted and checks for
-        filesystem existence and wipe it off after dir/disk unmount.
-
-        :param l_disk: disk name for which you want to check the mount status
-        :return: None
-        """
-        def is_fs_deleted():
-            cmd = "wipefs -af %s" % l_disk
-            process.system(cmd, shell=True, ignore_status=True)
-            if disk.fs_exists(l_disk):
-                return False
-            return True
-
-        def is_disk_unmounted():
-            cmd = "umount %s" % l_disk
-            cmd1 = 'umount /dev/mapper/avocado_vg-avocado_lv'
-            process.system(cmd, shell=True, ignore_status=True)
-            process.system(cmd1, shell=True, ignore_status=True)
-            if disk.is_disk_mounted(l_disk):
-                return False
-            return True
-
-        def is_dir_unmounted():
-            cmd = 'umount %s' % self.dir
-            process.system(cmd, shell=True, ignore_status=True)
-            if disk.is_dir_mounted(self.dir):
-                return False
-            return True
-
-        self.log.info("checking if disk is mounted.")
-        if disk.is_disk_mounted(l_disk):
-            self.log.info("%s is mounted, unmounting it ....", l_disk)
-            if wait.wait_for(is_disk_unmounted, timeout=10):
-                self.log.info("%s unmounted successfully" % l_disk)
-            else:
-                self.err_mesg.append("%s unmount failed", l_disk)
-        else:
-            self.log.info("disk %s not mounted." % l_disk)
-        self.log.info("checking if dir %s is mounted." % self.dir)
-        if disk.is_dir_mounted(self.dir):
-            self.log.info("%s is mounted, unmounting it ....", self.dir)
-            if wait.wait_for(is_dir_unmounted, timeout=10):
-                self.log.info("%s unmounted successfully" % self.dir)
-            else:
-                self.err_mesg.append("failed to unount %s", self.dir)
-        else:
-            self.log.info("dir %s not mounted." % self.dir)
-        self.log.info("checking if fs exists in {}" .format(l_disk))
-        if disk.fs_exists(l_disk):
-            self.log.info("found fs on %s, removing it....", l_disk)
-            if wait.wait_for(is_fs_deleted, timeout=10):
-                self.log.info("fs removed successfully..")
-            else:
-                self.err_mesg.append(f'failed to delete fs on {l_disk}')
-        else:
-            self.log.info(f'No fs detected on {self.disk}')
-
     def test(self):
         """
-        Runs one iteration of disktest.
-        """
-        procs = []
-        errors = []
-        for i in range(self.no_chunks):
-            self.log.debug("Testing chunk %s...", i)
-            procs.append(self.one_disk_chunk(self.dir, i))
-            for pid, proc in procs:
-                if proc.wait():
-                    errors.append(str(pid))
-        if errors:
-            self.fail("The %s pid(s) failed, please check the logs and %s"
-                      " for details." % (", ".join(errors), self.disk_log))
+        Runs one iteration of disktest on all the chunks.
+        """
+        scheduler = chunks.ChunkScheduler(
+            os.path.join(self.teststmpdir, "disktest"), self.chunks,
+            self.chunk_mb, self.jobs, self.log, self.disk_log)
+        results = scheduler.run()
+        with open(os.path.join(self.outputdir, "chunks.json"), "w") as out:
+            json.dump(results, out, indent=2)
+        failed = [result for result in results if result["status"]]
+        if failed:
+            corrupted = ["%s at offset %s" % (result["file"],
+                                              result["first_corruption"])
+                         for result in failed
+                         if result["first_corruption"] is not None]
+            self.fail("%s of %s chunk(s) failed, corruption in %s, please "
+                      "check the logs and %s for details."
+                      % (len(failed), len(results),
+                         ", ".join(corrupted) or "none", self.disk_log))
 
     def tearDown(self):
         """
         To clean all the testfiles generated
         """
-        for disk1 in getattr(self, "dir", []):
-            for filename in glob.glob("%s/testfile.*" % disk1):
+        for target in self.targets:
+            for filename in glob.glob("%s/testfile.*" % target):
                 os.remove(filename)
-        if self.fs_create:
-            self.delete_fs(self.target)
-        if self.raid_create:
-            self.delete_raid()
+        for stack in self.stacks:
+            self.err_mesg.extend(stack.release())
         dmesg.clear_dmesg()
         if self.err_mesg:
             self.warn("test failed due to following errors %s" % self.err_mesg)
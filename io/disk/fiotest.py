@@ -22,8 +22,9 @@
 FIO Test
 """
 
+import json
 import os
-import time
+import sys
 import avocado
 
 from avocado import Test
@@ -32,12 +33,16 @@ from avocado.utils import build
 from avocado.utils import pmem
 from avocado.utils import disk
 from avocado.utils import dmesg
-from avocado.utils import lv_utils, wait
 from avocado.utils import process, distro
-from avocado.utils import softwareraid
-from avocado.utils.partition import Partition
 from avocado.utils.software_manager.manager import SoftwareManager
-from avocado.utils.partition import PartitionError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from misc_api.build_cache import BuildCache
+from misc_api import sysfs
+from misc_api.baseline import STORE_PATH, ResultStore, compare
+from disk_api import fio
+from disk_api.stack import StackError, StorageStack
 
 
 class FioTest(Test):
@@ -50,6 +55,12 @@ class FioTest(Test):
 
     :param fio_tarbal: name of the tarball of fio suite located in deps path
     :param fio_job: config defining set of executed tests located in deps path
+    :param baseline: 'check' to compare the results with the baseline of
+                     the device model and job, saved by the first run,
+                     'update' to save the results as the new baseline,
+                     'off' to only log them
+    :param tolerance: accepted throughput drop or p99 latency growth
+                      against the baseline, in percent
     """
 
     def setUp(self):
@@ -67,10 +78,17 @@ class FioTest(Test):
         self.fio_file = 'fiotest-image'
         self.err_mesg = []
         self.fs_create = False
-        self.lv_create = False
-        self.raid_create = False
+        self.stack = None
         self.devdax_file = None
         self.disk_type = self.params.get('disk_type', default='')
+        self.baseline = self.params.get('baseline', default='check')
+        self.tolerance = float(self.params.get('tolerance', default=10))
+        self.results_store = self.params.get('results_store',
+                                             default=STORE_PATH)
+        # runs are compared with the runs on the same storage stack
+        self.stack_key = 'fs=%s,lv=%s,raid=%s,type=%s' % (
+            fstype or 'none', bool(lv_needed), bool(raid_needed),
+            self.disk_type or 'disk')
         device = self.params.get('disk', default=None)
         detected_distro = distro.detect()
         if device and not self.disk_type:
@@ -98,7 +116,7 @@ class FioTest(Test):
             pkg_list.extend(['libaio-dev', 'g++'])
             if fstype == 'btrfs':
                 pkg_list.append('btrfs-progs')
-        elif detected_distro.name is 'SuSE':
+        elif detected_distro.name == 'SuSE':
             pkg_list.extend(['libaio1', 'gcc-c++'])
         else:
             pkg_list.extend(['libaio', 'gcc-c++'])
@@ -125,9 +143,6 @@ class FioTest(Test):
         self.sourcedir = os.path.join(self.teststmpdir, "fio")
         fio_flags = ""
         self.ld_path = ""
-        self.raid_name = '/dev/md/sraid'
-        self.vgname = 'avocado_vg'
-        self.lvname = 'avocado_lv'
 
         if self.disk_type == 'nvdimm':
             self.setup_pmem_disk(mnt_args)
@@ -154,30 +169,27 @@ class FioTest(Test):
 
         if not self.dir:
             self.dir = self.workdir
-        if self.disk:
-            self.target = self.disk
-            self.lv_disk = self.disk
-            self.part_obj = Partition(self.disk, mountpoint=self.dir)
-            self.sraid = softwareraid.SoftwareRaid(self.raid_name, '0',
-                                                   self.disk.split(), '1.2')
-            self.pre_cleanup()
         dmesg.clear_dmesg()
-
-        if raid_needed:
-            self.create_raid(self.target, self.raid_name)
-            self.raid_create = True
-            self.target = self.raid_name
-
-        if lv_needed:
-            self.lv_disk = self.target
-            self.target = self.create_lv(self.target)
-            self.lv_create = True
-
-        if fstype:
-            self.create_fs(self.target, self.dir, fstype, fs_args, mnt_args)
-            self.fs_create = True
-
-        build.make(self.sourcedir, extra_args=fio_flags)
+        if self.disk:
+            self.stack = StorageStack(
+                self.disk, self.dir, raid_level='0' if raid_needed else None,
+                lv=lv_needed, fs=fstype, fs_args=fs_args, mnt_args=mnt_args,
+                reuse=self.params.get('reuse_stack', default=False),
+                discard=self.params.get('discard', default=False))
+            try:
+                self.target = self.stack.build()
+            except StackError as details:
+                self.fail("Storage stack setup failed: %s" % details)
+            self.fs_create = bool(fstype)
+
+        # NVDIMM builds link against the PMDK installed in teststmpdir,
+        # those can not be shared through the build cache
+        cache = BuildCache('fio', [tarball], flags=fio_flags,
+                           enabled=self.params.get('build_cache',
+                                                   default=True) and
+                           self.disk_type != 'nvdimm')
+        cache.build(self.sourcedir,
+                    lambda: build.make(self.sourcedir, extra_args=fio_flags))
 
     @avocado.fail_on(pmem.PMemException)
     def setup_pmem_disk(self, mnt_args):
@@ -206,188 +218,147 @@ class FioTest(Test):
                     self.plib.run_ndctl_list('-N -r %s' % region)[0],
                     'chardev')
 
-    def pre_cleanup(self):
-        """
-        cleanup the disk and directory before test starts on it
-        """
-        self.log.info("Pre_cleaning of disk and directories...")
-        disk_list = ['/dev/mapper/avocado_vg-avocado_lv', self.raid_name,
-                     self.disk]
-        for disk in disk_list:
-            self.delete_fs(disk)
-        self.log.info("checking ...lv/vg existence...")
-        if lv_utils.lv_check(self.vgname, self.lvname):
-            self.log.info("found lv existence... deleting it")
-            self.delete_lv()
-        elif lv_utils.vg_check(self.vgname):
-            self.log.info("found vg existence ... deleting it")
-            lv_utils.vg_remove(self.vgname)
-        else:
-            self.log.info("No VG/LV detected")
-        self.log.info("checking for sraid existence...")
-        if self.sraid.exists():
-            self.log.info("found sraid existence... deleting it")
-            self.delete_raid()
-        else:
-            self.log.info("No softwareraid detected ")
-        self.log.info("\n End of pre_cleanup")
-
-    def create_raid(self, l_disk, l_raid_name):
-        """
-        creates a softwareraid with given raid name on given disk
-
-        :param l_disk: disk name on which raid will be created
-        :l_raid_name: name of the softwareraid
-        :return: None
-        """
-        self.log.info("creating softwareraid on {}" .format(l_disk))
-        self.sraid = softwareraid.SoftwareRaid(l_raid_name, '0',
-                                               l_disk.split(), '1.2')
-        self.sraid.create()
-
-    def create_lv(self, l_disk):
+    def device_model(self):
         """
-        creates a volume group then logical volume on it and returns lv.
-
-        :param l_disk: disk name on which a lv will be created
-        :returns: Returns the lv name
-        :rtype: str
+        Return the model of the tested disk, from sysfs
         """
-        lv_size = lv_utils.get_device_total_space(l_disk) / 2330168
-        lv_utils.vg_create(self.vgname, l_disk, force=True)
-        lv_utils.lv_create(self.vgname, self.lvname, lv_size)
-        return '/dev/%s/%s' % (self.vgname, self.lvname)
-
-    def create_fs(self, l_disk, mountpoint, fstype, fs_args='', mnt_args=''):
+        if not self.disk:
+            return self.disk_type or 'unknown'
+        name = os.path.basename(os.path.realpath(self.disk))
+        # partitions have the device of their disk one level up
+        for path in ['/sys/class/block/%s/device' % name,
+                     '/sys/class/block/%s/../device' % name]:
+            model = sysfs.read(os.path.join(path, 'model'))
+            if model:
+                return model
+        # device mapper and md devices have no model, use their name
+        return sysfs.read('/sys/class/block/%s/dm/name' % name,
+                          default=name)
+
+    def check_results(self, fio_job, output):
         """
-        umounts the given disk if mounted then creates a filesystem on it
-        and then mounts it on given directory
+        Parse the fio JSON results, store them and compare them with the
+        baseline of the device model and job
 
-        :param l_disk: disk name on which fs will be created
-        :param mountpoint: directory name on which the disk will be mounted
-        :param fstype: filesystem type like ext4,xfs,btrfs etc
-        :param fs_args: filesystem related extra arguments like -f -b -s etc
-        :param mnt_args: mounting arguments like -o etc
-        :returns: None
+        :param fio_job: fio job file
+        :param output: fio JSON output file
         """
-        self.part_obj = Partition(l_disk, mountpoint=mountpoint)
-        self.part_obj.unmount()
-        self.part_obj.mkfs(fstype, args=fs_args)
         try:
-            self.part_obj.mount(args=mnt_args)
-        except PartitionError:
-            self.fail("Mounting disk %s on directory %s failed"
-                      % (l_disk, mountpoint))
-
-    def delete_raid(self):
+            jobs = fio.summarize(fio.load_output(output))
+        except (OSError, ValueError) as details:
+            self.fail("Could not parse fio results: %s" % details)
+        results = fio.metrics(jobs)
+        if not results:
+            self.fail("fio reported no IO")
+        for name in sorted(results):
+            self.log.info("%s: %s", name, results[name])
+        if self.baseline == 'off':
+            return
+        key = [self.device_model(),
+               os.path.splitext(os.path.basename(fio_job))[0], self.stack_key]
+        store = ResultStore('fio', self.results_store)
+        baseline = store.baseline(key)
+        record = store.record(key, results, details=jobs, test=self.name)
+        if self.baseline == 'update' or baseline is None:
+            self.log.info("Saving the results as baseline of %s",
+                          ' '.join(key))
+            store.set_baseline(key, record)
+            return
+        regressions = compare(baseline['metrics'], results, self.tolerance,
+                              lower=fio.LOWER_IS_BETTER)
+        for reg in regressions:
+            self.log.error("%s: %s against baseline %s of %s (%+.1f%%)",
+                           reg['metric'], reg['current'], reg['baseline'],
+                           baseline['time'], reg['change'])
+        if regressions:
+            self.fail("%d fio metrics regressed beyond %s%% of the baseline"
+                      % (len(regressions), self.tolerance))
+
+    def run_fio(self, job, filename, output):
         """
-        it checks for existing of raid and deletes it if exists
-        """
-        self.log.info("deleting Sraid %s" % self.raid_name)
-
-        def is_raid_deleted():
-            self.sraid.stop()
-            self.sraid.clear_superblock()
-            self.log.info("checking for raid metadata")
-            cmd = "wipefs -af %s" % self.disk
-            process.system(cmd, shell=True, ignore_status=True)
-            if self.sraid.exists():
-                return False
-            return True
-        self.log.info("checking lvm_metadata on %s" % self.raid_name)
-        cmd = 'blkid -o value -s TYPE %s' % self.raid_name
-        out = process.system_output(cmd, shell=True,
-                                    ignore_status=True).decode("utf-8")
-        if out == 'LVM2_member':
-            cmd = "wipefs -af %s" % self.raid_name
-            process.system(cmd, shell=True, ignore_status=True)
-        if wait.wait_for(is_raid_deleted, timeout=10):
-            self.log.info("software raid  %s deleted" % self.raid_name)
-        else:
-            self.err_mesg.append("failed to delete raid %s" % self.raid_name)
+        Run fio with JSON results
 
-    def delete_lv(self):
-        """
-        checks if lv/vg exists and delete them along with its metadata
-        if exists.
+        :param job: fio job file
+        :param filename: file or device fio runs on
+        :param output: fio JSON output file
         """
-        def is_lv_deleted():
-            lv_utils.lv_remove(self.vgname, self.lvname)
-            time.sleep(5)
-            lv_utils.vg_remove(self.vgname)
-            if lv_utils.lv_check(self.vgname, self.lvname):
-                return False
-            return True
-        if wait.wait_for(is_lv_deleted, timeout=10):
-            self.log.info("lv %s deleted" % self.lvname)
-        else:
-            self.err_mesg.append("lv %s not deleted" % self.lvname)
-        # checking and deleting if lvm_meta_data exists after lv removed
-        cmd = 'blkid -o value -s TYPE %s' % self.lv_disk
-        out = process.system_output(cmd, shell=True,
-                                    ignore_status=True).decode("utf-8")
-        if out == 'LVM2_member':
-            cmd = "wipefs -af %s" % self.lv_disk
-            process.system(cmd, shell=True, ignore_status=True)
+        cmd = '%s %s/fio %s --filename=%s --output-format=json+ ' \
+              '--output=%s' % (self.ld_path, self.sourcedir, job, filename,
+                               output)
+        self.log.info("running fio test using command : %s" % cmd)
+        status = process.system(cmd, ignore_status=True, shell=True)
+        if status:
+            # status of 3 is a common warning with iscsi disks but fio
+            # process completes successfully so throw a warning not
+            # a fail. For other nonzero statuses we should fail.
+            if status == 3:
+                self.log.warning("Warnings during fio run")
+            else:
+                self.fail("fio run failed")
 
-    def delete_fs(self, l_disk):
+    def sweep(self, filename):
         """
-        checks for disk/dir mount, unmount if mounted and checks for
-        filesystem existence and wipe it off after dir/disk unmount.
+        Run fio over a matrix of block sizes, queue depths, job counts and
+        read/write mixes, every cell until its IOPS reach a steady state,
+        and summarize the knee of the curve of every workload
 
-        :param l_disk: disk name for which you want to check the mount status
-        :return: None
+        :param filename: file or device fio runs on
         """
-        def is_fs_deleted():
-            cmd = "wipefs -af %s" % l_disk
-            process.system(cmd, shell=True, ignore_status=True)
-            if disk.fs_exists(l_disk):
-                return False
-            return True
-
-        def is_disk_unmounted():
-            cmd = "umount %s" % l_disk
-            cmd1 = 'umount /dev/mapper/avocado_vg-avocado_lv'
-            process.system(cmd, shell=True, ignore_status=True)
-            process.system(cmd1, shell=True, ignore_status=True)
-            if disk.is_disk_mounted(l_disk):
-                return False
-            return True
-
-        def is_dir_unmounted():
-            cmd = 'umount %s' % self.dir
-            process.system(cmd, shell=True, ignore_status=True)
-            if disk.is_dir_mounted(self.dir):
-                return False
-            return True
-
-        self.log.info("checking if disk is mounted.")
-        if disk.is_disk_mounted(l_disk):
-            self.log.info("%s is mounted, unmounting it ....", l_disk)
-            if wait.wait_for(is_disk_unmounted, timeout=10):
-                self.log.info("%s unmounted successfully" % l_disk)
-            else:
-                self.err_mesg.append("%s unmount failed", l_disk)
-        else:
-            self.log.info("disk %s not mounted." % l_disk)
-        self.log.info("checking if dir %s is mounted." % self.dir)
-        if disk.is_dir_mounted(self.dir):
-            self.log.info("%s is mounted, unmounting it ....", self.dir)
-            if wait.wait_for(is_dir_unmounted, timeout=10):
-                self.log.info("%s unmounted successfully" % self.dir)
-            else:
-                self.err_mesg.append("failed to unount %s", self.dir)
-        else:
-            self.log.info("dir %s not mounted." % self.dir)
-        self.log.info("checking if fs exists in {}" .format(l_disk))
-        if disk.fs_exists(l_disk):
-            self.log.info("found fs on %s, removing it....", l_disk)
-            if wait.wait_for(is_fs_deleted, timeout=10):
-                self.log.info("fs removed successfully..")
-            else:
-                self.err_mesg.append("failed to delete fs on %s", l_disk)
-        else:
-            self.log.info("No fs detected on %s" % self.disk)
+        cells = fio.sweep_cells(
+            self.params.get('sweep_rw', default='randread').split(),
+            self.params.get('sweep_bs', default='4k').split(),
+            self.params.get('sweep_iodepth', default='1 4 16 64').split(),
+            self.params.get('sweep_numjobs', default='1').split())
+        options = {'ioengine': self.params.get('sweep_ioengine',
+                                               default='libaio'),
+                   'direct': 1, 'time_based': 1,
+                   'size': self.params.get('sweep_size', default='10G'),
+                   # upper bound, the steady state ends the cells sooner
+                   'runtime': self.params.get('sweep_runtime', default=300),
+                   'steadystate': self.params.get('steadystate',
+                                                  default='iops_slope:0.3%'),
+                   'steadystate_duration': self.params.get(
+                       'steadystate_duration', default='30s'),
+                   'steadystate_ramp_time': self.params.get(
+                       'steadystate_ramp_time', default='10s')}
+        max_p99 = self.params.get('max_p99_us', default=None)
+        results = []
+        for count, cell in enumerate(cells, 1):
+            name = fio.cell_name(cell)
+            job = os.path.join(self.workdir, '%s.job' % name)
+            with open(job, 'w') as job_file:
+                job_file.write(fio.cell_job(cell, options))
+            output = os.path.join(self.outputdir, '%s.json' % name)
+            self.log.info("Sweep cell %d/%d: %s", count, len(cells), name)
+            self.run_fio(job, filename, output)
+            try:
+                jobs = fio.summarize(fio.load_output(output))
+            except (OSError, ValueError) as details:
+                self.fail("Could not parse fio results of %s: %s"
+                          % (name, details))
+            result = fio.cell_result(cell, jobs)
+            self.log.info("%s: %s IOPS, %s KiB/s, p99 %s us in %.1f s%s",
+                          name, result['iops'], result['bw_kib'],
+                          result['clat_p99_us'], result['runtime_ms'] / 1000.0,
+                          '' if result['steady'] else ', no steady state')
+            results.append(result)
+        summary = fio.knee(results, float(max_p99) if max_p99 else None)
+        for group, knee in summary.items():
+            if not knee['best']:
+                self.log.warning("%s: no cell within p99 %s us", group,
+                                 max_p99)
+                continue
+            self.log.info("%s: best %s IOPS at %s, knee %s IOPS at %s",
+                          group, knee['best']['iops'], knee['best']['name'],
+                          knee['knee']['iops'], knee['knee']['name'])
+        with open(os.path.join(self.outputdir, 'sweep_summary.json'),
+                  'w') as summary_file:
+            json.dump({'model': self.device_model(), 'stack': self.stack_key,
+                       'max_p99_us': max_p99, 'knees': summary,
+                       'cells': results}, summary_file, indent=2)
+        if not any(knee['best'] for knee in summary.values()):
+            self.fail("No sweep cell within the p99 latency of %s us"
+                      % max_p99)
 
     def test(self):
         """
@@ -406,33 +377,23 @@ class FioTest(Test):
             filename = self.target
         else:
             filename = self.dir
-        cmd = '%s %s/fio %s --filename=%s' % (self.ld_path,
-                                              self.sourcedir,
-                                              self.get_data(fio_job),
-                                              filename)
-        self.log.info("running fio test using command : %s" % cmd)
-        status = process.system(cmd, ignore_status=True, shell=True)
-        if status:
-            # status of 3 is a common warning with iscsi disks but fio
-            # process completes successfully so throw a warning not
-            # a fail. For other nonzero statuses we should fail.
-            if status == 3:
-                self.log.warning("Warnings during fio run")
-            else:
-                self.fail("fio run failed")
+        if self.params.get('sweep', default=False):
+            self.sweep(filename)
+            return
+        output = os.path.join(self.outputdir, '%s.json' %
+                              os.path.splitext(os.path.basename(fio_job))[0])
+        self.run_fio(self.get_data(fio_job), filename, output)
+        self.check_results(fio_job, output)
 
     def tearDown(self):
         '''
         Cleanup of disk used to perform this test
         '''
-        if os.path.exists(self.fio_file):
-            os.remove(self.fio_file)
-        if self.fs_create:
-            self.delete_fs(self.target)
-        if self.lv_create:
-            self.delete_lv()
-        if self.raid_create:
-            self.delete_raid()
+        if self.fs_create and \
+                os.path.exists(os.path.join(self.dir, self.fio_file)):
+            os.remove(os.path.join(self.dir, self.fio_file))
+        if self.stack:
+            self.err_mesg.extend(self.stack.release())
         dmesg.clear_dmesg()
         if self.err_mesg:
             self.log.warn("test failed with errors: %s" % self.err_mesg)
@@ -31,13 +31,10 @@ from avocado.utils import process
 from avocado.utils import build
 from avocado.utils import distro
 from avocado.utils import disk
-from avocado.utils import lv_utils
-from avocado.utils import softwareraid
-from avocado.utils.partition import Partition
 from avocado.utils import data_structures
 from avocado.utils import astring
-from avocado.utils.partition import PartitionError
 from avocado.utils.software_manager.manager import SoftwareManager
+from disk_api.stack import StackError, StorageStack
 
 
 _LABELS = ['file_size', 'record_size', 'write', 'rewrite', 'read', 'reread',
@@ -416,14 +413,13 @@ class IOZone(Test):
         '''
         Build IOZone
         '''
+        self.stack = None
         fstype = self.params.get('fs', default='')
-        self.fs_create = False
         lv_needed = self.params.get('lv', default=False)
-        self.lv_create = False
         raid_needed = self.params.get('raid', default=False)
-        self.raid_create = False
         device = self.params.get('disk', default=None)
         self.disk = disk.get_absolute_disk_path(device)
+        self.dir = self.params.get('dir', default=None)
         self.source_url = self.params.get('source', default=None)
 
         self.base_dir = os.path.abspath(self.basedir)
@@ -472,61 +468,21 @@ class IOZone(Test):
         else:
             build.make(make_dir, extra_args='linux')
         self.dirs = self.disk
-        if self.disk is not None:
+        if self.disk is not None and (raid_needed or lv_needed or fstype):
             if self.disk in disk.get_all_disk_paths():
-                if raid_needed:
-                    raid_name = '/dev/md/sraid'
-                    self.create_raid(self.disk, raid_name)
-                    self.raid_create = True
-                    self.disk = raid_name
-                    self.dirs = self.disk
-                if lv_needed:
-                    self.disk = self.create_lv(self.disk)
-                    self.lv_create = True
-                    self.dirs = self.disk
-                if fstype:
-                    self.dirs = self.workdir
-                    self.create_fs(self.disk, self.dirs, fstype)
-                    self.fs_create = True
-
-    def create_raid(self, l_disk, l_raid_name):
-        self.sraid = softwareraid.SoftwareRaid(l_raid_name, '0',
-                                               l_disk.split(), '1.2')
-        self.sraid.create()
-
-    def delete_raid(self):
-        self.sraid.stop()
-        self.sraid.clear_superblock()
-
-    def create_lv(self, l_disk):
-        vgname = 'avocado_vg'
-        lvname = 'avocado_lv'
-        lv_size = lv_utils.get_device_total_space(l_disk) / 2330168
-        lv_utils.vg_create(vgname, l_disk, force=True)
-        lv_utils.lv_create(vgname, lvname, lv_size)
-        return '/dev/%s/%s' % (vgname, lvname)
-
-    def delete_lv(self):
-        vgname = 'avocado_vg'
-        lvname = 'avocado_lv'
-        lv_utils.lv_remove(vgname, lvname)
-        lv_utils.vg_remove(vgname)
-
-    def create_fs(self, l_disk, mountpoint, fstype):
-        self.part_obj = Partition(l_disk, mountpoint=mountpoint)
-        self.part_obj.unmount()
-        self.part_obj.mkfs(fstype)
-        try:
-            self.part_obj.mount()
-        except PartitionError:
-            self.fail("Mounting disk %s on directory %s failed"
-                      % (l_disk, mountpoint))
-
-    def delete_fs(self, l_disk):
-        self.part_obj.unmount()
-        delete_fs = "dd if=/dev/zero bs=512 count=512 of=%s" % l_disk
-        if process.system(delete_fs, shell=True, ignore_status=True):
-            self.fail("Failed to delete filesystem on %s" % l_disk)
+                if not self.dir:
+                    self.dir = self.workdir
+                self.stack = StorageStack(
+                    self.disk, self.dir,
+                    raid_level='0' if raid_needed else None, lv=lv_needed,
+                    fs=fstype,
+                    reuse=self.params.get('reuse_stack', default=False),
+                    discard=self.params.get('discard', default=False))
+                try:
+                    self.disk = self.stack.build()
+                except StackError as details:
+                    self.fail("Storage stack setup failed: %s" % details)
+                self.dirs = self.dir if fstype else self.disk
 
     @staticmethod
     def __get_section_name(desc):
@@ -621,7 +577,7 @@ class IOZone(Test):
         '''
         Test method for performing IOZone test and analysis.
         '''
-        directory = self.params.get('dir', default=None)
+        directory = self.dir
         args = self.params.get('args', default=None)
         previous_results = self.params.get('previous_results', default=None)
 
@@ -663,10 +619,8 @@ class IOZone(Test):
         '''
         Cleanup of disk used to perform this test
         '''
-        if self.disk is not None:
-            if self.fs_create:
-                self.delete_fs(self.disk)
-            if self.lv_create:
-                self.delete_lv()
-            if self.raid_create:
-                self.delete_raid()
+        if self.stack:
+            errors = self.stack.release()
+            if errors:
+                self.fail("Storage stack cleanup failed: %s"
+                          % '; '.join(errors))
@@ -20,6 +20,7 @@ Multipath Test.
 Needs to be run as root.
 """
 
+import json
 import os
 import shutil
 import time
@@ -30,6 +31,7 @@ from avocado.utils import multipath
 from avocado.utils import service
 from avocado.utils import wait
 from avocado.utils.software_manager.manager import SoftwareManager
+from disk_api.iostall import IoProbe
 
 
 class MultipathTest(Test):
@@ -51,6 +53,14 @@ class MultipathTest(Test):
         self.policies.append(self.policy)
         self.op_shot_sleep_time = 60
         self.op_long_sleep_time = 180
+        # path failover tests: seconds the paths stay failed, how long
+        # multipathd gets to report a path state, and the I/O probe
+        self.hold_time = self.params.get('hold_time', default=5)
+        self.path_timeout = self.params.get('path_timeout', default=60)
+        self.probe_write = self.params.get('probe_write', default=False)
+        self.max_stall = self.params.get('max_stall', default=0)
+        self.probe = None
+        self.stall_events = []
         # Install needed packages
         dist = distro.detect()
         pkg_name = ""
@@ -216,24 +226,100 @@ class MultipathTest(Test):
         if msg:
             self.fail("Some tests failed. Find details below:\n%s" % msg)
 
+    def wait_paths(self, wwid, paths, state):
+        '''
+        Waits for multipathd to report all the paths of wwid in state,
+        'failed', or 'active' with a ready checker.
+        '''
+        def in_state():
+            status = multipath.get_mpath_paths_status(wwid) or {}
+            for path in paths:
+                dm_st, _, chk_st = status.get(path, ('', '', ''))
+                if dm_st != state or (state == 'active' and
+                                      chk_st != 'ready'):
+                    return False
+            return True
+        return wait.wait_for(in_state, timeout=self.path_timeout, step=0.2)
+
+    def start_probe(self, dic_path):
+        '''
+        Starts the background I/O on the multipath device
+        '''
+        device = "/dev/mapper/%s" % dic_path["name"]
+        self.probe = IoProbe(device, write=self.probe_write)
+        self.probe.start()
+        if not self.probe.wait_io(0, timeout=self.path_timeout):
+            self.log.warning("no I/O probe on %s: %s", device,
+                             self.probe.error or "I/O does not complete")
+            self.stop_probe()
+
+    def stop_probe(self):
+        '''
+        Stops the background I/O
+        '''
+        if self.probe and not self.probe.stop(timeout=self.path_timeout):
+            self.log.warning("I/O probe on %s still hung", self.probe.device)
+        self.probe = None
+
+    def stall_event(self, dic_path, event, since, io_expected=True):
+        '''
+        Records the I/O impact of a path event which started at since.
+
+        :param io_expected: the I/O keeps flowing, wait for an I/O to
+                            complete and check the stall against max_stall
+        :return: error message when the stall is over max_stall
+        '''
+        if not self.probe:
+            return None
+        if io_expected:
+            self.probe.wait_io(time.monotonic(), timeout=self.path_timeout)
+        window = self.probe.window(since)
+        window.update(mpath=dic_path["name"], event=event)
+        self.stall_events.append(window)
+        self.log.info("%s %s: max stall %ss, %s I/O error(s), recovered "
+                      "after %ss", dic_path["name"], event,
+                      window["max_stall"], window["errors"],
+                      window["recovery"])
+        if io_expected and self.max_stall and \
+                (window["max_stall"] > self.max_stall or window["errors"]):
+            return "%s %s: I/O stalled %ss with %s error(s)" % (
+                dic_path["name"], event, window["max_stall"],
+                window["errors"])
+        return None
+
     def test_fail_reinstate_individual_paths(self):
         '''
         Failing and reinstating individual paths eg: sdX
         '''
         err_paths = []
+        stalls = []
         self.log.info(" Failing and reinstating the individual paths")
         for dic_path in self.mpath_list:
+            self.start_probe(dic_path)
             for path in dic_path['paths']:
+                since = time.monotonic()
                 if multipath.fail_path(path) is False:
                     self.log.info("could not fail %s in indvdl path:", path)
                     err_paths.append(path)
-                elif multipath.reinstate_path(path) is False:
+                    continue
+                stalls.append(self.stall_event(dic_path, "fail %s" % path,
+                                               since))
+                since = time.monotonic()
+                if multipath.reinstate_path(path) is False:
                     self.log.info("couldn't reinstat %s in indvdl path", path)
                     err_paths.append(path)
+                    continue
+                stalls.append(self.stall_event(dic_path,
+                                               "reinstate %s" % path, since))
+            self.stop_probe()
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
             self.fail("failing for following paths : %s" % err_paths)
+        stalls = [stall for stall in stalls if stall]
+        if stalls:
+            self.fail("I/O stalls over %ss: %s" % (self.max_stall,
+                                                   "; ".join(stalls)))
 
     def test_io_run_on_single_path(self):
         '''
@@ -241,22 +327,39 @@ class MultipathTest(Test):
         of it for short time and reinstating back
         '''
         err_paths = []
+        stalls = []
         self.log.info("Failing and reinstating the n-1 paths")
         for dic_path in self.mpath_list:
+            self.start_probe(dic_path)
+            since = time.monotonic()
             for path in dic_path['paths'][:-1]:
                 if multipath.fail_path(path) is False:
                     self.log.info("could not fail %s under n-1 path", path)
                     err_paths.append(path)
 
-            time.sleep(self.op_long_sleep_time)
+            # the I/O runs on the last path for hold_time
+            time.sleep(self.hold_time)
+            stalls.append(self.stall_event(dic_path, "fail n-1 paths",
+                                           since))
+            since = time.monotonic()
             for path in dic_path['paths'][:-1]:
                 if multipath.reinstate_path(path) is False:
                     self.log.info("couldn't reinstate in n-1 path: %s", path)
                     err_paths.append(path)
+            if not self.wait_paths(dic_path["wwid"], dic_path["paths"],
+                                   "active"):
+                self.log.info("paths of %s not all active", dic_path["name"])
+            stalls.append(self.stall_event(dic_path, "reinstate n-1 paths",
+                                           since))
+            self.stop_probe()
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
             self.fail("following paths fails in n-1 paths : %s" % err_paths)
+        stalls = [stall for stall in stalls if stall]
+        if stalls:
+            self.fail("I/O stalls over %ss: %s" % (self.max_stall,
+                                                   "; ".join(stalls)))
 
     def test_failing_reinstate_all_paths(self):
         '''
@@ -265,16 +368,31 @@ class MultipathTest(Test):
         err_paths = []
         self.log.info("Failing and reinstating the n-1 paths")
         for dic_path in self.mpath_list:
+            self.start_probe(dic_path)
+            since = time.monotonic()
             for path in dic_path["paths"]:
                 if multipath.fail_path(path) is False:
                     self.log.info("could not fail under all path %s", path)
                     err_paths.append(path)
 
-            time.sleep(self.op_long_sleep_time)
+            # the I/O queues or fails without any path for hold_time
+            time.sleep(self.hold_time)
+            self.stall_event(dic_path, "fail all paths", since,
+                             io_expected=False)
+            since = time.monotonic()
             for path in dic_path["paths"]:
                 if multipath.reinstate_path(path) is False:
                     self.log.info("couldn't reinstate in all path %s", path)
                     err_paths.append(path)
+            if not self.wait_paths(dic_path["wwid"], dic_path["paths"],
+                                   "active"):
+                self.log.info("paths of %s not all active", dic_path["name"])
+            if self.probe and not self.probe.wait_io(
+                    since, timeout=self.path_timeout):
+                self.log.info("I/O on %s not recovered", dic_path["name"])
+            self.stall_event(dic_path, "reinstate all paths", since,
+                             io_expected=False)
+            self.stop_probe()
         self.mpath_svc.restart()
         wait.wait_for(self.mpath_svc.status, timeout=10)
         if err_paths:
@@ -362,6 +480,11 @@ class MultipathTest(Test):
         """
         Restore config file, if existed, and restart services
         """
+        self.stop_probe()
+        if self.stall_events:
+            with open(os.path.join(self.outputdir, "io_stall.json"),
+                      "w") as stall_file:
+                json.dump(self.stall_events, stall_file, indent=2)
         if os.path.isfile("%s.bkp" % self.mpath_file):
             shutil.copyfile("%s.bkp" % self.mpath_file, self.mpath_file)
         self.mpath_svc.restart()
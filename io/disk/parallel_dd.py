@@ -25,13 +25,108 @@ the files system.
 """
 
 import os
+import re
+import mmap
 import time
 import sys
 import json
+import threading
 from avocado import Test
 from avocado.utils import process, distro, disk
 from avocado.utils import partition as partition_lib
 
+BLOCK_SIZE = 4096
+
+
+def percentile(values, pct):
+    """
+    Returns the nearest-rank percentile of a sorted list of values.
+    """
+    if not values:
+        return 0
+    index = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+class Stream(threading.Thread):
+    """
+    One in-process read or write stream of a file, timing every request.
+    """
+
+    def __init__(self, path, operation, blocks, io_size, direct=False,
+                 barrier=None):
+        super().__init__()
+        self.path = path
+        self.operation = operation
+        self.size = int(blocks) * BLOCK_SIZE
+        self.io_size = io_size
+        self.direct = direct
+        self.barrier = barrier
+        self.latencies = []
+        self.elapsed = 0
+        self.error = None
+
+    def run(self):
+        flags = os.O_RDONLY
+        if self.operation == 'write':
+            flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        if self.direct:
+            flags |= os.O_DIRECT
+        # anonymous mmap is page aligned, as O_DIRECT needs it
+        buf = mmap.mmap(-1, self.io_size)
+        try:
+            fd = os.open(self.path, flags, 0o644)
+        except OSError as details:
+            self.error = str(details)
+            buf.close()
+            # release the other streams waiting for this one
+            if self.barrier:
+                self.barrier.abort()
+            return
+        try:
+            if self.barrier:
+                self.barrier.wait()
+            done = 0
+            start = time.perf_counter()
+            while done < self.size:
+                io_start = time.perf_counter()
+                if self.operation == 'write':
+                    count = os.write(fd, buf)
+                else:
+                    count = os.readv(fd, [buf])
+                self.latencies.append(time.perf_counter() - io_start)
+                if count <= 0:
+                    break
+                done += count
+            if self.operation == 'write':
+                os.fsync(fd)
+            self.elapsed = time.perf_counter() - start
+            self.size = done
+        except threading.BrokenBarrierError:
+            self.error = 'aborted, another stream failed to start'
+        except OSError as details:
+            self.error = str(details)
+        finally:
+            os.close(fd)
+            buf.close()
+
+    def result(self):
+        """
+        Returns the throughput and latency percentiles of the stream.
+        """
+        lat = sorted(self.latencies)
+        megabytes = self.size / (1024.0 * 1024)
+        return {'file': self.path,
+                'megabytes': megabytes,
+                'seconds': self.elapsed,
+                'mb_per_sec': megabytes / self.elapsed if self.elapsed else 0,
+                'requests': len(lat),
+                'lat_usec': {'p50': percentile(lat, 50) * 1e6,
+                             'p90': percentile(lat, 90) * 1e6,
+                             'p99': percentile(lat, 99) * 1e6,
+                             'max': lat[-1] * 1e6 if lat else 0},
+                'error': self.error}
+
 
 class ParallelDd(Test):
     """
@@ -52,6 +147,11 @@ class ParallelDd(Test):
         :params dd_roptions: dd read options.
         :params fs_dd_woptions: dd write in streams.
         :params fs_dd_roptions: dd read in streams.
+        :params stream_engine: 'dd' runs a dd process per stream, 'inprocess'
+                               runs the streams as threads timing every
+                               request. Defaults to dd.
+        :params direct: Use O_DIRECT for the inprocess streams.
+        :params io_size: Request size in bytes of the inprocess streams.
         """
 
         device = self.params.get('disk', default=None)
@@ -70,6 +170,16 @@ class ParallelDd(Test):
         self.dd_roptions = self.params.get('dd_roptions', default='')
         self.fs_dd_woptions = self.params.get('fs_dd_woptions', default='')
         self.fs_dd_roptions = self.params.get('fs_dd_roptions', default='')
+        self.stream_engine = self.params.get('stream_engine', default='dd')
+        self.direct = self.params.get('direct', default=False)
+        self.io_size = int(self.params.get('io_size', default=BLOCK_SIZE))
+        if self.io_size % BLOCK_SIZE:
+            self.cancel("io_size must be a multiple of %d" % BLOCK_SIZE)
+        self.stream_results = {}
+        # latencies of all the inprocess streams and seconds of their
+        # groups, by operation
+        self.stream_latencies = {}
+        self.stream_seconds = {}
         detected_distro = distro.detect()
         if self.fstype == 'btrfs':
             if detected_distro.name == 'Ubuntu':
@@ -116,22 +226,95 @@ class ParallelDd(Test):
                 cmd += " %s=%s" % (option.split(":")[0], option.split(":")[1])
             process.run(cmd, shell=True)
 
+    def _dd_streams(self, operation, cmds):
+        """
+        Starts a dd per command at once and waits for all of them.
+        Returns the per stream results parsed from the dd summaries.
+        """
+        procs = []
+        for cmd in cmds:
+            proc = process.SubProcess(cmd + ' > /dev/null', shell=True)
+            proc.start()
+            procs.append(proc)
+        results = []
+        # Wait for everyone to complete
+        for proc in procs:
+            proc.wait()
+            summary = re.search(r'(\d+) bytes .* copied, ([\d.]+) s',
+                                proc.get_stderr().decode())
+            if proc.result.exit_status or not summary:
+                self.fail("%s failed: %s" % (proc.cmd, proc.get_stderr()))
+            megabytes = int(summary.group(1)) / (1024.0 * 1024)
+            seconds = float(summary.group(2))
+            results.append({'megabytes': megabytes, 'seconds': seconds,
+                            'mb_per_sec': megabytes / seconds if seconds
+                            else 0})
+        self.stream_results.setdefault(operation, []).extend(results)
+        self.stream_seconds[operation] = self.stream_seconds.get(
+            operation, 0) + max(result['seconds'] for result in results)
+
+    def _inprocess_streams(self, operation, files):
+        """
+        Runs one in-process stream per file, all released at once.
+        """
+        barrier = threading.Barrier(len(files))
+        streams = [Stream(s_file, operation, self.blocks_per_file,
+                          self.io_size, self.direct, barrier)
+                   for s_file in files]
+        for stream in streams:
+            stream.start()
+        for stream in streams:
+            stream.join()
+        # the reads of seq_read come one stream at a time, keep them all
+        self.stream_results.setdefault(operation, []).extend(
+            stream.result() for stream in streams)
+        self.stream_latencies.setdefault(operation, []).extend(
+            lat for stream in streams for lat in stream.latencies)
+        self.stream_seconds[operation] = self.stream_seconds.get(
+            operation, 0) + max(stream.elapsed for stream in streams)
+        errors = ["%s: %s" % (stream.path, stream.error)
+                  for stream in streams if stream.error]
+        if errors:
+            self.fail("%s failed: %s" % (operation, "; ".join(errors)))
+
+    def aggregate(self, operation):
+        """
+        Returns the throughput of all the streams of an operation, and the
+        latency percentiles of all their requests for the inprocess ones.
+        """
+        results = self.stream_results.get(operation, [])
+        megabytes = sum(result['megabytes'] for result in results)
+        seconds = self.stream_seconds.get(operation, 0)
+        aggregate = {'streams': len(results), 'megabytes': megabytes,
+                     'seconds': seconds,
+                     'mb_per_sec': megabytes / seconds if seconds else 0}
+        lat = sorted(self.stream_latencies.get(operation, []))
+        if lat:
+            aggregate['requests'] = len(lat)
+            aggregate['lat_usec'] = {'p50': percentile(lat, 50) * 1e6,
+                                     'p90': percentile(lat, 90) * 1e6,
+                                     'p99': percentile(lat, 99) * 1e6,
+                                     'max': lat[-1] * 1e6}
+        return aggregate
+
     def fs_write(self):
         """
          Write out 'streams' files in parallel background task.
         """
-        for i in range(self.streams):
-            s_file = os.path.join(self.workdir, 'poo%d' % (i + 1))
+        files = [os.path.join(self.workdir, 'poo%d' % (i + 1))
+                 for i in range(self.streams)]
+        if self.stream_engine == 'inprocess':
+            self._inprocess_streams('write', files)
+            return
+        cmds = []
+        for s_file in files:
             cmd = 'dd if=/dev/zero of=%s bs=4k count=%d' % \
                 (s_file, self.blocks_per_file)
             for option in self.fs_dd_woptions.split():
                 cmd += " %s=%s" % (option.split(":")[0],
                                    option.split(":")[1])
-            # Wait for everyone to complete
-            proc = process.SubProcess(cmd + ' > /dev/null', shell=True)
-            proc.start()
-            proc.poll()
-            proc.wait()
+            cmds.append(cmd)
+        self._dd_streams('write', cmds)
         sys.stdout.flush()
         sys.stderr.flush()
 
@@ -139,22 +322,29 @@ class ParallelDd(Test):
         """
         Read in 'streams' files in parallel background tasks.
         """
-        for i in range(self.streams):
-            s_file = os.path.join(self.workdir, 'poo%d' % (i + 1))
+        files = [os.path.join(self.workdir, 'poo%d' % (i + 1))
+                 for i in range(self.streams)]
+        if self.stream_engine == 'inprocess':
+            if self.seq_read:
+                for s_file in files:
+                    self._inprocess_streams('read', [s_file])
+            else:
+                self._inprocess_streams('read', files)
+            return
+        cmds = []
+        for s_file in files:
             cmd = 'dd if=%s of=/dev/null bs=4k count=%d' % \
                 (s_file, self.blocks_per_file)
             for option in self.fs_dd_roptions.split():
                 cmd += " %s=%s" % (option.split(":")[0],
                                    option.split(":")[1])
-            if self.seq_read:
+            cmds.append(cmd)
+        if self.seq_read:
+            for cmd in cmds:
                 process.run(cmd + ' > /dev/null', shell=True)
-            else:
-                # Wait for everyone to complete
-                proc = process.SubProcess(cmd + ' > /dev/null', shell=True)
-                proc.start()
-                proc.poll()
-                proc.wait()
-            sys.stdout.flush()
+        else:
+            self._dd_streams('read', cmds)
+        sys.stdout.flush()
 
     def _device_to_fstype(self, s_file, device=None):
         """
@@ -209,6 +399,22 @@ class ParallelDd(Test):
                                       'raw_read': raw_read_rate,
                                       'fs_write': fs_write_rate,
                                       'fs_read': fs_read_rate})
+        results = {'raw_write': raw_write_rate, 'raw_read': raw_read_rate,
+                   'fs_write': fs_write_rate, 'fs_read': fs_read_rate,
+                   'engine': self.stream_engine, 'direct': self.direct,
+                   'streams': self.streams, 'per_stream': self.stream_results,
+                   'aggregate': {}}
+        for operation in sorted(self.stream_results):
+            aggregate = self.aggregate(operation)
+            results['aggregate'][operation] = aggregate
+            self.log.info("fs %s: %d streams, %.2f MB/s%s", operation,
+                          aggregate['streams'], aggregate['mb_per_sec'],
+                          ', p99 latency %.1f usec' %
+                          aggregate['lat_usec']['p99']
+                          if 'lat_usec' in aggregate else '')
+        with open(os.path.join(self.outputdir, 'parallel_dd.json'),
+                  'w') as results_file:
+            json.dump(results, results_file, indent=4)
 
     def tearDown(self):
         """
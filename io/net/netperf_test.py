@@ -23,17 +23,24 @@ unidirectional throughput, and end-to-end latency.
 
 
 import os
+import sys
+import json
 from avocado import Test
 from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import distro
 from avocado.utils import build
 from avocado.utils import archive
 from avocado.utils import process
+from avocado.utils import cpu
 from avocado.utils.genio import read_file
 from avocado.utils.network.interfaces import NetworkInterface
 from avocado.utils.network.hosts import LocalHost, RemoteHost
 from avocado.utils.ssh import Session
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir))
+from misc_api import sysfs
+
 
 class Netperf(Test):
     """
@@ -152,6 +159,7 @@ class Netperf(Test):
         # duration and max values, with additional 60 sec.
         self.timeout = self.duration * self.max + 60
         self.option = self.params.get("option", default='')
+        self.streams = int(self.params.get("streams", default=1))
 
     def test(self):
         """
@@ -167,23 +175,10 @@ class Netperf(Test):
             if not output.exit_status == 0:
                 self.fail("test failed because netserver not available")
         speed = int(read_file("/sys/class/net/%s/speed" % self.iface))
-        cmd = "timeout %s %s -H %s" % (self.timeout, self.perf,
-                                       self.peer_ip)
-        if self.option != "":
-            if "TCP_STREAM" in self.option:
-                socket_size = process.run("cat /proc/sys/net/ipv4/tcp_rmem",
-                                          shell=True, ignore_status=True)
-                cmd = "%s %s -m %s" % (cmd, self.option,
-                                       socket_size.stdout.decode("utf-8").split('\t')[1])
-            elif "UDP_STREAM" in self.option:
-                socket_size = process.run("cat /proc/sys/net/ipv4/udp_mem",
-                                          shell=True, ignore_status=True)
-                cmd = "%s %s -m %s" % (cmd, self.option,
-                                       socket_size.stdout.decode("utf-8").split('\t')[1])
-            else:
-                cmd = "%s -t %s" % (cmd, self.option)
-        cmd = "%s -l %s -i %s,%s" % (cmd, self.duration, self.max,
-                                     self.min)
+        cmd = self.netperf_cmd()
+        if self.streams > 1:
+            self.run_streams(cmd, speed)
+            return
         result = process.run(cmd, shell=True, ignore_status=True)
         if result.exit_status != 0:
             self.fail("FAIL: Run failed")
@@ -200,6 +195,83 @@ class Netperf(Test):
         if 'WARNING' in result.stdout.decode("utf-8"):
             self.log.warn('Test completed with warning')
 
+    def netperf_cmd(self):
+        """
+        Returns the netperf command line for the configured option
+        """
+        cmd = "timeout %s %s -H %s" % (self.timeout, self.perf,
+                                       self.peer_ip)
+        if self.option != "":
+            if "TCP_STREAM" in self.option:
+                socket_size = sysfs.read("/proc/sys/net/ipv4/tcp_rmem", "")
+                cmd = "%s %s -m %s" % (cmd, self.option,
+                                       socket_size.split()[1])
+            elif "UDP_STREAM" in self.option:
+                socket_size = sysfs.read("/proc/sys/net/ipv4/udp_mem", "")
+                cmd = "%s %s -m %s" % (cmd, self.option,
+                                       socket_size.split()[1])
+            else:
+                cmd = "%s -t %s" % (cmd, self.option)
+        cmd = "%s -l %s -i %s,%s" % (cmd, self.duration, self.max,
+                                     self.min)
+        return cmd
+
+    def run_streams(self, cmd, speed):
+        """
+        Runs self.streams netperf instances at once, each pinned to its
+        own CPU on both hosts, and checks the aggregate throughput
+        """
+        local_cpus = cpu.online_list()
+        output = self.session.cmd("getconf _NPROCESSORS_ONLN")
+        if output.exit_status != 0:
+            self.fail("unable to get the CPU count of the peer machine")
+        peer_cpus = int(output.stdout_text.strip())
+        # global options go before the test specific ones after "--"
+        iterations = " -l %s -i %s,%s" % (self.duration, self.max, self.min)
+        global_opts, sep, test_opts = cmd[:-len(iterations)].partition(' -- ')
+        # without -i every instance runs the same single interval, so the
+        # streams overlap for the whole run and their sum is meaningful
+        run_opts = " -l %s" % self.duration
+        procs = []
+        for index in range(self.streams):
+            pinned = "%s%s -P 0 -T %s,%s -- %s -o THROUGHPUT,THROUGHPUT_UNITS" \
+                % (global_opts, run_opts, local_cpus[index % len(local_cpus)],
+                   index % peer_cpus, test_opts if sep else '')
+            proc = process.SubProcess(pinned, shell=True)
+            proc.start()
+            procs.append(proc)
+        results = []
+        units = ''
+        for proc in procs:
+            result = proc.wait()
+            lines = [line for line in proc.get_stdout().decode().splitlines()
+                     if line.strip()]
+            if result != 0 or not lines:
+                self.fail("FAIL: Run failed: %s" % proc.cmd)
+            fields = lines[-1].split(',')
+            results.append(float(fields[0]))
+            units = fields[1] if len(fields) > 1 else units
+        total = sum(results)
+        mean = total / len(results)
+        variance = sum((tput - mean) ** 2 for tput in results) / len(results)
+        # Jain's fairness index, 1 when all the streams get the same share
+        squares = sum(tput ** 2 for tput in results)
+        fairness = total ** 2 / (len(results) * squares) if squares else 0
+        report = {'streams': results, 'aggregate': total, 'units': units,
+                  'variance': variance, 'fairness': fairness}
+        self.log.info("netperf %d streams: %s", self.streams, report)
+        with open(os.path.join(self.outputdir, 'netperf_streams.json'),
+                  'w') as report_file:
+            json.dump(report, report_file, indent=4)
+        self.whiteboard = json.dumps(report)
+        # transaction rates of the RR tests can not be checked against
+        # the link speed
+        if units.startswith('10^6bits') and \
+                total < (int(self.expected_tp) * speed) / 100:
+            self.fail("FAIL: Aggregate throughput Actual - %s%%, Expected - "
+                      "%s%%, Throughput Actual value - %sMb/sec"
+                      % ((total * 100) / speed, self.expected_tp, total))
+
     def tearDown(self):
         """
         removing the data in peer machine
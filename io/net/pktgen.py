@@ -19,9 +19,12 @@
 # https://github.com/autotest/autotest-client-tests/tree/master/pktgen
 
 import os
+import re
+import glob
+import json
 import shutil
 from avocado import Test
-from avocado.utils import process
+from avocado.utils import genio, process
 
 
 class Pktgen(Test):
@@ -40,6 +43,9 @@ class Pktgen(Test):
         self.dst_ip = self.params.get("peer_ip", default="")
         self.dst_mac = self.params.get("peer_mac", default="")
         self.results = self.params.get("resultsdir", default="/tmp/")
+        self.threads = int(self.params.get("threads", default=1))
+        self.pkt_size = self.params.get("pkt_size", default=60)
+        self.saved_affinity = {}
         if not os.path.exists('/proc/net/pktgen'):
             process.system("modprobe pktgen", ignore_status=True, shell=True)
         if not os.path.exists('/proc/net/pktgen'):
@@ -49,32 +55,151 @@ class Pktgen(Test):
         self.validate_net_interface()
         self.ping_test()
 
-        # Adding the devices
+        # kpktgend_N threads run bound to CPU N, one per online CPU
+        self.kthreads = sorted(
+            (int(path.rsplit('_', 1)[1]) for path in
+             glob.glob('/proc/net/pktgen/kpktgend_*')))
+        tx_queues = len(glob.glob('/sys/class/net/%s/queues/tx-*' %
+                                  self.eth))
+        self.max_threads = max(1, min(len(self.kthreads), tx_queues))
+        if self.threads > self.max_threads:
+            self.cancel("%d threads requested, %s supports %d" %
+                        (self.threads, self.eth, self.max_threads))
+        self.add_devices(self.threads, self.pkt_size)
+
+    def devices(self, threads):
+        """
+        pktgen devices, with more than one thread every thread drives
+        its own dev@N clone of the interface
+        """
+        if threads == 1:
+            return [self.eth]
+        return ['%s@%d' % (self.eth, index) for index in range(threads)]
+
+    def add_devices(self, threads, pkt_size):
+        """
+        Spread the interface over threads kpktgend threads, one TX queue
+        per thread, and configure the individual devices
+        """
+        self.start_flag = False
         self.log.info("Adding devices")
-        self.pgdev = '/proc/net/pktgen/kpktgend_0'
-        self.pgset('rem_device_all')
-        self.pgset('add_device %s' % self.eth)
-        self.pgset('max_before_softirq 10000')
-
-        # configure the individual devices
-        self.log.info("Configuring the individual devices")
-        self.pgdev = '/proc/net/pktgen/%s' % self.eth
-        if self.clone_skb:
-            self.pgset('clone_skb %s' % (self.count))
-        self.pgset('min_pkt_size 60')
-        self.pgset('max_pkt_size 60')
-        self.pgset('dst %s' % self.dst_ip)
-        self.pgset('dst_mac %s' % self.dst_mac)
-        self.pgset('count %s' % (self.count))
-
-    def test_pktgen(self):
+        for cpu in self.kthreads:
+            self.pgdev = '/proc/net/pktgen/kpktgend_%d' % cpu
+            self.pgset('rem_device_all')
+        for index, dev in enumerate(self.devices(threads)):
+            self.pgdev = '/proc/net/pktgen/kpktgend_%d' % self.kthreads[index]
+            self.pgset('add_device %s' % dev)
+            self.pgset('max_before_softirq 10000')
+
+            # configure the individual devices
+            self.log.info("Configuring the individual device %s", dev)
+            self.pgdev = '/proc/net/pktgen/%s' % dev
+            if self.clone_skb:
+                self.pgset('clone_skb %s' % (self.count))
+            self.pgset('min_pkt_size %s' % pkt_size)
+            self.pgset('max_pkt_size %s' % pkt_size)
+            self.pgset('dst %s' % self.dst_ip)
+            self.pgset('dst_mac %s' % self.dst_mac)
+            self.pgset('count %s' % (self.count))
+            if threads > 1:
+                self.pgset('queue_map_min %d' % index)
+                self.pgset('queue_map_max %d' % index)
+        if threads > 1:
+            self.bind_queues(threads)
+
+    def set_affinity(self, path, value):
+        """
+        Writes an affinity file, remembering the original value
+        """
+        if not os.path.exists(path):
+            return
+        try:
+            if path not in self.saved_affinity:
+                self.saved_affinity[path] = genio.read_one_line(path)
+            genio.write_one_line(path, value)
+        except OSError as details:
+            self.log.warning("Could not set %s to %s: %s", path, value,
+                             details)
+
+    @staticmethod
+    def cpu_mask(cpu):
+        """
+        Returns the cpumask of one CPU as the kernel prints it, comma
+        separated 32-bit hex words, the highest first
+        """
+        words = ['%08x' % (1 << (cpu % 32))] + ['00000000'] * (cpu // 32)
+        return ','.join(words)
+
+    def bind_queues(self, threads):
+        """
+        Steer TX queue N and its IRQ to the CPU of the thread driving it
+        """
+        for index in range(threads):
+            cpu = self.kthreads[index]
+            xps = '/sys/class/net/%s/queues/tx-%d/xps_cpus' % (self.eth, index)
+            self.set_affinity(xps, self.cpu_mask(cpu))
+        irqs = [line.split(':')[0].strip()
+                for line in genio.read_all_lines('/proc/interrupts')
+                if re.search(r'\b%s\b' % re.escape(self.eth), line)]
+        for index, irq in enumerate(irqs):
+            self.set_affinity('/proc/irq/%s/smp_affinity_list' % irq,
+                              str(self.kthreads[index % threads]))
+
+    def start_traffic(self, threads):
+        """
+        Runs pktgen on every device and returns the summed pps and Mb/s
+        """
         self.pgdev = '/proc/net/pktgen/pgctrl'
         self.start_flag = True
         self.pgset('start')
-        process.system("tail -2 /proc/net/pktgen/%s" % self.eth,
-                       ignore_status=True, shell=True)
+        pps = mbps = 0
+        for dev in self.devices(threads):
+            result = re.search(r'(\d+)pps (\d+)Mb/sec',
+                               genio.read_file('/proc/net/pktgen/%s' % dev))
+            if not result:
+                self.fail("No pktgen result for %s" % dev)
+            pps += int(result.group(1))
+            mbps += int(result.group(2))
+        self.log.info("%d threads, %s byte packets: %d pps %d Mb/sec",
+                      threads, self.pkt_size, pps, mbps)
+        return pps, mbps
+
+    def test_pktgen(self):
+        pps, mbps = self.start_traffic(self.threads)
+        for dev in self.devices(self.threads):
+            process.system("tail -2 /proc/net/pktgen/%s" % dev,
+                           ignore_status=True, shell=True)
         output = os.path.join(self.results, self.eth)
         shutil.copyfile(self.pgdev, output)
+        self.whiteboard = json.dumps({'threads': self.threads, 'pps': pps,
+                                      'mbps': mbps})
+
+    def test_pktgen_scaling(self):
+        """
+        Sweeps packet sizes and thread counts and reports the scaling curve
+        """
+        pkt_sizes = self.params.get("pkt_sizes", default=[60, 512, 1500])
+        thread_counts = self.params.get("thread_counts", default=None)
+        if not thread_counts:
+            thread_counts = [count for count in (1, 2, 4, 8, 16, 32, 64)
+                             if count < self.max_threads]
+            thread_counts.append(self.max_threads)
+        curve = []
+        for threads in thread_counts:
+            if threads > self.max_threads:
+                self.log.warning("Skipping %d threads, %s supports %d",
+                                 threads, self.eth, self.max_threads)
+                continue
+            for pkt_size in pkt_sizes:
+                self.pkt_size = pkt_size
+                self.add_devices(threads, pkt_size)
+                pps, mbps = self.start_traffic(threads)
+                curve.append({'threads': threads, 'pkt_size': pkt_size,
+                              'pps': pps, 'mbps': mbps})
+        with open(os.path.join(self.outputdir, 'pktgen_scaling.json'),
+                  'w') as curve_file:
+            json.dump(curve, curve_file, indent=4)
+        self.whiteboard = json.dumps(curve)
 
     def pgset(self, command):
         file_name = open(self.pgdev, 'w')
@@ -105,3 +230,10 @@ class Pktgen(Test):
         self.log.info("Ping response value is %d" % ping_response)
         if ping_response != 0:
             self.cancel("Host not reachable")
+
+    def tearDown(self):
+        for path, value in self.saved_affinity.items():
+            try:
+                genio.write_one_line(path, value)
+            except OSError:
+                self.log.debug("Could not restore %s", path)
@@ -19,7 +19,9 @@
 Tests for Network virtualized device
 '''
 
+import json
 import os
+import sys
 import time
 import shutil
 import netifaces
@@ -40,6 +42,10 @@ from pexpect import pxssh
 import re
 from avocado.utils.network.hosts import RemoteHost
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, os.pardir, os.pardir))
+from misc_api.netlink import LinkWatcher
+
 IS_POWER_NV = 'PowerNV' in open('/proc/cpuinfo', 'r').read()
 IS_KVM_GUEST = 'qemu' in open('/proc/cpuinfo', 'r').read()
 
@@ -61,6 +67,15 @@ class NetworkVirtualization(Test):
         '''
         set up required packages and gather necessary test inputs
         '''
+        # follow the link events from the start, failovers are timed
+        # from them instead of sleeping
+        self.link_watcher = LinkWatcher()
+        self.link_watcher.start()
+        self.failover_latency = []
+        self.failover_timeout = int(self.params.get('failover_timeout',
+                                                    default=120))
+        self.carrier_timeout = int(self.params.get('carrier_down_timeout',
+                                                   default=30))
         self.install_packages()
         self.hmc_ip = wait.wait_for(
             lambda: self.get_mcp_component("HMCIPAddr"), timeout=30)
@@ -220,7 +235,7 @@ class NetworkVirtualization(Test):
                 process.run('startsrc -g %s' % svc, shell=True, sudo=True)
         except CmdError as details:
             self.log.debug(str(details))
-            self.fail("Starting service %s failed", svc)
+            self.fail("Starting service %s failed" % svc)
 
         output = process.system_output("lssrc -a", ignore_status=True,
                                        shell=True, sudo=True)
@@ -423,14 +438,15 @@ class NetworkVirtualization(Test):
         original = self.get_active_device_logport(self.slot_num[0])
         for _ in range(self.count):
             before = self.get_active_device_logport(self.slot_num[0])
+            device = self.find_device(self.mac_id[0])
+            mark = self.link_watcher.mark()
             self.trigger_failover(self.get_backing_device_logport
                                   (self.slot_num[0]))
-            time.sleep(60)
+            self.measure_failover(mark, device)
             after = self.get_active_device_logport(self.slot_num[0])
             self.log.debug("Active backing device: %s", after)
             if before == after:
                 self.fail("No failover happened")
-            device = self.find_device(self.mac_id[0])
             networkinterface = NetworkInterface(device, self.local)
             if networkinterface.ping_check(self.peer_ip[0], count=5) is not None:
                 self.fail("Failover has affected Network connectivity")
@@ -451,12 +467,13 @@ class NetworkVirtualization(Test):
                 for val in range(int(self.backing_dev_count())):
                     self.log.info("Performing Client initiated\
                                   failover - Attempt %s", int(val + 1))
+                    device = self.find_device(self.mac_id[0])
+                    mark = self.link_watcher.mark()
                     genio.write_file_or_fail("/sys/devices/vio/%s/failover"
                                              % device_id, "1")
-                    time.sleep(60)
+                    self.measure_failover(mark, device)
                     self.log.info("Running a ping test to check if failover \
                                     affected Network connectivity")
-                    device = self.find_device(self.mac_id[0])
                     networkinterface = NetworkInterface(device, self.local)
                     if networkinterface.ping_check(self.peer_ip[0], count=5, options="-w50") is not None:
                         self.fail("Ping test failed. Network virtualized \
@@ -481,16 +498,17 @@ class NetworkVirtualization(Test):
                 backing_dev_priority = self.get_backing_device_priority(
                     self.slot_num[0])
                 if self.enable_auto_failover():
+                    device = self.find_device(self.mac_id[0])
+                    mark = self.link_watcher.mark()
                     if not self.change_failover_priority(backing_logport, '1'):
                         self.fail(
-                            "Fail to change the priority for backing device %s", backing_logport)
+                            "Fail to change the priority for backing device %s" % backing_logport)
                     if not self.change_failover_priority(active_logport, '100'):
                         self.fail(
-                            "Fail to change the priority for active device %s", active_logport)
-                    time.sleep(60)
+                            "Fail to change the priority for active device %s" % active_logport)
+                    self.measure_failover(mark, device)
                     if backing_logport != self.get_active_device_logport(self.slot_num[0]):
                         self.fail("Auto failover of backing device failed")
-                    device = self.find_device(self.mac_id[0])
                     networkinterface = NetworkInterface(device, self.local)
                     if networkinterface.ping_check(self.peer_ip[0], count=5) is not None:
                         self.fail("Auto failover has effected connectivity")
@@ -537,12 +555,13 @@ class NetworkVirtualization(Test):
         before = self.get_active_device_logport(self.slot_num[0])
         self.log.debug("Active backing device before : %s", before)
 
+        mark = self.link_watcher.mark()
         self.validate_vios_command('rmdev -l %s' % vnic_server, 'Defined')
         if vnic_backing_device:
             self.validate_vios_command(
                 'rmdev -l %s' % vnic_backing_device, 'Defined')
 
-        time.sleep(10)
+        self.measure_failover(mark, device)
 
         for backing_dev in self.backing_dev_list().splitlines():
             if backing_dev.startswith('%s,' % self.slot_num[0]):
@@ -550,8 +569,6 @@ class NetworkVirtualization(Test):
                 if 'Powered Off' not in backing_dev:
                     self.fail("Failover did not occur")
 
-        time.sleep(60)
-
         if vnic_backing_device:
             self.validate_vios_command(
                 'mkdev -l %s' % vnic_backing_device, 'Available')
@@ -654,11 +671,14 @@ class NetworkVirtualization(Test):
         if self.backing_dev_count() == 1:
             self.cancel("EEH cannot be tested as the interface has single backing device")
         current_logport = self.get_active_device_logport(self.slot_num[0])
+        device = self.find_device(self.mac_id[0])
         if not self.original_logport == current_logport:
             self.trigger_failover(self.original_logport)
         else:
             self.log.info("Unable to set the logport to original one")
-        time.sleep(5)
+        if not self.link_watcher.wait_ready(device, self.failover_timeout):
+            self.fail("%s not ready after the failover to the original "
+                      "logport" % device)
         self.session = Session(self.vios_ip, user=self.vios_user,
                                password=self.vios_pwd)
         self.session.cleanup_master()
@@ -700,8 +720,8 @@ class NetworkVirtualization(Test):
                     map_start_value = i.split("=")[1]
             vios.sendline("quit")
             cmd = "./eeh_tool_64 %s 3 15 -w 64 -a %s -m 0xFFFFFFFFFFFFF000" % (vnic_backingdevice, map_start_value)
+            mark = self.link_watcher.mark()
             vios.sendline(cmd)
-            time.sleep(5)
         else:
             cmd = "lnc2ent setacs %s" % vnic_backingdevice
             vios.sendline(cmd)
@@ -715,12 +735,12 @@ class NetworkVirtualization(Test):
                     tce_start_value = i.split("=")[1]
             vios.sendline("quit")
             cmd = "./eeh_tool_64 %s 3 15 -w 64 -a %s -m 0xFFFFFFFFFFFFF000" % (vnic_backingdevice, tce_start_value)
+            mark = self.link_watcher.mark()
             vios.sendline(cmd)
-            time.sleep(5)
+        self.measure_failover(mark, device)
         active_logport = self.get_active_device_logport(self.slot_num[0])
         if current_logport == active_logport:
             self.fail("EEH unsuccessful as there is no failover triggered on the OS")
-        device = self.find_device(self.mac_id[0])
         networkinterface = NetworkInterface(device, self.local)
         if networkinterface.ping_check(self.peer_ip[0], count=5) is not None:
             self.fail("Ping to peer failed. EEH has affected Network connectivity")
@@ -750,15 +770,37 @@ class NetworkVirtualization(Test):
         :returns: if the device is up or down
         :rtype: bool
         """
-        for _ in range(0, 120, 10):
-            for interface in netifaces.interfaces():
-                if device_name == interface:
-                    self.log.info(
-                        "Network virtualized device %s is up", device_name)
-                    return True
-                time.sleep(5)
+        if self.link_watcher.wait_link(device_name, timeout=120):
+            self.log.info(
+                "Network virtualized device %s is up", device_name)
+            return True
         return False
 
+    def measure_failover(self, mark, device):
+        """
+        Wait for the device to be back after a failover triggered at mark
+        and record how long the failover took
+        :param mark: time of the failover trigger, from the link watcher
+        :param device: vnic device that is tested
+        :type device: str
+
+        :returns: seconds from the trigger to each failover step
+        :rtype: dict
+        """
+        latency = self.link_watcher.failover(
+            device, mark, self.peer_ip[0], down_timeout=self.carrier_timeout,
+            timeout=self.failover_timeout)
+        latency['iteration'] = len(self.failover_latency) + 1
+        self.failover_latency.append(latency)
+        self.log.info("Failover #%d of %s: carrier down %ss, carrier up "
+                      "%ss, ready %ss, first ping %ss", latency['iteration'],
+                      device, latency['carrier_down'], latency['carrier_up'],
+                      latency['ready'], latency['first_ping'])
+        if latency['ready'] is None:
+            self.fail("Network virtualized device %s not ready %ss after "
+                      "failover" % (device, self.failover_timeout))
+        return latency
+
     def test_backingdevremove(self):
         """
         Removing Backing device for Network virtualized device
@@ -1125,14 +1167,7 @@ class NetworkVirtualization(Test):
         """
         Wait till interface come up
         """
-        for _ in range(0, 120, 10):
-            for interface in netifaces.interfaces():
-                if device_name == interface:
-                    self.log.info(
-                        "Network virtualized device %s is up", device_name)
-                    return True
-                time.sleep(5)
-        return False
+        return self.wait_interface(device_name)
 
     def check_dmesg_error(self):
         """
@@ -1157,6 +1192,11 @@ class NetworkVirtualization(Test):
             self.fail("test failed,check dmesg log in debug log")
 
     def tearDown(self):
+        self.link_watcher.stop()
+        if self.failover_latency:
+            with open(os.path.join(self.outputdir, 'failover_latency.json'),
+                      'w') as latency_file:
+                json.dump(self.failover_latency, latency_file, indent=2)
         if 'vios' in str(self.name.name):
             self.session.quit()
         try:
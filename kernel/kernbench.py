@@ -18,9 +18,11 @@
 # Based on code by "mbligh@google.com (Martin Bligh)"
 # https://github.com/autotest/autotest-client-tests/commits/master/kernbench
 
+import json
 import os
 import re
 import platform
+import sys
 
 from avocado import Test
 from avocado.utils import build
@@ -30,6 +32,10 @@ from avocado.utils import distro
 from avocado.utils import archive
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import repetition
+
 
 class Kernbench(Test):
     """
@@ -123,6 +129,16 @@ class Kernbench(Test):
                 self.cancel('%s is needed for the test to be run' % package)
         self.kernel_version = platform.uname()[2]
         self.iterations = self.params.get('runs', default=1)
+        # a build is long, no warmup by default
+        self.warmup = int(self.params.get('warmup', default=0))
+        self.min_runs = int(self.params.get('min_runs', default=3))
+        self.target_ci = float(self.params.get('target_ci', default=2))
+        self.max_runs = int(self.params.get('max_runs', default=10))
+        self.time_cap = float(self.params.get('time_cap', default=7200))
+        self.noise = repetition.NoiseControl(
+            self.params.get('pin_cpus', default=''),
+            self.params.get('governor', default=''),
+            self.params.get('drop_caches', default=False), log=self.log)
         self.threads = self.params.get('cpus', default=None)
         if self.threads is None:
             self.threads = 2 * cpu.online_cpus_count()
@@ -144,23 +160,33 @@ class Kernbench(Test):
 
         self.log.info("Starting build the kernel")
         timefile = "%s/time_file" % self.sourcedir
-        # Build kernel
-        user_time = 0
-        system_time = 0
-        elapsed_time = 0
-        for run in range(self.iterations):
-            self.log.info("Iteration: %s" % (int(run) + 1))
+
+        def run(iteration):
+            self.log.info("Iteration: %s", iteration)
             self.time_build(self.threads, timefile, "")
             # Processing the timefile
-            results = open(timefile).readline().strip()
-            (user, system, elapsed) = self.extract_all_time_results(results)[0]
-            user_time += float(user)
-            system_time += float(system)
-            elapsed_time += float(elapsed)
+            with open(timefile) as time_file:
+                results = time_file.readline().strip()
+            times = self.extract_all_time_results(results)
+            if not times:
+                self.log.warning("No times in %s: %s", timefile, results)
+                return None
+            (user, system, elapsed) = times[0]
+            return {'elapsed': float(elapsed), 'user': float(user),
+                    'system': float(system)}
+
+        # Build kernel, until the 95% confidence interval of the mean
+        # elapsed time is within target_ci percent of it
+        summary = repetition.Repeater(
+            run, warmup=self.warmup, min_runs=self.min_runs,
+            max_runs=self.max_runs, target_ci=self.target_ci,
+            runs=int(self.iterations),
+            time_cap=self.time_cap, noise=self.noise, log=self.log).run()
+        self.whiteboard = json.dumps(summary)
+        if not summary['runs']:
+            self.fail("No build time found in %s" % timefile)
         # Results
         self.log.info("Performance figures:")
-        self.log.info("Iterations        : %s", self.iterations)
+        self.log.info("Iterations        : %s", summary['runs'])
         self.log.info("Number of threads     : %s", self.threads)
-        self.log.info("User      : %s", user_time)
-        self.log.info("System    : %s", system_time)
-        self.log.info("Elapsed   : %s", elapsed_time)
+        repetition.report(summary, log=self.log)
@@ -19,15 +19,67 @@
 # https://github.com/autotest/autotest-client-tests/tree/master/dma_memtest
 
 
+import hashlib
 import os
 import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from avocado import Test
 from avocado.utils import process
 from avocado.utils import disk
 from avocado.utils import archive
 from avocado.utils import memory
 
+HASH_CHUNK = 1024 * 1024
+
+
+def file_digest(path):
+    """
+    Return the sha1 hex digest of a file, or of the target of a symlink.
+    """
+    if os.path.islink(path):
+        return 'link:%s' % os.readlink(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tree_paths(root):
+    """
+    Return the paths of the files and symlinks under root, relative to it.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        # symlinks to directories are hashed as links, not walked
+        names = filenames + [name for name in dirnames
+                             if os.path.islink(os.path.join(dirpath, name))]
+        paths.extend(os.path.normpath(os.path.join(rel_dir, name))
+                     for name in names)
+    return paths
+
+
+def tree_manifest(root, pool):
+    """
+    Return the dict of relative path to digest of the tree under root,
+    hashing the files on the worker pool.
+    """
+    paths = tree_paths(root)
+    digests = pool.map(file_digest, [os.path.join(root, path)
+                                     for path in paths])
+    return dict(zip(paths, digests))
+
+
+def manifest_diff(base, copy):
+    """
+    Return the sorted paths whose digest differs between two manifests,
+    including the paths missing from either.
+    """
+    return sorted(path for path in set(base) | set(copy)
+                  if base.get(path) != copy.get(path))
+
 
 class DmaMemtest(Test):
 
@@ -67,6 +119,9 @@ class DmaMemtest(Test):
                                       '74')
         parallel = self.params.get('parallel', default=True)
         self.parallel = parallel
+        self.verify = self.params.get('verify', default='diff')
+        self.hash_workers = self.params.get('hash_workers',
+                                            default=os.cpu_count())
         self.log.info('Downloading linux kernel tarball')
         self.tarball = self.fetch_asset(tarball_url, asset_hash=tarball_md5,
                                         algorithm='md5')
@@ -87,6 +142,15 @@ class DmaMemtest(Test):
         self.log.info('Estimated size after uncompression: %s', est_size)
         self.log.info('Number of copies: %s', self.sim_cps)
         self.log.info('Parallel: %s', parallel)
+        self.log.info('Verify: %s', self.verify)
+
+        self.base_manifest = None
+        if self.verify == 'hash':
+            # Hash the base copy once, while it is still in the page cache
+            with ThreadPoolExecutor(max_workers=self.hash_workers) as pool:
+                self.base_manifest = tree_manifest(self.base_dir, pool)
+            self.log.info('Hashed %d files of the base copy',
+                          len(self.base_manifest))
 
         # Verify if space is available in disk
         disk_free_mb = (disk.freespace(self.tmpdir) // 1024) // 1024
@@ -137,6 +201,44 @@ class DmaMemtest(Test):
             self.log.info("Wait background processes before proceed")
             for proc in parallel_procs:
                 proc.wait()
+        if self.verify == 'hash':
+            self.hash_compare()
+        else:
+            self.diff_compare()
+
+        if self.nfail != 0:
+            self.fail('DMA memory test failed.')
+        else:
+            self.log.info('DMA memory test passed.')
+
+    def hash_compare(self):
+        """
+        Compare the digests of every test copy with the base copy manifest,
+        reading each copy once on a pool of hashing workers.
+        """
+        self.log.info('Hashing test copies with %s workers',
+                      self.hash_workers)
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as pool:
+            for j in range(self.sim_cps):
+                tmp_dir = 'linux.%s' % j
+                manifest = tree_manifest(os.path.join(self.tmpdir, tmp_dir),
+                                         pool)
+                mismatches = manifest_diff(self.base_manifest, manifest)
+                if not mismatches:
+                    self.log.info('%s matches the base copy', tmp_dir)
+                    continue
+                self.nfail += 1
+                self.log.error('%s differs from the base copy in %d files',
+                               tmp_dir, len(mismatches))
+                for path in mismatches:
+                    self.log.error('  %s/%s: expected %s, got %s', tmp_dir,
+                                   path, self.base_manifest.get(path),
+                                   manifest.get(path))
+
+    def diff_compare(self):
+        """
+        Compare every test copy with the base copy using diff.
+        """
         parallel_procs = []
         self.log.info('Comparing test copies with base copy')
         for j in range(self.sim_cps):
@@ -170,11 +272,6 @@ class DmaMemtest(Test):
         # Clean up for the next iteration
         parallel_procs = []
 
-        if self.nfail != 0:
-            self.fail('DMA memory test failed.')
-        else:
-            self.log.info('DMA memory test passed.')
-
     def tearDown(self):
         self.log.info('Cleaning up')
         for j in range(self.sim_cps):
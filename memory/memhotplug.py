@@ -14,6 +14,7 @@
 # Author: Abdul Haleem <abdhalee@linux.vnet.ibm.com>
 
 import os
+import sys
 import glob
 import re
 import multiprocessing
@@ -22,6 +23,11 @@ from avocado import Test
 from avocado.utils import process, memory, build, archive, dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api.kmsg import KmsgWatcher
+from misc_api import sysfs
+
 
 MEM_PATH = '/sys/devices/system/memory'
 ERRORLOG = ['WARNING: CPU:', 'Oops',
@@ -53,10 +59,12 @@ def offline(block):
 
 def get_hotpluggable_blocks(path, ratio):
     mem_blocks = []
+    # read the removable flag of every block at once
+    blocks = sysfs.snapshot(MEM_PATH, include=['removable'])
     for mem_blk in glob.glob(path):
-        block = re.findall(r"\d+", os.path.basename(mem_blk))[0]
-        block = re.sub(r'^\s*$', '', block)
-        if memory.is_hot_pluggable(block):
+        name = os.path.basename(mem_blk)
+        block = re.findall(r"\d+", name)[0]
+        if blocks.get(name, {}).get('removable') == '1':
             mem_blocks.append(block)
 
     def chunks(num):
@@ -127,6 +135,11 @@ class MemStress(Test):
             if not self.__is_auto_online():
                 self.hotplug_all(self.blocks_hotpluggable)
         dmesg.clear_dmesg()
+        self.kmsg = KmsgWatcher(ERRORLOG)
+        # stop the stress run on the first fatal message, not at its end
+        self.kmsg.subscribe(
+            lambda hit: process.kill_process_by_pattern('stress'))
+        self.kmsg.start()
 
     def hotunplug_all(self, blocks):
         for block in blocks:
@@ -150,13 +163,8 @@ class MemStress(Test):
             return False
 
     def __error_check(self):
-        err_list = []
-        logs = process.system_output("dmesg -Txl 1,2,3,4").splitlines()
-        for error in ERRORLOG:
-            for log in logs:
-                if error in log.decode():
-                    err_list.append(log)
-        if "\n".join(err_list):
+        if self.kmsg.hits:
+            self.log.error("\n".join(self.kmsg.messages()))
             collect_dmesg(self)
             self.fail('ERROR: Test failed, please check the dmesg logs')
 
@@ -167,6 +175,7 @@ class MemStress(Test):
                     (cpu_count, self.iocount, self.vmcount,
                      mem_free, self.stresstime), ignore_status=True,
                     sudo=True, shell=True)
+        self.__error_check()
 
     def test_hotplug_loop(self):
         self.log.info("\nTEST: hotunplug and hotplug in a loop\n")
@@ -232,4 +241,6 @@ class MemStress(Test):
         self.__error_check()
 
     def tearDown(self):
+        if hasattr(self, 'kmsg'):
+            self.kmsg.stop()
         self.hotplug_all(self.blocks_hotpluggable)
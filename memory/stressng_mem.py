@@ -14,15 +14,23 @@
 # Copyright: 2022 IBM
 # Author: Rohan Deshpande <rohan_d@linux.ibm.com>
 
+import json
 import os
+import sys
 from avocado import Test
-from avocado.utils import process
 from avocado.utils import memory
 from avocado.utils import build
 from avocado.utils import archive
 from avocado.utils import dmesg
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import calltrace
+from misc_api import numa
+from misc_api import stressng
+from misc_api.baseline import STORE_PATH
+
 
 class Stressngmem(Test):
     """
@@ -35,6 +43,9 @@ class Stressngmem(Test):
     :params:
     --base-time <time_in_seconds>
     --time-per-gig <time_in_seconds>
+    --baseline <check|update|off> compare the bogo-ops/s of every stressor
+                with the baseline of the kernel and platform
+    --tolerance <percent> accepted bogo-ops/s drop against the baseline
     """
 
     def read_line_with_matching_pattern(self, filename, pattern):
@@ -47,114 +58,84 @@ class Stressngmem(Test):
 
     def extract_call_traces(self, filename, ignore_patterns):
         """
-        Extract full call traces from dmesg, excluding OOM-related traces.
-        Returns a list of unique call trace blocks.
+        Extract the call traces from dmesg, excluding OOM-related traces,
+        and record their signatures in the call trace index.
+        Returns a list of (call trace report, index entry), one per unique
+        signature.
         """
-        call_traces = []
-        unique_traces = set()
-
         with open(filename, 'r') as file_obj:
-            lines = file_obj.readlines()
-            i = 0
-            while i < len(lines):
-                line = lines[i].rstrip("\n")
-
-                # Check if this is the start of a call trace
-                if 'Call Trace:' in line:
-                    # Check if this trace should be ignored (OOM-related)
-                    should_ignore = False
-                    for ignore_pattern in ignore_patterns:
-                        if ignore_pattern in line:
-                            should_ignore = True
-                            break
-
-                    if not should_ignore:
-                        # Collect the full call trace
-                        trace_lines = [line]
-                        i += 1
-
-                        # Continue collecting lines that are part of the call trace
-                        # Call trace lines typically start with spaces or specific patterns
-                        while i < len(lines):
-                            next_line = lines[i].rstrip("\n")
-
-                            # Check if still part of call trace (indented or contains function names)
-                            if (next_line.strip().startswith('[') or
-                                next_line.strip().startswith('?') or
-                                '0x' in next_line or
-                                '+0x' in next_line or
-                                next_line.strip().startswith('---[') or
-                                (len(next_line) > 0 and next_line[0] == ' ' and
-                                 any(c in next_line for c in ['[', ']', '+']))):
-
-                                # Check if this line should be ignored
-                                line_should_ignore = False
-                                for ignore_pattern in ignore_patterns:
-                                    if ignore_pattern in next_line:
-                                        line_should_ignore = True
-                                        should_ignore = True  # Mark entire trace as ignored
-                                        break
-
-                                if not line_should_ignore:
-                                    trace_lines.append(next_line)
-                                i += 1
-                            else:
-                                # End of call trace
-                                break
-
-                        # Add the complete trace if not ignored
-                        if not should_ignore and trace_lines:
-                            trace_block = '\n'.join(trace_lines)
-                            # Use first line as key for uniqueness
-                            trace_key = trace_lines[0]
-                            if trace_key not in unique_traces:
-                                unique_traces.add(trace_key)
-                                call_traces.append(trace_block)
-                        continue
-
-                i += 1
-
+            reports = calltrace.extract_reports(file_obj, ignore_patterns)
+        index = calltrace.TraceIndex(self.trace_index)
+        call_traces = []
+        for report in calltrace.unique_reports(reports):
+            if not report['frames']:
+                # reports without a call trace are checked by pattern
+                continue
+            call_traces.append((report, index.record(report, self.name)))
         return call_traces
 
-    def process_looping(self, list_of_stressors):
-        loop_count = 0
-        while loop_count < len(list_of_stressors):
-            return_code = self.execute_stressor(list_of_stressors[loop_count])
-            loop_count = loop_count + 1
-        return return_code
-
-    def execute_stressor(self, stressor):
-        if self.stressor_flag == "crt":
-            run_time = self.base_time
-        elif self.stressor_flag == "vrt":
-            run_time = self.variable_time
-
-        end_time = ((run_time)*(15/10))
-        self.log.info(
-            "Running stress-ng : %s stressor for %s seconds",
-            stressor, run_time)
-
-        # Use "timeout" command to launch stress-ng, in order catch it;
-        # should it go into la-la land
-        cmd = "timeout -s 9 %s stress-ng --aggressive --verify \
-                --timeout %s --%s 0" % (end_time, run_time, stressor)
-        return_code = process.system(cmd, ignore_status=True)
-        self.log.info("Return code is %s", return_code)
-
-        if (return_code != 0):
-            self.had_error = 1
-            self.log.info(
-                "=====================================================")
-            if (return_code == 137):
-                self.log.info("== > stress-ng memory test timed out and \
-                              was forcefully terminated!")
-            else:
-                self.log.info(
-                    "==> Error %s reported on stressor %s!",
-                    return_code, stressor)
-            self.log.info(
-                "=====================================================")
-        return return_code
+    def check_metrics(self, result, config):
+        """
+        Record the stress-ng metrics of a stressor run and compare its
+        bogo-ops/s with the baseline.
+        """
+        if not result['metrics']:
+            return
+        if len(self.slots) > 1:
+            # a stressor bound to a slot is compared with its runs on as
+            # many CPUs only
+            config = "%s-%dcpu" % (config, result['instances'])
+        self.regressions.extend(stressng.check(
+            {result['stressor']: result['metrics']}, self.baseline,
+            self.tolerance, config=config, test=self.name,
+            path=self.results_store))
+
+    def check_regressions(self):
+        """
+        Fail when the throughput of stressors regressed.
+        """
+        if self.regressions:
+            self.fail("%d stress-ng throughput metrics regressed beyond %s%% "
+                      "of the baseline: %s" % (
+                          len(self.regressions), self.tolerance,
+                          ", ".join(sorted(set(reg['stressor'] for reg in
+                                               self.regressions)))))
+
+    def run_stressors(self, tasks, options, budget, config):
+        """
+        Run the stressors concurrently on the NUMA slots within budget
+        seconds, queueing the failed ones again.
+        Returns the result of the last attempt of every stressor.
+        """
+        scheduler = stressng.StressorScheduler(
+            tasks, self.slots, self.outputdir, options, budget=budget,
+            retries=self.retries, memory_usage=self.memory_usage,
+            log=self.log)
+        results = scheduler.run()
+        with open(os.path.join(self.outputdir, "stressors.json"),
+                  "a") as json_file:
+            json.dump(results, json_file, indent=2)
+            json_file.write("\n")
+        last = stressng.last_attempts(results)
+        for result in last:
+            # the bogo-ops of a failed run are no baseline nor regression
+            if result['status'] == 0:
+                self.check_metrics(result, config)
+            if result['attempt'] > 1 and result['status'] == 0:
+                self.log.warning("stress-ng %s passed on attempt %s",
+                                 result['stressor'], result['attempt'])
+        return last
+
+    def estimate_runtime(self, tasks, budget):
+        """
+        Log the runtime of the stressors spread over the NUMA slots.
+        """
+        runtime = sum(run_time for _, run_time in tasks) / len(self.slots)
+        if budget:
+            runtime = min(runtime, budget)
+        self.log.info("%d stressors on %d NUMA slot(s), estimated runtime "
+                      "is %s minutes", len(tasks), len(self.slots),
+                      round(runtime / 60.0, 1))
 
     def calculate_variable_time(self):
         self.total_memory_in_GiB = memory.meminfo.MemTotal.g
@@ -178,7 +159,6 @@ class Stressngmem(Test):
         vrt_stressors_list = ["malloc", "mincore", "vm", "bigheap", "brk",
                               "mmap"]
 
-        self.had_error = 0
         self.skip_teardown_dmesg_check = False  # Flag to skip dmesg check in tearDown
         self.base_time = self.params.get("base_time", default=300)
         self.time_per_gig = self.params.get("time_per_gig", default=10)
@@ -188,6 +168,21 @@ class Stressngmem(Test):
             "crt_stressors", default=crt_stressors_list)
         self.vrt_stressors = self.params.get(
             "vrt_stressors", default=vrt_stressors_list)
+        self.trace_index = self.params.get(
+            "trace_index", default=calltrace.INDEX_PATH)
+        self.baseline = self.params.get("baseline", default="check")
+        self.tolerance = float(self.params.get("tolerance", default=10))
+        self.results_store = self.params.get("results_store",
+                                             default=STORE_PATH)
+        self.regressions = []
+        self.time_budget = int(self.params.get("time_budget", default=0))
+        self.vm_class_budget = int(self.params.get("vm_class_budget",
+                                                   default=3600))
+        self.retries = int(self.params.get("retries", default=1))
+        self.memory_usage = float(self.params.get("memory_usage",
+                                                  default=0.9))
+        self.slots = numa.slots(self.params.get("nodes_per_stressor",
+                                                default=1))
 
         for package in ['gcc', 'make', 'libattr-devel', 'libcap-devel',
                         'libgcrypt-devel', 'zlib-devel', 'libaio-devel']:
@@ -219,57 +214,56 @@ class Stressngmem(Test):
 
         self.calculate_variable_time()
 
-        crt_runtime = (len(self.crt_stressors) * self.base_time)
-        vrt_runtime = (len(self.vrt_stressors) * self.variable_time)
-        total_runtime = ((crt_runtime + vrt_runtime) / 60)
-        self.log.info("Total estimated runtime is : %s minutes", total_runtime)
-
-        # Loop through each constant_run_time stressors
-        self.stressor_flag = "crt"
-        return_code = self.process_looping(self.crt_stressors)
-
-        # Loop through each variable_run_time stressors
-        self.stressor_flag = "vrt"
-        return_code = self.process_looping(self.vrt_stressors)
+        # the longest first, the short ones fill the slots at the end
+        tasks = [(stressor, self.variable_time)
+                 for stressor in self.vrt_stressors]
+        tasks += [(stressor, self.base_time)
+                  for stressor in self.crt_stressors]
+        self.estimate_runtime(tasks, self.time_budget)
+
+        results = self.run_stressors(tasks, "--aggressive --verify",
+                                     self.time_budget, "aggressive-verify")
+        failed = ["%s (%s)" % (result['stressor'], result['status'])
+                  for result in results if result['status']]
+        skipped = [result['stressor'] for result in results
+                   if result['skipped']]
+        if skipped:
+            self.log.warning("Not run for lack of time: %s",
+                             ", ".join(skipped))
 
         self.log.info("=====================================================")
-        if self.had_error == 0:
+        if not failed:
             self.log.info("==> stress-ng memory test passed!")
         else:
-            self.fail("==> stress-ng memory test failed; most recent error \
-                    was %s" % return_code)
+            self.fail("==> stress-ng memory test failed; stressors failing "
+                      "after %s retries: %s" % (self.retries,
+                                                ", ".join(failed)))
         self.log.info("=====================================================")
+        self.check_regressions()
 
     def test_vm_class_sequential(self):
         """
-        Test VM and memory-related stressors sequentially with specific options.
-        Runs stressors in sequence for exactly 1 hour total.
+        Test VM and memory-related stressors with specific options.
+        Every stressor runs for 60 seconds, one at a time on every NUMA
+        slot, the slots running concurrently, within vm_class_budget
+        seconds (1 hour by default).
 
         Command breakdown:
         --no-oom-adjust: Don't adjust OOM killer settings
         --oomable: Allow OOM killer to terminate stressors
-        --seq 0: Run stressors sequentially (one at a time)
-        -t 60s: Each stressor runs for 60 seconds
+        --timeout 60: Each stressor runs for 60 seconds
         --perf: Enable performance statistics
         -v: Verbose output
         --verify: Verify results
 
-        Stressors to run sequentially (60 total, 1 hour runtime):
+        Stressors (59 total, 1 hour runtime on one NUMA node):
         VM stressors: vm, vm-rw, vm-addr, vm-splice, mmap, mremap,
                       mlock, mincore, madvise, msync, mprotect
         Memory stressors: malloc, brk, stack, bigheap
         Other: tlb-shootdown, fault, userfaultfd, fork, exec, memfd,
                numa, pkey, remap, rmap, shm, switch, tmpfs, pthread, swap
         """
-        self.log.info("=====================================================")
-        self.log.info("Starting VM class sequential stress test")
-        self.log.info("Expected runtime: Approximately 60 minutes")
-        self.log.info("=====================================================")
-
-        # Set flag to skip dmesg check in tearDown. We check it here instead
-        self.skip_teardown_dmesg_check = True
-
-        # List of all stressors to run sequentially (60 stressors × 60s = 3600s = 60 minutes)
+        # List of all stressors (59 stressors x 60s = 3540s = 59 minutes)
         stressors = [
             "tlb-shootdown", "fault", "userfaultfd", "fork", "exec", "memfd",
             "numa", "pkey", "remap", "rmap", "shm", "switch", "tmpfs",
@@ -279,36 +273,39 @@ class Stressngmem(Test):
             # Memory stressors
             "malloc", "brk", "stack", "bigheap",
             # Additional VM/memory stressors
-            "memcpy", "memfd", "memrate", "memthrash", "mq", "pipe",
+            "memcpy", "memrate", "memthrash", "mq", "pipe",
             "shm-sysv", "mmapfork", "mmapmany", "mmapfixed", "mmaphuge",
             "context", "clone", "vfork", "vforkmany", "zombie",
             "get", "getrandom", "handle", "heapsort", "hdd",
             "hsearch", "icache", "iomix", "itimer",
             "kcmp", "key", "kill", "klog", "lease"
         ]
+        tasks = [(stressor, 60) for stressor in stressors]
 
-        # Base command with common options
-        base_cmd = "stress-ng --no-oom-adjust --oomable --seq 0 -t 60s --perf -v --verify"
-
-        # Build the full command with all stressors
-        stressor_args = []
-        for stressor in stressors:
-            stressor_args.append("--%s 0" % stressor)
-
-        full_cmd = "%s %s" % (base_cmd, " ".join(stressor_args))
-
-        self.log.info("Executing command: %s", full_cmd)
+        self.log.info("=====================================================")
+        self.log.info("Starting VM class stress test")
+        self.estimate_runtime(tasks, self.vm_class_budget)
+        self.log.info("=====================================================")
 
-        # Set timeout to 90 minutes (1.5x expected 60 minutes) for safety
-        timeout_seconds = 90 * 60
-        cmd_with_timeout = "timeout -s 9 %s %s" % (timeout_seconds, full_cmd)
+        # Set flag to skip dmesg check in tearDown. We check it here instead
+        self.skip_teardown_dmesg_check = True
 
-        self.log.info("Running VM class sequential test...")
-        return_code = process.system(cmd_with_timeout, ignore_status=True, shell=True)
+        results = self.run_stressors(
+            tasks, "--no-oom-adjust --oomable --perf -v --verify",
+            self.vm_class_budget, "vm-class-sequential")
+        timed_out = [result['stressor'] for result in results
+                     if result['status'] == stressng.KILLED]
+        failed = ["%s (%s)" % (result['stressor'], result['status'])
+                  for result in results if result['status'] and
+                  result['status'] != stressng.KILLED]
+        skipped = [result['stressor'] for result in results
+                   if result['skipped']]
 
         self.log.info("=====================================================")
-        self.log.info("VM class sequential test completed")
-        self.log.info("Return code: %s", return_code)
+        self.log.info("VM class test completed")
+        if skipped:
+            self.log.warning("Not run for lack of time: %s",
+                             ", ".join(skipped))
 
         # Check for errors in dmesg (excluding OOM and expected swap errors)
         errors_in_dmesg = []
@@ -364,31 +361,35 @@ class Stressngmem(Test):
 
             if call_traces:
                 self.log.error("\n--- Call Traces (%d unique) ---" % len(call_traces))
-                for i, trace in enumerate(call_traces, 1):
-                    self.log.error("\nCall Trace #%d:", i)
-                    self.log.error("%s", trace)
+                for i, (report, entry) in enumerate(call_traces, 1):
+                    self.log.error("\nCall Trace #%d: signature %s, seen %d "
+                                   "time(s) since %s", i, report['signature'],
+                                   entry['count'], entry['first_seen'])
+                    self.log.error("%s", "\n".join(report['lines']))
 
             self.log.error("\n=====================================================")
 
         # Check return code and dmesg errors
         total_errors = len(errors_in_dmesg) + len(call_traces)
 
-        if return_code == 137:
-            self.fail("VM class sequential test timed out after 90 minutes!")
+        if timed_out:
+            self.fail("VM class test: stressors timed out: %s" %
+                      ", ".join(timed_out))
         elif total_errors > 0:
             # Real errors found in dmesg (non-OOM)
-            self.fail("VM class sequential test completed but %d error(s) found in dmesg: %d non-trace errors, %d call traces (see log above)" %
+            self.fail("VM class test completed but %d error(s) found in dmesg: %d non-trace errors, %d call traces (see log above)" %
                       (total_errors, len(errors_in_dmesg), len(call_traces)))
-        elif return_code != 0:
+        elif failed:
             # Non-zero return code but no dmesg errors (likely OOM-related failures)
             self.log.info("=====================================================")
-            self.log.info("stress-ng returned exit code %s, but no non-OOM errors found in dmesg", return_code)
+            self.log.info("stress-ng failed on %s, but no non-OOM errors found in dmesg", ", ".join(failed))
             self.log.info("This is expected behavior during aggressive memory stress testing")
-            self.log.info("==> VM class sequential test passed!")
+            self.log.info("==> VM class test passed!")
             self.log.info("=====================================================")
         else:
-            self.log.info("==> VM class sequential test passed!")
+            self.log.info("==> VM class test passed!")
             self.log.info("=====================================================")
+        self.check_regressions()
 
     def tearDown(self):
         # Skip dmesg check if test already handled it
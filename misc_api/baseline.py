@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Local benchmark results store and regression gate.
+
+Benchmark tests used to check only the exit status of the tool and threw
+its numbers away. :class:`ResultStore` keeps the metrics of every run on
+the local disk, keyed by whatever makes runs comparable, like the device
+model and the job file, together with a baseline per key, so that
+:func:`compare` can fail a run whose throughput drops, or latency grows,
+beyond a tolerance.
+
+Usage::
+
+    store = ResultStore('fio')
+    key = [model, 'fio-rand-read']
+    baseline = store.baseline(key)
+    record = store.record(key, metrics, test=self.name)
+    if baseline is None:
+        store.set_baseline(key, record)
+    elif compare(baseline['metrics'], metrics, 10, lower=('_us',)):
+        self.fail('performance regression')
+"""
+
+import fcntl
+import json
+import os
+import re
+import time
+
+__all__ = ['STORE_PATH', 'ResultStore', 'compare']
+
+STORE_PATH = '/var/cache/avocado/results'
+# runs kept per key
+HISTORY = 50
+
+
+def _safe(part):
+    """Return a key part usable as a file name."""
+    return re.sub(r'[^\w.+-]', '_', str(part).strip()) or '_'
+
+
+class ResultStore:
+    """Results history and baselines of one tool.
+
+    Every key has its own JSON file holding the last :data:`HISTORY` runs
+    and the baseline. Updates take a lock on the file, tests running in
+    parallel share the store.
+
+    :param tool: name of the tool, a directory of the store
+    :param path: root directory of the store
+    """
+
+    def __init__(self, tool, path=STORE_PATH):
+        self.path = os.path.join(path, _safe(tool))
+
+    def _file(self, key):
+        key = [key] if isinstance(key, str) else key
+        name = '--'.join(_safe(part) for part in key)
+        return os.path.join(self.path, '%s.json' % name)
+
+    def load(self, key):
+        """Return the entry of key, with its 'history' and 'baseline'."""
+        try:
+            with open(self._file(key)) as entry_file:
+                return json.load(entry_file)
+        except (OSError, ValueError):
+            return {'history': [], 'baseline': None}
+
+    def _update(self, key, func):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(key)
+        with open('%s.lock' % path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entry = self.load(key)
+            func(entry)
+            tmp_path = '%s.%d' % (path, os.getpid())
+            with open(tmp_path, 'w') as entry_file:
+                json.dump(entry, entry_file, indent=2, sort_keys=True)
+            os.rename(tmp_path, path)
+
+    def record(self, key, metrics, details=None, test=''):
+        """Add a run to the history of key.
+
+        :param metrics: dict of metric name to number, the values compared
+        :param details: anything else worth keeping, like histograms
+        :return: the record of the run
+        """
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'test': str(test), 'metrics': metrics}
+        if details is not None:
+            record['details'] = details
+
+        def add(entry):
+            entry['history'] = (entry['history'] + [record])[-HISTORY:]
+        self._update(key, add)
+        return record
+
+    def baseline(self, key):
+        """Return the baseline record of key, None when there is none."""
+        return self.load(key).get('baseline')
+
+    def set_baseline(self, key, record):
+        """Make record the baseline of key."""
+        self._update(key, lambda entry: entry.update(baseline=record))
+
+    def history(self, key):
+        """Return the records of key, the oldest first."""
+        return self.load(key)['history']
+
+
+def compare(baseline, current, tolerance, lower=()):
+    """Return the metrics of current worse than baseline beyond tolerance.
+
+    :param baseline: dict of metric name to baseline value
+    :param current: dict of metric name to value
+    :param tolerance: accepted change in percent
+    :param lower: suffixes of the metrics for which lower is better, like
+                  latencies, higher is better for the others
+    :return: list of dicts with the 'metric', its 'baseline' and 'current'
+             values and the 'change' in percent, the worst first
+    """
+    regressions = []
+    for metric, value in current.items():
+        base = baseline.get(metric)
+        if not base or value is None:
+            continue
+        change = (value - base) * 100.0 / base
+        worse = change if metric.endswith(tuple(lower)) else -change
+        if worse > tolerance:
+            regressions.append({'metric': metric, 'baseline': base,
+                                'current': value,
+                                'change': round(change, 1)})
+    return sorted(regressions, key=lambda item: abs(item['change']),
+                  reverse=True)
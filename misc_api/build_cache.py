@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Content addressed cache of built test sources.
+
+Every test that compiles a tool from a tarball can keep the built tree in
+a cache shared by all the tests of the machine. A cache entry is keyed by
+the hash of the tarballs and patches, the build flags, the compiler
+version and the architecture, so any change to the inputs is a cache
+miss. The least recently used entries are evicted once the cache grows
+over its size limit.
+
+Usage::
+
+    cache = BuildCache('fio', [tarball], flags=fio_flags)
+    cache.build(self.sourcedir, lambda: build.make(self.sourcedir))
+
+Trees are copied back to wherever the test asks for them, so only builds
+that do not embed their build path should be restored that way. Builds
+installed with a fixed prefix can use the entry ``path`` in place, see
+:meth:`BuildCache.lookup` and :meth:`BuildCache.mark`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+import time
+from avocado.utils import process
+
+__all__ = ['CACHE_BASE', 'BuildCache']
+
+LOG = logging.getLogger('avocado.test')
+
+CACHE_BASE = '/var/cache/avocado/build'
+DEFAULT_MAX_SIZE_MB = 20480
+MARKER = '.build_marker'
+TREE = 'tree'
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compiler_version(compiler='cc'):
+    """Return the first line of the compiler version, '' without one."""
+    result = process.run('%s --version' % compiler, ignore_status=True,
+                         verbose=False)
+    if result.exit_status:
+        return ''
+    return result.stdout_text.splitlines()[0].strip()
+
+
+def tree_size(path):
+    """Return the size in bytes of the files under path."""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return size
+
+
+class BuildCache:
+    """One entry of the build cache.
+
+    :param name: name of the tool, used as prefix of the entry
+    :param sources: tarballs or files the build is made from
+    :param patches: patches applied to the sources
+    :param flags: configure/make flags or any other build option
+    :param cache_dir: directory holding the cache entries
+    :param max_size_mb: size of the cache above which entries are evicted
+    :param enabled: when False :meth:`build` always builds
+    """
+
+    def __init__(self, name, sources, patches=(), flags='',
+                 cache_dir=CACHE_BASE, max_size_mb=DEFAULT_MAX_SIZE_MB,
+                 enabled=True):
+        self.name = name
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_mb) * 1024 * 1024
+        self.enabled = enabled
+        self.inputs = {'name': name,
+                       'sources': [file_digest(src) for src in sources],
+                       'patches': [file_digest(patch) for patch in patches],
+                       'flags': flags,
+                       'compiler': compiler_version(),
+                       'arch': platform.machine()}
+        key = json.dumps(self.inputs, sort_keys=True).encode()
+        self.key = hashlib.sha256(key).hexdigest()
+        self.path = os.path.join(cache_dir, '%s-%s' % (name, self.key[:16]))
+        self.marker = os.path.join(self.path, MARKER)
+
+    def lookup(self):
+        """Return True when the entry is complete, marking it as used."""
+        if not self.enabled or not os.path.isfile(self.marker):
+            return False
+        # the marker mtime is the last use for the LRU eviction
+        os.utime(self.marker)
+        LOG.info('Build cache hit for %s: %s', self.name, self.path)
+        return True
+
+    def mark(self):
+        """Mark the entry built in place at ``path`` as complete."""
+        info = dict(self.inputs, key=self.key, created=time.time(),
+                    size=tree_size(self.path))
+        with open(self.marker, 'w') as marker:
+            json.dump(info, marker, indent=4)
+        self.evict()
+
+    def invalidate(self):
+        """Drop the complete mark of the entry before rebuilding it."""
+        if os.path.isfile(self.marker):
+            os.remove(self.marker)
+
+    def restore(self, dest):
+        """Copy the cached tree to dest, return False on a cache miss."""
+        if not self.lookup():
+            return False
+        shutil.copytree(os.path.join(self.path, TREE), dest, symlinks=True,
+                        dirs_exist_ok=True)
+        return True
+
+    def save(self, src):
+        """Store the tree at src as the entry."""
+        if not self.enabled or os.path.isfile(self.marker):
+            return
+        tmp_path = '%s.tmp-%d' % (self.path, os.getpid())
+        try:
+            shutil.copytree(src, os.path.join(tmp_path, TREE), symlinks=True)
+            shutil.rmtree(self.path, ignore_errors=True)
+            os.rename(tmp_path, self.path)
+        except OSError as details:
+            LOG.warning('Could not store %s in the build cache: %s',
+                        self.name, details)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.mark()
+        LOG.info('Stored %s in the build cache: %s', self.name, self.path)
+
+    def build(self, dest, build_fn):
+        """Restore dest from the cache or run build_fn and cache dest.
+
+        :param dest: directory holding the built tree
+        :param build_fn: callable building the tree in dest
+        :return: True on a cache hit
+        """
+        if self.restore(dest):
+            return True
+        build_fn()
+        self.save(dest)
+        return False
+
+    def evict(self):
+        """Remove the least recently used entries above the size limit."""
+        entries = []
+        total = 0
+        for entry in os.listdir(self.cache_dir):
+            marker = os.path.join(self.cache_dir, entry, MARKER)
+            try:
+                with open(marker) as marker_file:
+                    size = json.load(marker_file).get('size', 0)
+                entries.append((os.stat(marker).st_mtime, size, entry))
+            except (OSError, ValueError):
+                continue
+            total += size
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            path = os.path.join(self.cache_dir, entry)
+            if path == self.path:
+                continue
+            LOG.info('Evicting %s from the build cache', path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
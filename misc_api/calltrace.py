@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Kernel call trace fingerprinting.
+
+Splits a kernel log into its oops/WARN/BUG reports and gives each one a
+signature that stays the same across runs and machines: the report title
+and the top frames of its call trace, with the addresses, offsets, CPU and
+PID numbers and timestamps stripped, hashed together.
+
+The signatures of every run go into a :class:`TraceIndex` on the local
+disk, with the first and last time a trace was seen, how many times and by
+which tests, so triaging a night of runs is a lookup in the index rather
+than a rescan of the dmesg of every test.
+
+Usage::
+
+    reports = extract_reports(dmesg_lines, ignore=['Out of memory'])
+    index = TraceIndex()
+    for report in unique_reports(reports):
+        new = index.record(report, test=self.name)
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+__all__ = ['INDEX_PATH', 'TOP_FRAMES', 'normalize', 'parse_frame',
+           'signature', 'extract_reports', 'unique_reports', 'TraceIndex']
+
+LOG = logging.getLogger('avocado.test')
+
+INDEX_PATH = '/var/cache/avocado/calltraces.json'
+TOP_FRAMES = 8
+# tests listed per signature in the index
+MAX_TESTS = 20
+# a header this close to the previous one belongs to the same report,
+# like the Oops following an "Unable to handle kernel paging request"
+HEADER_LINES = 5
+
+# first line of a kernel report
+HEADER = re.compile(r'(WARNING:|BUG:|Oops|[Kk]ernel BUG|Unable to handle|'
+                    r'general protection fault|Kernel panic|'
+                    r'INFO: task .* blocked|detected stalls?|ard LOCKUP)')
+# dmesg timestamp, -T date and printk caller id prefixes
+PREFIX = re.compile(r'^(\s*\[[^\]]*\])+\s?')
+# x86/arm64 "func+0x1c/0x40 [mod]", powerpc "[c0..] [c0..] func+0x1c/0x40"
+FRAME = re.compile(r'([\w.$]+)\+0x[0-9a-fA-F]+/0x[0-9a-fA-F]+'
+                   r'(?:\s+\[(\w+)\])?')
+# lines inside a call trace that are not frames
+TRACE_MARKERS = re.compile(r'^(<\/?\w+>|--- interrupt|Exception stack|'
+                           r'\w+: 0x[0-9a-fA-F]+)')
+END_TRACE = '---[ end trace'
+# frames of the reporting machinery, the same for every report
+NOISE_FRAMES = set(['dump_stack', 'dump_stack_lvl', 'show_stack', '__warn',
+                    'warn_slowpath_fmt', 'report_bug', 'panic',
+                    'nmi_cpu_backtrace', 'nmi_trigger_cpumask_backtrace'])
+
+NORMALIZE = [(re.compile(r'\b(CPU|PID|cpu|pid)[:#]?\s*\d+'), r'\1'),
+             (re.compile(r'\+0x[0-9a-fA-F]+/0x[0-9a-fA-F]+'), ''),
+             (re.compile(r'0x[0-9a-fA-F]+'), '0x?'),
+             (re.compile(r'\b[0-9a-fA-F]{8,}\b'), '?'),
+             (re.compile(r'\d+'), 'N'),
+             (re.compile(r'\s+'), ' ')]
+
+
+def strip_prefix(line):
+    """Return the log line without its timestamp prefix."""
+    return PREFIX.sub('', line.rstrip('\n'))
+
+
+def normalize(text):
+    """Return text without the parts that change from run to run."""
+    for regex, repl in NORMALIZE:
+        text = regex.sub(repl, text)
+    return text.strip()
+
+
+def parse_frame(line):
+    """Return the 'func' or 'func [module]' of a call trace line.
+
+    Frames the unwinder is not sure about are skipped, None is returned
+    for them and for lines that are not frames.
+    """
+    line = line.strip()
+    if line.startswith('?') or '(unreliable)' in line:
+        return None
+    match = FRAME.search(line)
+    if not match:
+        return None
+    if match.group(2):
+        return '%s [%s]' % match.groups()
+    return match.group(1)
+
+
+def signature(title, frames, depth=TOP_FRAMES):
+    """Return the signature of a report from its title and frames."""
+    frames = [frame for frame in frames
+              if frame.split()[0] not in NOISE_FRAMES][:depth]
+    text = '\n'.join([normalize(title)] + frames)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+def _report(title):
+    return {'title': title, 'frames': [], 'lines': [title],
+            'ignored': False}
+
+
+def extract_reports(lines, ignore=(), depth=TOP_FRAMES):
+    """Split kernel log lines into oops/WARN/BUG reports.
+
+    :param lines: kernel log lines, with or without timestamps
+    :param ignore: a report with a line containing one of these strings
+                   is left out, like the OOM killer reports
+    :param depth: number of top frames in the signature
+    :return: list of dicts with the title, frames, lines and signature
+             of every report, in log order
+    """
+    reports = []
+    current = {}
+    in_trace = False
+
+    def close():
+        if current and not current['ignored']:
+            current['signature'] = signature(current['title'],
+                                             current['frames'], depth)
+            del current['ignored']
+            reports.append(current)
+
+    for raw in lines:
+        line = strip_prefix(raw)
+        if current and any(pattern in line for pattern in ignore):
+            current['ignored'] = True
+        if END_TRACE in line:
+            close()
+            current, in_trace = {}, False
+        elif 'Call Trace:' in line:
+            if not current or current['frames']:
+                # a trace without header, or the next one of a dump
+                close()
+                current = _report(line.strip())
+                current['ignored'] = any(pattern in line
+                                         for pattern in ignore)
+            else:
+                current['lines'].append(line)
+            in_trace = True
+        elif HEADER.search(line) and not in_trace and \
+                not (current and len(current['lines']) < HEADER_LINES):
+            close()
+            current = _report(line.strip())
+            current['ignored'] = any(pattern in line for pattern in ignore)
+        elif in_trace:
+            frame = parse_frame(line)
+            if frame or FRAME.search(line) or \
+                    TRACE_MARKERS.match(line.strip()):
+                current['lines'].append(line)
+                if frame:
+                    current['frames'].append(frame)
+                continue
+            # the first line that is not part of the trace ends the report
+            close()
+            current, in_trace = {}, False
+            if HEADER.search(line):
+                current = _report(line.strip())
+                current['ignored'] = any(pattern in line
+                                         for pattern in ignore)
+        elif current:
+            current['lines'].append(line)
+    close()
+    return reports
+
+
+def unique_reports(reports):
+    """Return the first report of every signature, in log order."""
+    seen = set()
+    unique = []
+    for report in reports:
+        if report['signature'] not in seen:
+            seen.add(report['signature'])
+            unique.append(report)
+    return unique
+
+
+class TraceIndex:
+    """Persistent index of the call trace signatures seen on the machine.
+
+    Every entry holds the normalized title and frames of the trace, the
+    first and last time it was seen, its count and the tests which hit it.
+    Updates take a lock on the index, tests running in parallel share it.
+
+    :param path: JSON file of the index
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+
+    def load(self):
+        """Return the index as a dict of signature to entry."""
+        try:
+            with open(self.path) as index:
+                return json.load(index)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as index:
+                json.dump(entries, index, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def record(self, report, test=''):
+        """Add one occurrence of report.
+
+        :return: the entry of the report signature, 'count' 1 when the
+                 trace was never seen before
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open('%s.lock' % self.path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self.load()
+            entry = entries.setdefault(report['signature'], {
+                'title': normalize(report['title']),
+                'frames': report['frames'][:TOP_FRAMES],
+                'first_seen': now,
+                'count': 0,
+                'tests': []})
+            entry['last_seen'] = now
+            entry['count'] += 1
+            # avocado test names are TestID objects, not JSON
+            test = str(test)
+            if test and test not in entry['tests']:
+                entry['tests'] = (entry['tests'] + [test])[-MAX_TESTS:]
+            self._save(entries)
+        return entry
+
+    def lookup(self, sig):
+        """Return the entry of a signature, None when never seen."""
+        return self.load().get(sig)
+
+    def top(self, count=None):
+        """Return (signature, entry) pairs, the most frequent first."""
+        entries = sorted(self.load().items(),
+                         key=lambda item: item[1]['count'], reverse=True)
+        return entries[:count] if count else entries
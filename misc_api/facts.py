@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Cached platform facts.
+
+The static facts of the machine (CPU topology, platform type, distro,
+kernel config and installed packages) are computed on first use and
+memoized in the process, and persisted per boot so that the following
+tests read them back instead of forking lscpu/rpm/dpkg again.
+
+Facts that may change during a boot are stored with a stamp and
+recomputed when it changes: the CPU topology with the online CPU list
+(hotplug, SMT changes) and the package set with the package database
+modification time.
+"""
+
+import gzip
+import json
+import logging
+import os
+import platform
+from avocado.utils import cpu, distro, genio, process
+from avocado.utils.software_manager.manager import SoftwareManager
+
+__all__ = ['CACHE_DIR', 'boot_id', 'lscpu', 'platform_type', 'is_power_nv',
+           'is_power_vm', 'is_kvm_guest', 'detect_distro', 'kernel_config',
+           'installed_packages', 'check_installed', 'install_packages']
+
+LOG = logging.getLogger('avocado.test')
+
+CACHE_DIR = '/var/cache/avocado/facts'
+PKG_DBS = ['/var/lib/rpm', '/usr/lib/sysimage/rpm', '/var/lib/dpkg/status']
+
+_FACTS = None
+
+
+def boot_id():
+    """Return the ID of the current boot."""
+    return genio.read_one_line('/proc/sys/kernel/random/boot_id')
+
+
+def _cache_file():
+    return os.path.join(CACHE_DIR, '%s.json' % boot_id())
+
+
+def _load():
+    """Return the facts of this boot, reading the persisted ones once."""
+    global _FACTS
+    if _FACTS is None:
+        _FACTS = {}
+        try:
+            with open(_cache_file()) as cache:
+                _FACTS = json.load(cache)
+        except (OSError, ValueError):
+            pass
+    return _FACTS
+
+
+def _save():
+    """Persist the facts, atomically for the tests running in parallel."""
+    tmp_file = '%s.%d' % (_cache_file(), os.getpid())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_file, 'w') as cache:
+            json.dump(_FACTS, cache)
+        os.rename(tmp_file, _cache_file())
+    except OSError as details:
+        LOG.debug('Could not persist the platform facts: %s', details)
+
+
+def _fact(name, compute, stamp=None):
+    """Return the fact name, computing it when missing or stale."""
+    facts = _load()
+    entry = facts.get(name)
+    if entry is None or entry.get('stamp') != stamp:
+        entry = {'stamp': stamp, 'value': compute()}
+        facts[name] = entry
+        _save()
+    return entry['value']
+
+
+def lscpu():
+    """Return the avocado cpu.lscpu() topology."""
+    online = genio.read_one_line('/sys/devices/system/cpu/online')
+    return _fact('lscpu', cpu.lscpu, stamp=online)
+
+
+def _platform_type():
+    cpuinfo = genio.read_file('/proc/cpuinfo')
+    if 'PowerNV' in cpuinfo:
+        return 'PowerNV'
+    if 'qemu' in cpuinfo:
+        return 'KVM'
+    if os.path.exists('/proc/ppc64/lparcfg'):
+        return 'PowerVM'
+    return ''
+
+
+def platform_type():
+    """Return 'PowerNV', 'PowerVM', 'KVM' for a KVM guest or ''."""
+    return _fact('platform', _platform_type)
+
+
+def is_power_nv():
+    """Return True on a PowerNV (bare metal Power) host."""
+    return platform_type() == 'PowerNV'
+
+
+def is_power_vm():
+    """Return True on a PowerVM LPAR."""
+    return platform_type() == 'PowerVM'
+
+
+def is_kvm_guest():
+    """Return True in a KVM guest."""
+    return platform_type() == 'KVM'
+
+
+def _distro():
+    dist = distro.detect()
+    return [dist.name, dist.version, dist.release, dist.arch]
+
+
+def detect_distro():
+    """Return the avocado LinuxDistro of the machine."""
+    return distro.LinuxDistro(*_fact('distro', _distro))
+
+
+def _kernel_config():
+    config = {}
+    path = '/boot/config-%s' % platform.release()
+    if os.path.exists(path):
+        lines = genio.read_all_lines(path)
+    elif os.path.exists('/proc/config.gz'):
+        with gzip.open('/proc/config.gz', 'rt') as config_gz:
+            lines = config_gz.read().splitlines()
+    else:
+        return config
+    for line in lines:
+        if line.startswith('CONFIG_'):
+            name, _, value = line.partition('=')
+            config[name] = value.strip('"')
+    return config
+
+
+def kernel_config():
+    """Return the running kernel config as a dict of CONFIG_* to value."""
+    return _fact('kernel_config', _kernel_config)
+
+
+def _pkg_stamp():
+    stamp = []
+    for path in PKG_DBS:
+        if os.path.isdir(path):
+            stamp.extend(entry.stat().st_mtime for entry in os.scandir(path))
+        elif os.path.exists(path):
+            stamp.append(os.stat(path).st_mtime)
+    return max(stamp) if stamp else None
+
+
+def _installed_packages():
+    if process.system('which rpm', ignore_status=True, shell=True,
+                      verbose=False) == 0:
+        cmd = "rpm -qa --qf '%{NAME}\\n'"
+        return sorted(set(process.system_output(
+            cmd, shell=True, verbose=False).decode().split()))
+    cmd = "dpkg-query -W -f='${db:Status-Abbrev} ${Package}\\n'"
+    output = process.system_output(cmd, shell=True, ignore_status=True,
+                                   verbose=False).decode()
+    return sorted(set(line.split()[1].split(':')[0]
+                      for line in output.splitlines()
+                      if line.startswith('ii') and len(line.split()) > 1))
+
+
+def installed_packages():
+    """Return the set of installed package names."""
+    return set(_fact('packages', _installed_packages, stamp=_pkg_stamp()))
+
+
+def check_installed(package):
+    """Return True if package is installed.
+
+    Names missing from the package set, like capabilities or versioned
+    names, are checked with the software manager.
+    """
+    if package in installed_packages():
+        return True
+    return bool(SoftwareManager().check_installed(package))
+
+
+def install_packages(packages):
+    """Install the packages which are not installed yet.
+
+    :return: list of the packages that could not be installed
+    """
+    smm = None
+    missing = []
+    for package in packages:
+        if not package or check_installed(package):
+            continue
+        smm = smm or SoftwareManager()
+        if not smm.install(package):
+            missing.append(package)
+    return missing
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Live kernel log watcher.
+
+Scanning ``dmesg`` once the workload is over notices a lockup or a BUG hit
+in the first minute of an hour long stress run only at the end of it.
+:class:`KmsgWatcher` follows ``/dev/kmsg`` from the start of the test in a
+background thread, matches every new record against all the patterns with
+one compiled regular expression, and records each hit with the time it was
+seen relative to the start of the watch. Tests subscribe callbacks to abort
+their workload on the first hit, and check :attr:`KmsgWatcher.hits` instead
+of forking and scanning dmesg.
+
+Usage::
+
+    self.kmsg = KmsgWatcher(ERRORLOG)
+    self.kmsg.subscribe(lambda hit: process.kill_process_by_pattern('stress'))
+    self.kmsg.start()
+    ...
+    if self.kmsg.hits:
+        self.fail('\\n'.join(self.kmsg.messages()))
+"""
+
+import errno
+import logging
+import os
+import re
+import select
+import threading
+import time
+
+__all__ = ['KMSG', 'parse_record', 'compile_patterns', 'KmsgWatcher']
+
+LOG = logging.getLogger('avocado.test')
+
+KMSG = '/dev/kmsg'
+# a record is at most 1024 bytes of text plus its key=value dictionary
+READ_SIZE = 8192
+POLL_TIMEOUT = 0.5
+# warning, the lowest priority of ``dmesg -l 1,2,3,4``
+DEFAULT_MAX_LEVEL = 4
+
+
+def parse_record(record):
+    """Parse one /dev/kmsg record like ``4,1234,5678901,-;message``.
+
+    :return: tuple of level, sequence number, kernel timestamp in seconds
+             and message, None for a malformed record
+    """
+    header, _, text = record.partition(';')
+    fields = header.split(',')
+    if not text or len(fields) < 3:
+        return None
+    try:
+        prio, seq, usec = int(fields[0]), int(fields[1]), int(fields[2])
+    except ValueError:
+        return None
+    # continuation lines hold the SUBSYSTEM=/DEVICE= dictionary
+    message = text.split('\n', 1)[0]
+    return prio & 7, seq, usec / 1000000.0, message
+
+
+def compile_patterns(patterns):
+    """Return one regular expression matching any of the literal patterns."""
+    return re.compile('|'.join(re.escape(pattern) for pattern in patterns))
+
+
+class KmsgWatcher:
+    """Follow the kernel log and record the messages matching patterns.
+
+    :param patterns: literal strings a fatal kernel message contains
+    :param max_level: lowest priority (highest level number) of the
+                      messages matched, 7 matches every message
+    :param kmsg: kernel log device
+    """
+
+    def __init__(self, patterns, max_level=DEFAULT_MAX_LEVEL, kmsg=KMSG):
+        self.regex = compile_patterns(patterns)
+        self.max_level = max_level
+        self.kmsg = kmsg
+        self.hits = []
+        self.lost = 0
+        self.started = None
+        self._callbacks = []
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Call callback(hit) from the watcher thread on every hit."""
+        self._callbacks.append(callback)
+
+    def _match(self, record):
+        parsed = parse_record(record)
+        if parsed is None:
+            return
+        level, seq, timestamp, message = parsed
+        if level > self.max_level:
+            return
+        match = self.regex.search(message)
+        if not match:
+            return
+        hit = {'elapsed': round(time.monotonic() - self.started, 3),
+               'timestamp': timestamp,
+               'seq': seq,
+               'level': level,
+               'pattern': match.group(0),
+               'message': message}
+        with self._lock:
+            self.hits.append(hit)
+        LOG.error('Kernel message %.3fs into the test: %s', hit['elapsed'],
+                  message)
+        for callback in self._callbacks:
+            try:
+                callback(hit)
+            except Exception as details:  # pylint: disable=W0703
+                LOG.warning('kmsg callback %s failed: %s', callback, details)
+
+    def _run(self, fd):
+        try:
+            while True:
+                stopping = self._stop.is_set()
+                readable, _, _ = select.select([fd], [], [], POLL_TIMEOUT)
+                try:
+                    # every read returns exactly one record
+                    record = os.read(fd, READ_SIZE) if readable else b''
+                except OSError as details:
+                    if details.errno == errno.EPIPE:
+                        # the ring buffer overwrote records before we read
+                        self.lost += 1
+                        continue
+                    if details.errno != errno.EAGAIN:
+                        raise
+                    record = b''
+                if not record:
+                    if stopping:
+                        break
+                    continue
+                self._match(record.decode('utf-8', 'replace'))
+        finally:
+            os.close(fd)
+
+    def start(self):
+        """Start following the messages logged from now on."""
+        fd = os.open(self.kmsg, os.O_RDONLY | os.O_NONBLOCK)
+        os.lseek(fd, 0, os.SEEK_END)
+        self.started = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(fd,),
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Read the pending messages and stop the watcher."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self.lost:
+            LOG.warning('%d kernel log overruns while watching', self.lost)
+
+    def reset(self):
+        """Forget the hits seen so far."""
+        with self._lock:
+            self.hits = []
+
+    def messages(self):
+        """Return the hits as log lines prefixed with their test time."""
+        with self._lock:
+            return ['[+%.3fs] %s' % (hit['elapsed'], hit['message'])
+                    for hit in self.hits]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
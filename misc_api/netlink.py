@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Event driven network link readiness.
+
+Sleeping a minute after a failover and then polling the interface list
+wastes most of the minute and says nothing about how long the failover
+took. :class:`LinkWatcher` subscribes to the rtnetlink link and address
+multicast groups and follows, in a background thread, the interfaces
+appearing, disappearing or being renamed by udev, their carrier and their
+addresses, with the time of every change. Tests wait for the exact state
+they need and get the time it was reached, and :meth:`LinkWatcher.failover`
+times a failover from its trigger to carrier down, carrier up, address and
+first answered ping.
+
+:class:`VethPair` is a local stand-in for a failing over device: flapping
+the peer of a veth pair drops and restores the carrier of the other end,
+which exercises the watcher without a vNIC.
+
+Usage::
+
+    watcher = LinkWatcher()
+    watcher.start()
+    mark = watcher.mark()
+    ... trigger the failover ...
+    latency = watcher.failover('env3', mark, peer_ip='10.0.0.1')
+    watcher.stop()
+"""
+
+import errno
+import logging
+import select
+import socket
+import struct
+import threading
+import time
+from avocado.utils import process
+
+__all__ = ['LinkWatcher', 'VethPair', 'ping_until']
+
+LOG = logging.getLogger('avocado.test')
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+IFLA_IFNAME = 3
+IFLA_OPERSTATE = 16
+IFLA_CARRIER = 33
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFF_UP = 0x1
+IFF_LOWER_UP = 0x10000
+OPERSTATES = ['unknown', 'notpresent', 'down', 'lowerlayerdown', 'testing',
+              'dormant', 'up']
+# link local IPv6 addresses come with the carrier, they do not make the
+# interface reachable
+LINK_LOCAL = 0xfd
+
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBi')
+RTATTR = struct.Struct('=HH')
+RECV_SIZE = 65536
+POLL_TIMEOUT = 0.5
+
+
+def _attributes(data, offset):
+    """Return the rtattr payloads of a message by attribute type."""
+    attrs = {}
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        attrs[kind & 0x3fff] = data[offset + RTATTR.size:offset + length]
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def ping_until(peer_ip, interface=None, timeout=60):
+    """Ping peer_ip once a second until it answers.
+
+    :return: monotonic time of the first answer, None on timeout
+    """
+    cmd = 'ping -c 1 -W 1 %s' % peer_ip
+    if interface:
+        cmd = 'ping -c 1 -W 1 -I %s %s' % (interface, peer_ip)
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if not process.system(cmd, ignore_status=True, shell=True):
+            return time.monotonic()
+        # an unreachable network fails at once, do not spin
+        time.sleep(0.2)
+    return None
+
+
+class LinkWatcher:
+    """Follow the link and address events of the network interfaces.
+
+    Every event is kept in :attr:`events` as a dict with the monotonic
+    'time', the 'event' ('link_add', 'link_del', 'link_rename',
+    'carrier_up', 'carrier_down', 'addr_add' or 'addr_del') and the
+    'interface'.
+    """
+
+    def __init__(self):
+        self.links = {}
+        self.addrs = {}
+        self.events = []
+        self._names = {}
+        self._sock = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._cond = threading.Condition()
+        self._seq = 0
+
+    def _event(self, event, name, **details):
+        entry = dict(details, time=time.monotonic(), event=event,
+                     interface=name)
+        self.events.append(entry)
+        LOG.debug('link event: %s %s %s', name, event, details or '')
+
+    def _link(self, kind, data, offset):
+        _, _, index, flags, _ = IFINFOMSG.unpack_from(data, offset)
+        attrs = _attributes(data, offset + IFINFOMSG.size)
+        name = attrs.get(IFLA_IFNAME, b'').rstrip(b'\0').decode()
+        old = self._names.get(index)
+        if kind == RTM_DELLINK:
+            self._names.pop(index, None)
+            self.links.pop(name or old, None)
+            self.addrs.pop(name or old, None)
+            self._event('link_del', name or old)
+            return
+        if old and name and old != name:
+            # renamed, by udev for a new device
+            self.links[name] = self.links.pop(old, {})
+            self.addrs[name] = self.addrs.pop(old, set())
+            self._event('link_rename', name, old=old)
+        self._names[index] = name
+        if IFLA_CARRIER in attrs:
+            carrier = bool(attrs[IFLA_CARRIER][0])
+        else:
+            carrier = bool(flags & IFF_LOWER_UP)
+        operstate = OPERSTATES[attrs[IFLA_OPERSTATE][0]] \
+            if attrs.get(IFLA_OPERSTATE, b'\x07')[0] < len(OPERSTATES) \
+            else 'unknown'
+        link = self.links.get(name)
+        if link is None:
+            self._event('link_add', name)
+            link = self.links[name] = {'carrier': None}
+            self.addrs.setdefault(name, set())
+        # a new link without carrier did not lose it
+        if link['carrier'] != carrier and (carrier or link['carrier']):
+            self._event('carrier_up' if carrier else 'carrier_down', name)
+        link.update(index=index, carrier=carrier, operstate=operstate,
+                    admin_up=bool(flags & IFF_UP))
+
+    def _addr(self, kind, data, offset):
+        family, prefixlen, _, scope, index = IFADDRMSG.unpack_from(data,
+                                                                   offset)
+        attrs = _attributes(data, offset + IFADDRMSG.size)
+        raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        name = self._names.get(index)
+        if raw is None or name is None:
+            return
+        address = '%s/%d' % (socket.inet_ntop(family, raw), prefixlen)
+        addrs = self.addrs.setdefault(name, set())
+        if kind == RTM_NEWADDR and address not in addrs:
+            addrs.add(address)
+            self._event('addr_add', name, address=address,
+                        link_local=scope == LINK_LOCAL)
+        elif kind == RTM_DELADDR and address in addrs:
+            addrs.discard(address)
+            self._event('addr_del', name, address=address)
+
+    def _parse(self, data):
+        """Apply the messages of one datagram, return True on NLMSG_DONE."""
+        done = False
+        offset = 0
+        with self._cond:
+            while offset + NLMSGHDR.size <= len(data):
+                length, kind, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+                if length < NLMSGHDR.size:
+                    break
+                body = offset + NLMSGHDR.size
+                if kind in (RTM_NEWLINK, RTM_DELLINK):
+                    self._link(kind, data, body)
+                elif kind in (RTM_NEWADDR, RTM_DELADDR):
+                    self._addr(kind, data, body)
+                elif kind in (NLMSG_DONE, NLMSG_ERROR):
+                    done = True
+                offset += (length + 3) & ~3
+            self._cond.notify_all()
+        return done
+
+    def _dump(self, kind):
+        """Read the current links or addresses like ``ip link`` does."""
+        self._seq += 1
+        # rtgenmsg, the family is unspecified to get IPv4 and IPv6
+        request = NLMSGHDR.pack(NLMSGHDR.size + 4, kind,
+                                NLM_F_REQUEST | NLM_F_DUMP, self._seq, 0) + \
+            struct.pack('=Bxxx', socket.AF_UNSPEC)
+        self._sock.send(request)
+        while not self._parse(self._sock.recv(RECV_SIZE)):
+            pass
+
+    def _read(self):
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self._sock], [], [], POLL_TIMEOUT)
+            if not readable:
+                continue
+            try:
+                self._parse(self._sock.recv(RECV_SIZE))
+            except OSError as details:
+                # the socket buffer overflowed, resync the state
+                if details.errno != errno.ENOBUFS:
+                    raise
+                LOG.warning('link events lost, reading the links again')
+                self._dump(RTM_GETLINK)
+                self._dump(RTM_GETADDR)
+
+    def start(self):
+        """Read the current state and follow its changes."""
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                   NETLINK_ROUTE)
+        # port 0, the kernel picks a free one
+        self._sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR |
+                         RTMGRP_IPV6_IFADDR))
+        self._dump(RTM_GETLINK)
+        self._dump(RTM_GETADDR)
+        # the initial state is not a change
+        self.events = []
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop following the events."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    @staticmethod
+    def mark():
+        """Return the current time, to wait for the events after it."""
+        return time.monotonic()
+
+    def _wait(self, predicate, timeout):
+        with self._cond:
+            if self._cond.wait_for(predicate, timeout):
+                return True
+        return False
+
+    def wait_event(self, interface, events, since, timeout=60):
+        """Wait for one of events on interface after since.
+
+        :return: the first matching event, None on timeout
+        """
+        events = [events] if isinstance(events, str) else events
+
+        def seen():
+            for entry in self.events:
+                if entry['time'] >= since and \
+                        entry['interface'] == interface and \
+                        entry['event'] in events:
+                    return entry
+            return None
+        if self._wait(seen, timeout):
+            return seen()
+        return None
+
+    def is_ready(self, interface, address=True):
+        """Return True when interface has carrier and, when address is
+        True, an address other than the IPv6 link local one.
+        """
+        link = self.links.get(interface)
+        if not link or not link['carrier']:
+            return False
+        return not address or any(not addr.startswith('fe80:')
+                                  for addr in self.addrs.get(interface, []))
+
+    def wait_ready(self, interface, timeout=60, address=True):
+        """Wait for interface to exist, have carrier and an address.
+
+        :return: monotonic time it was ready, None on timeout
+        """
+        if self._wait(lambda: self.is_ready(interface, address), timeout):
+            return time.monotonic()
+        return None
+
+    def wait_link(self, interface, timeout=60):
+        """Wait for interface to exist, True when it does."""
+        return self._wait(lambda: interface in self.links, timeout)
+
+    def failover(self, interface, since, peer_ip=None, down_timeout=30,
+                 timeout=120):
+        """Time a failover triggered at since.
+
+        A failover which keeps the carrier up is hitless, only the first
+        answered ping is timed then.
+
+        :param down_timeout: seconds to wait for the carrier to drop
+        :param timeout: seconds to wait for the interface to be ready and
+                        the peer to answer
+        :return: dict of the seconds from since to 'carrier_down',
+                 'carrier_up', 'ready' and 'first_ping', None for the steps
+                 which did not happen, and the 'outage' between carrier
+                 down and up
+        """
+        down = self.wait_event(interface, 'carrier_down', since,
+                               down_timeout)
+        up = None
+        if down:
+            up = self.wait_event(interface, 'carrier_up', down['time'],
+                                 timeout)
+        ready = self.wait_ready(interface, timeout)
+        ping = None
+        if ready and peer_ip:
+            ping = ping_until(peer_ip, interface, timeout)
+
+        def delta(moment):
+            return round(moment - since, 3) if moment else None
+        return {'carrier_down': delta(down and down['time']),
+                'carrier_up': delta(up and up['time']),
+                'ready': delta(ready),
+                'first_ping': delta(ping),
+                'outage': round(up['time'] - down['time'], 3)
+                if down and up else None}
+
+
+class VethPair:
+    """veth pair standing in for a failing over interface.
+
+    Setting the peer down drops the carrier of the interface, like the
+    reset of a vNIC failover.
+
+    :param name: name of the watched end, the peer is name + 'p'
+    :param address: address set on the watched end, like '192.0.2.1/24'
+    """
+
+    def __init__(self, name='lwtest0', address='192.0.2.1/24'):
+        self.name = name
+        self.peer = name + 'p'
+        self.address = address
+
+    def create(self):
+        """Create the pair, with the address and both ends up."""
+        for cmd in ['ip link add %s type veth peer name %s' %
+                    (self.name, self.peer),
+                    'ip addr add %s dev %s' % (self.address, self.name),
+                    'ip link set %s up' % self.name,
+                    'ip link set %s up' % self.peer]:
+            process.run(cmd, sudo=True)
+
+    def flap(self, down_time=1.0):
+        """Drop the carrier for down_time seconds."""
+        process.run('ip link set %s down' % self.peer, sudo=True)
+        time.sleep(down_time)
+        process.run('ip link set %s up' % self.peer, sudo=True)
+
+    def destroy(self):
+        """Delete the pair, both ends go with it."""
+        process.run('ip link del %s' % self.name, sudo=True,
+                    ignore_status=True)
+
+    def __enter__(self):
+        self.create()
+        return self
+
+    def __exit__(self, *args):
+        self.destroy()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+NUMA topology from sysfs.
+
+Reads the online CPUs and the free memory of every node, and cuts the
+nodes having both in slots, disjoint sets of nodes and of their CPUs a
+workload can be bound to without sharing them with the workloads of the
+other slots.
+
+Usage::
+
+    for slot in slots(width=1):
+        nodes = cpulist(slot['nodes'])
+        free = slot_free_mb(slot)
+        cmd = 'numactl --cpunodebind=%s --membind=%s ...' % (nodes, nodes)
+"""
+
+import os
+
+from misc_api import sysfs
+
+__all__ = ['NODE_ROOT', 'parse_cpulist', 'cpulist', 'online_cpus',
+           'free_mb', 'slot_free_mb', 'nodes', 'slots']
+
+NODE_ROOT = '/sys/devices/system/node'
+CPU_ONLINE = '/sys/devices/system/cpu/online'
+
+
+def parse_cpulist(text):
+    """Return the sorted numbers of a list like '0-3,8,10-11'."""
+    numbers = set()
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition('-')
+        numbers.update(range(int(first), int(last or first) + 1))
+    return sorted(numbers)
+
+
+def cpulist(numbers):
+    """Return the list like '0-3,8' of numbers, the reverse of
+    :func:`parse_cpulist`."""
+    ranges = []
+    for number in sorted(set(numbers)):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ','.join(str(first) if first == last else '%d-%d' % (first, last)
+                    for first, last in ranges)
+
+
+def online_cpus():
+    """Return the online CPUs."""
+    online = sysfs.read(CPU_ONLINE)
+    if online is None:
+        return list(range(os.cpu_count() or 1))
+    return parse_cpulist(online)
+
+
+def _meminfo_mb(node, field):
+    text = sysfs.read(os.path.join(NODE_ROOT, 'node%d' % node, 'meminfo'),
+                      default='')
+    for line in text.splitlines():
+        # Node 0 MemFree:         3304540 kB
+        fields = line.split()
+        if len(fields) >= 4 and fields[2] == '%s:' % field:
+            return int(fields[3]) // 1024
+    return 0
+
+
+def free_mb(node):
+    """Return the free memory of a node, in MB."""
+    return _meminfo_mb(node, 'MemFree')
+
+
+def slot_free_mb(slot):
+    """Return the free memory of the nodes of a slot, in MB, the available
+    memory of the machine for a slot without nodes."""
+    if slot['nodes']:
+        return sum(free_mb(node) for node in slot['nodes'])
+    with open('/proc/meminfo') as meminfo:
+        for line in meminfo:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) // 1024
+    return 0
+
+
+def nodes():
+    """Return the online nodes.
+
+    :return: dict of node number to dict of its online 'cpus', its
+             'total_mb' and 'free_mb' memory
+    """
+    online = set(online_cpus())
+    topology = {}
+    for node in parse_cpulist(sysfs.read(os.path.join(NODE_ROOT, 'online'))):
+        cpus = parse_cpulist(sysfs.read(os.path.join(
+            NODE_ROOT, 'node%d' % node, 'cpulist')))
+        topology[node] = {'cpus': [cpu for cpu in cpus if cpu in online],
+                          'total_mb': _meminfo_mb(node, 'MemTotal'),
+                          'free_mb': free_mb(node)}
+    return topology
+
+
+def slots(width=1):
+    """Cut the nodes having CPUs and memory in disjoint slots.
+
+    :param width: number of nodes of a slot, the nodes left over join the
+                  last slot
+    :return: list of dicts with the 'nodes' and 'cpus' of every slot, a
+             single slot of all the online CPUs without 'nodes' to bind
+             to when the machine has no usable NUMA topology
+    """
+    usable = [(node, info['cpus']) for node, info in sorted(nodes().items())
+              if info['cpus'] and info['total_mb']]
+    if not usable:
+        return [{'nodes': [], 'cpus': online_cpus()}]
+    width = max(int(width), 1)
+    groups = [usable[start:start + width]
+              for start in range(0, len(usable), width)]
+    if len(groups) > 1 and len(groups[-1]) < width:
+        groups[-2].extend(groups.pop())
+    return [{'nodes': [node for node, _ in group],
+             'cpus': sorted(cpu for _, cpus in group for cpu in cpus)}
+            for group in groups]
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Adaptive repetition of benchmark runs.
+
+The benchmark tests ran their workload a fixed number of times and
+reported the min, max and average. :class:`Repeater` discards warmup
+runs, then runs the workload until the 95% confidence interval of the
+mean of its primary metric is narrower than a target, or a run count or
+time cap is reached: a stable benchmark stops after a few runs, a noisy
+one takes more samples. Runs whose primary metric is an outlier by the
+median absolute deviation are rejected from the statistics of all the
+metrics. :class:`NoiseControl` optionally pins the test to CPUs, sets
+the cpufreq governor and drops the caches before every run.
+
+Usage::
+
+    def run(iteration):
+        output = process.run(cmd).stdout_text
+        return {'time': parse(output)}
+
+    noise = NoiseControl(cpus='0-7', governor='performance')
+    summary = Repeater(run, warmup=1, max_runs=30, target_ci=2,
+                       time_cap=600, noise=noise).run()
+    report(summary)
+    self.whiteboard = json.dumps(summary)
+"""
+
+import logging
+import math
+import os
+import statistics
+import subprocess
+import time
+
+from misc_api import numa
+from misc_api import sysfs
+
+__all__ = ['t_critical', 'reject_outliers', 'summarize', 'report',
+           'NoiseControl', 'Repeater']
+
+LOG = logging.getLogger('avocado.test')
+
+# two-sided 95% Student t critical values by degrees of freedom
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447,
+        7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 11: 2.201, 12: 2.179,
+        13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101,
+        19: 2.093, 20: 2.086, 21: 2.080, 22: 2.074, 23: 2.069, 24: 2.064,
+        25: 2.060, 26: 2.056, 27: 2.052, 28: 2.048, 29: 2.045, 30: 2.042,
+        40: 2.021, 60: 2.000, 120: 1.980}
+T_INFINITY = 1.960
+# modified z-score above which a sample is an outlier, Iglewicz and Hoaglin
+OUTLIER_THRESHOLD = 3.5
+CPU_ROOT = '/sys/devices/system/cpu'
+
+
+def t_critical(df):
+    """Return the two-sided 95% Student t critical value of df degrees of
+    freedom, rounded towards the wider interval between the table rows."""
+    if df < 1:
+        return None
+    if df > max(T_95):
+        return T_INFINITY
+    return T_95[max(row for row in T_95 if row <= df)]
+
+
+def reject_outliers(samples, threshold=OUTLIER_THRESHOLD):
+    """Split samples in the kept ones and the outliers.
+
+    A sample is an outlier when its modified z-score, 0.6745 times its
+    distance to the median over the median absolute deviation, is above
+    threshold. Less than 3 samples, or more than half equal, are all kept.
+
+    :return: (list of the indexes kept, list of the indexes rejected)
+    """
+    if len(samples) < 3 or not threshold:
+        return list(range(len(samples))), []
+    median = statistics.median(samples)
+    mad = statistics.median(abs(value - median) for value in samples)
+    if not mad:
+        return list(range(len(samples))), []
+    kept, outliers = [], []
+    for index, value in enumerate(samples):
+        if 0.6745 * abs(value - median) / mad > threshold:
+            outliers.append(index)
+        else:
+            kept.append(index)
+    return kept, outliers
+
+
+def summarize(samples):
+    """Return the statistics of samples.
+
+    :return: dict with the number of samples 'n', their 'mean', 'stdev',
+             'median', 'min' and 'max', the half width 'ci' of the 95%
+             confidence interval of the mean and 'ci_pct', the same in
+             percent of the mean, None below 2 samples
+    """
+    stats = {'n': len(samples), 'mean': None, 'stdev': None,
+             'median': None, 'min': None, 'max': None, 'ci': None,
+             'ci_pct': None}
+    if not samples:
+        return stats
+    mean = statistics.mean(samples)
+    stats.update(mean=round(mean, 6), median=statistics.median(samples),
+                 min=min(samples), max=max(samples))
+    if len(samples) > 1:
+        stdev = statistics.stdev(samples)
+        ci = t_critical(len(samples) - 1) * stdev / math.sqrt(len(samples))
+        stats.update(stdev=round(stdev, 6), ci=round(ci, 6))
+        if mean:
+            stats['ci_pct'] = round(100.0 * ci / abs(mean), 3)
+    return stats
+
+
+def report(summary, log=LOG):
+    """Log the summary of :meth:`Repeater.run`."""
+    log.info("%d run(s) kept, %d outlier(s), %d warmup(s) discarded, "
+             "stopped on %s after %.1fs", summary['runs'],
+             len(summary['outliers']), summary['warmup'], summary['stopped'],
+             summary['seconds'])
+    for name, stats in sorted(summary['metrics'].items()):
+        if stats['mean'] is None:
+            log.info("%s: no sample", name)
+        elif stats['ci'] is None:
+            log.info("%s: %.3f (single run)", name, stats['mean'])
+        else:
+            log.info("%s: %.3f +/- %.3f (95%% CI, +/-%.2f%%), min %.3f, "
+                     "max %.3f, n=%d", name, stats['mean'], stats['ci'],
+                     stats['ci_pct'] or 0, stats['min'], stats['max'],
+                     stats['n'])
+
+
+class NoiseControl:
+    """Reduce the noise of the benchmark runs.
+
+    Used as a context manager around the runs, it restores the affinity
+    of the test and the governors when it exits.
+
+    :param cpus: CPU list like '0-7' the test, and the workloads it
+                 starts, are pinned to, not pinned when empty
+    :param governor: cpufreq governor set on all the CPUs, like
+                     'performance', unchanged when empty
+    :param drop_caches: drop the page cache, dentries and inodes before
+                        every run
+    :param log: test log
+    """
+
+    def __init__(self, cpus='', governor='', drop_caches=False, log=LOG):
+        self.cpus = numa.parse_cpulist(str(cpus)) if cpus else []
+        self.governor = governor
+        self.drop_caches = drop_caches
+        self.log = log
+        self.affinity = None
+        # governor file to the governor it had
+        self.governors = {}
+
+    def settings(self):
+        """Return the settings applied, for the results."""
+        return {'cpus': numa.cpulist(self.cpus), 'governor': self.governor,
+                'drop_caches': bool(self.drop_caches)}
+
+    def _set_governors(self):
+        for cpu in numa.online_cpus():
+            path = os.path.join(CPU_ROOT, 'cpu%d' % cpu, 'cpufreq',
+                                'scaling_governor')
+            current = sysfs.read(path)
+            if current is None:
+                continue
+            try:
+                with open(path, 'w') as governor_file:
+                    governor_file.write(self.governor)
+            except OSError as details:
+                self.log.warning("Could not set the %s governor on CPU %s: "
+                                 "%s", self.governor, cpu, details)
+                continue
+            self.governors[path] = current
+        if not self.governors:
+            self.log.warning("No cpufreq governor set to %s",
+                             self.governor)
+
+    def __enter__(self):
+        if self.cpus:
+            self.affinity = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, self.cpus)
+            self.log.info("Pinned the runs to CPUs %s",
+                          numa.cpulist(self.cpus))
+        if self.governor:
+            self._set_governors()
+        return self
+
+    def __exit__(self, *exc_info):
+        for path, governor in self.governors.items():
+            try:
+                with open(path, 'w') as governor_file:
+                    governor_file.write(governor)
+            except OSError as details:
+                self.log.warning("Could not restore %s: %s", path, details)
+        self.governors = {}
+        if self.affinity is not None:
+            os.sched_setaffinity(0, self.affinity)
+            self.affinity = None
+
+    def before_run(self):
+        """Prepare the machine for the next run."""
+        if self.drop_caches:
+            subprocess.call(['sync'])
+            try:
+                with open('/proc/sys/vm/drop_caches', 'w') as caches:
+                    caches.write('3')
+            except OSError as details:
+                self.log.warning("Could not drop the caches: %s", details)
+
+
+class Repeater:
+    """Run a benchmark until its mean is known precisely enough.
+
+    :param run: callable running the workload once, given the iteration
+                number counting the warmups from 1, returning a dict of
+                metric name to value, or None when the run gave no result
+    :param primary: metric deciding when to stop and which runs are
+                    outliers, the first one returned by default
+    :param warmup: number of runs discarded first
+    :param min_runs: number of runs kept before stopping on the interval
+    :param max_runs: number of measured runs at most when going for
+                     target_ci, larger than a fixed count so that a noisy
+                     benchmark takes more samples, time_cap bounds them
+    :param target_ci: half width of the 95% confidence interval of the
+                      primary mean, in percent of the mean, to stop at
+    :param runs: fixed number of measured runs when target_ci is 0, the
+                 iteration count of the tests before the adaptive runs,
+                 max_runs when None
+    :param time_cap: seconds of measured runs at most, no cap when 0
+    :param outlier_threshold: see :func:`reject_outliers`, no rejection
+                              when 0
+    :param noise: :class:`NoiseControl` of the runs
+    :param log: test log
+    """
+
+    def __init__(self, run, primary=None, warmup=0, min_runs=3, max_runs=30,
+                 target_ci=0, runs=None, time_cap=0,
+                 outlier_threshold=OUTLIER_THRESHOLD, noise=None, log=LOG):
+        self.run_once = run
+        self.primary = primary
+        self.warmup = int(warmup)
+        self.target_ci = float(target_ci or 0)
+        if not self.target_ci and runs:
+            max_runs = runs
+        self.max_runs = max(int(max_runs), 1)
+        # a confidence interval needs 2 samples at least
+        self.min_runs = min(max(int(min_runs), 2 if self.target_ci else 1),
+                            self.max_runs)
+        self.time_cap = float(time_cap or 0)
+        self.outlier_threshold = outlier_threshold
+        self.noise = noise or NoiseControl(log=log)
+        self.log = log
+
+    def _iterate(self, iteration):
+        self.noise.before_run()
+        start = time.monotonic()
+        result = self.run_once(iteration)
+        return result, time.monotonic() - start
+
+    def _stop(self, samples, seconds, last):
+        """Return why the runs stop, None to go on."""
+        values = [sample[self.primary] for sample in samples]
+        kept, _ = reject_outliers(values, self.outlier_threshold)
+        if len(kept) >= self.min_runs and self.target_ci:
+            ci_pct = summarize([values[index] for index in kept])['ci_pct']
+            if ci_pct is not None and ci_pct <= self.target_ci:
+                return 'ci'
+        if self.time_cap and samples and seconds + last > self.time_cap:
+            # the next run would end after the cap
+            return 'time_cap'
+        return None
+
+    def run(self):
+        """Run the warmups, then the measured runs.
+
+        :return: dict with the 'primary' metric, the 'metrics' statistics
+                 by name, see :func:`summarize`, the number of 'runs' kept,
+                 the 'samples' of every measured run, the indexes of the
+                 'outliers' among them, the number of 'warmup' runs and of
+                 'failed' runs, why the runs 'stopped', 'ci', 'max_runs'
+                 or 'time_cap', the 'seconds' of the measured runs, the
+                 'target_ci' and the 'noise' control settings
+        """
+        samples, failed = [], 0
+        seconds, last, stopped = 0.0, 0.0, 'max_runs'
+        with self.noise:
+            for iteration in range(1, self.warmup + 1):
+                self.log.info("Warmup run %d/%d", iteration, self.warmup)
+                self._iterate(iteration)
+            for count in range(1, self.max_runs + 1):
+                self.log.info("Run %d (at most %d)", count, self.max_runs)
+                result, last = self._iterate(self.warmup + count)
+                seconds += last
+                if result:
+                    if self.primary is None:
+                        self.primary = next(iter(result))
+                    if self.primary in result:
+                        samples.append(result)
+                    else:
+                        result = None
+                if not result:
+                    failed += 1
+                    self.log.warning("Run %d gave no %s", count,
+                                     self.primary or 'result')
+                reason = self._stop(samples, seconds, last)
+                if reason:
+                    stopped = reason
+                    break
+        values = [sample[self.primary] for sample in samples]
+        kept, outliers = reject_outliers(values, self.outlier_threshold)
+        for index in outliers:
+            self.log.info("Sample %d is an outlier: %s %s", index + 1,
+                          self.primary, values[index])
+        names = []
+        for sample in samples:
+            names.extend(name for name in sample if name not in names)
+        metrics = {name: summarize([samples[index][name] for index in kept
+                                    if name in samples[index]])
+                   for name in names}
+        if stopped != 'ci' and self.target_ci:
+            self.log.warning("The 95%% CI of %s did not reach +/-%s%% of "
+                             "the mean before %s", self.primary,
+                             self.target_ci, stopped)
+        return {'primary': self.primary, 'metrics': metrics,
+                'runs': len(kept), 'samples': samples, 'outliers': outliers,
+                'warmup': self.warmup, 'failed': failed, 'stopped': stopped,
+                'seconds': round(seconds, 1), 'target_ci': self.target_ci,
+                'noise': self.noise.settings()}
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+stress-ng metrics and stressor scheduler.
+
+With ``--metrics --yaml <file>`` stress-ng writes the bogo-ops, the
+bogo-ops per second of real and of user plus system time and the maximum
+RSS of every stressor it ran. :func:`load_metrics` reads them and
+:func:`check` records them in the results store per platform and
+stressor, with the kernel release which ran them, and compares their
+throughput with the baseline saved there, usually by an older kernel, so
+that the stress tests catch a kernel getting slower and not only a kernel
+crashing.
+
+Usage::
+
+    process.run('stress-ng --cpu 0 -t 60 --metrics --yaml %s' % path)
+    results = load_metrics(path)
+    regressions = check(results, 'check', 10, test=self.name)
+
+:class:`StressorScheduler` runs a list of independent stressors within a
+wall clock budget: the NUMA nodes are cut in disjoint slots, every slot
+runs one stressor at a time bound to its CPUs and memory, sized to the
+free memory of its nodes, and the stressors which failed are queued again
+instead of the whole list. On a machine of 8 nodes the list takes about
+an eighth of the time of one run after another.
+
+Usage::
+
+    scheduler = StressorScheduler([('vm', 300), ('mmap', 300)],
+                                  numa.slots(), self.outputdir,
+                                  '--aggressive --verify', budget=1800)
+    for result in last_attempts(scheduler.run()):
+        ...
+"""
+
+import collections
+import logging
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import time
+import yaml
+
+from misc_api import facts
+from misc_api import numa
+from misc_api.baseline import STORE_PATH, ResultStore, compare
+
+__all__ = ['METRICS', 'THROUGHPUT', 'BYTES_OPTIONS', 'KILLED',
+           'load_metrics', 'results_key', 'check', 'last_attempts',
+           'StressorScheduler']
+
+LOG = logging.getLogger('avocado.test')
+
+# stress-ng YAML metric names to the stored ones
+METRICS = {'bogo-ops': 'bogo_ops',
+           'bogo-ops-per-second-real-time': 'bogo_ops_s_real',
+           'bogo-ops-per-second-usr-sys-time': 'bogo_ops_s_usr_sys',
+           'max-rss': 'max_rss_kb'}
+# the metrics compared with the baseline, higher is better
+THROUGHPUT = ('bogo_ops_s_real', 'bogo_ops_s_usr_sys')
+# options of the stressors sizing their memory, stress-ng shares the size
+# among the instances of the stressor
+BYTES_OPTIONS = {'vm': 'vm-bytes', 'vm-rw': 'vm-rw-bytes',
+                 'malloc': 'malloc-bytes', 'mmap': 'mmap-bytes',
+                 'mremap': 'mremap-bytes', 'memfd': 'memfd-bytes',
+                 'memrate': 'memrate-bytes', 'shm': 'shm-bytes',
+                 'shm-sysv': 'shm-sysv-bytes'}
+# exit status of a stress-ng killed by timeout -s 9
+KILLED = 137
+# shortest run a stressor is started for within a budget
+MIN_RUN_TIME = 10
+POLL_INTERVAL = 1
+
+
+def load_metrics(path):
+    """Return the metrics of every stressor of a stress-ng YAML file.
+
+    :return: dict of stressor name to dict of its :data:`METRICS`
+    :raise ValueError: when the file holds no metrics, stress-ng writes
+                       them with --metrics only
+    """
+    try:
+        with open(path) as yaml_file:
+            report = yaml.safe_load(yaml_file) or {}
+    except (OSError, yaml.YAMLError) as details:
+        raise ValueError('could not read %s: %s' % (path, details))
+    results = {}
+    for entry in report.get('metrics') or []:
+        name = entry.get('stressor')
+        if not name:
+            continue
+        results[name] = {stored: entry[metric] for metric, stored
+                         in METRICS.items() if entry.get(metric) is not None}
+    if not results:
+        raise ValueError('no stressor metrics in %s' % path)
+    return results
+
+
+def results_key(stressor, config=''):
+    """Return the results store key of a stressor.
+
+    :param config: what else makes the runs comparable, like the stress-ng
+                   options
+    """
+    key = ['%s-%s' % (platform.machine(), facts.platform_type() or 'native'),
+           stressor]
+    return key + [config] if config else key
+
+
+def check(results, mode='check', tolerance=10, config='', test='',
+          path=STORE_PATH, log=LOG):
+    """Record the metrics of every stressor and compare their throughput
+    with the baseline of the stressor.
+
+    :param results: metrics by stressor, from :func:`load_metrics`
+    :param mode: 'check' compares with the baseline, saving one when there
+                 is none, 'update' saves the results as the new baseline,
+                 'off' only logs them
+    :param tolerance: accepted throughput drop in percent
+    :param config: see :func:`results_key`
+    :return: list of the regressions, dicts of :func:`compare` with the
+             'stressor'
+    """
+    regressions = []
+    for stressor, metrics in sorted(results.items()):
+        log.info("stress-ng %s: %s", stressor, ', '.join(
+            '%s=%s' % item for item in sorted(metrics.items())))
+        if mode == 'off':
+            continue
+        key = results_key(stressor, config)
+        store = ResultStore('stress-ng', path)
+        baseline = store.baseline(key)
+        compared = {name: value for name, value in metrics.items()
+                    if name in THROUGHPUT}
+        record = store.record(key, compared, test=test,
+                              details=dict(metrics,
+                                           kernel=platform.release()))
+        if mode == 'update' or baseline is None:
+            log.info("Saving the results of kernel %s as baseline of %s",
+                     platform.release(), ' '.join(key))
+            store.set_baseline(key, record)
+            continue
+        for reg in compare(baseline['metrics'], compared, tolerance):
+            log.error("stress-ng %s %s: %s against baseline %s of kernel %s "
+                      "on %s (%+.1f%%)", stressor, reg['metric'],
+                      reg['current'], reg['baseline'],
+                      baseline.get('details', {}).get('kernel'),
+                      baseline['time'], reg['change'])
+            regressions.append(dict(reg, stressor=stressor))
+    return regressions
+
+
+def last_attempts(results):
+    """Return the result of the last attempt of every stressor.
+
+    :param results: list of the results of :meth:`StressorScheduler.run`
+    :return: list of results, in the order the stressors were given
+    """
+    last = collections.OrderedDict()
+    for result in results:
+        last[result['stressor']] = result
+    return list(last.values())
+
+
+class StressorScheduler:
+    """Run stressors concurrently on disjoint NUMA slots.
+
+    :param tasks: list of (stressor, run time in seconds)
+    :param slots: disjoint sets of nodes and CPUs, from :func:`numa.slots`
+    :param outputdir: directory of the YAML and output of every run
+    :param options: stress-ng options of all the stressors
+    :param budget: wall clock time of all the runs in seconds, the run
+                   times are cut to fit in it and the stressors left when
+                   it is spent are skipped, no limit when 0
+    :param retries: number of times a failed stressor is run again, on
+                    another slot, waiting for one to be free, when there
+                    are several
+    :param memory_usage: share of the free memory of its slot given to
+                         the stressors of :data:`BYTES_OPTIONS`
+    :param kill_ratio: a stressor still running after kill_ratio times its
+                       run time is killed
+    :param log: test log
+    """
+
+    def __init__(self, tasks, slots, outputdir, options='', budget=0,
+                 retries=1, memory_usage=0.9, kill_ratio=1.5, log=LOG):
+        self.pending = collections.deque(
+            {'stressor': stressor, 'run_time': int(run_time), 'attempt': 1,
+             'avoid': None} for stressor, run_time in tasks)
+        self.slots = slots
+        self.outputdir = outputdir
+        self.options = options.split()
+        self.budget = budget
+        self.retries = retries
+        self.memory_usage = memory_usage
+        self.kill_ratio = kill_ratio
+        self.log = log
+        # without numactl the CPUs are bound by stress-ng, not the memory
+        self.numactl = shutil.which('numactl')
+        self.deadline = None
+        self.results = []
+        # slot index to (process, result) of the running stressors
+        self.running = {}
+
+    def _run_time(self, task):
+        """Return the run time of a task within the budget, None when the
+        budget left is too short to run it."""
+        if not self.deadline:
+            return task['run_time']
+        now = time.monotonic()
+        left = self.deadline - now
+        # slot seconds left, shared among the stressors still to run
+        busy = sum(max(result['end'] - now, 0)
+                   for _, result in self.running.values())
+        share = (left * len(self.slots) - busy) / (len(self.pending) + 1)
+        run_time = int(min(task['run_time'], share, left / self.kill_ratio))
+        return run_time if run_time >= MIN_RUN_TIME else None
+
+    def _command(self, slot, stressor, run_time, bytes_mb, yaml_path):
+        kill_time = int(run_time * self.kill_ratio)
+        cmd = ['timeout', '-s', '9', str(kill_time)]
+        cpus = numa.cpulist(slot['cpus'])
+        if slot['nodes'] and self.numactl:
+            nodes = numa.cpulist(slot['nodes'])
+            cmd += [self.numactl, '--cpunodebind=%s' % nodes,
+                    '--membind=%s' % nodes]
+        cmd += ['stress-ng'] + self.options
+        if slot['nodes'] and not self.numactl:
+            cmd += ['--taskset', cpus]
+        cmd += ['--timeout', str(run_time),
+                '--%s' % stressor, str(len(slot['cpus']))]
+        if bytes_mb:
+            cmd += ['--%s' % BYTES_OPTIONS[stressor], '%dm' % bytes_mb]
+        return cmd + ['--metrics', '--yaml', yaml_path]
+
+    def _start(self, index, task, run_time):
+        slot = self.slots[index]
+        stressor = task['stressor']
+        name = stressor if task['attempt'] == 1 else \
+            '%s.%d' % (stressor, task['attempt'])
+        yaml_path = os.path.join(self.outputdir, '%s.yaml' % name)
+        log_path = os.path.join(self.outputdir, '%s.log' % name)
+        bytes_mb = None
+        if stressor in BYTES_OPTIONS:
+            bytes_mb = int(numa.slot_free_mb(slot) * self.memory_usage)
+        cmd = self._command(slot, stressor, run_time, bytes_mb, yaml_path)
+        self.log.info("Running stress-ng %s for %ss on nodes %s, CPUs %s%s",
+                      stressor, run_time,
+                      numa.cpulist(slot['nodes']) or 'all',
+                      numa.cpulist(slot['cpus']),
+                      ' (attempt %d)' % task['attempt']
+                      if task['attempt'] > 1 else '')
+        self.log.debug("Command: %s", ' '.join(cmd))
+        with open(log_path, 'w') as log_file:
+            # in its own process group to kill the stress-ng workers too
+            proc = subprocess.Popen(cmd, stdout=log_file,
+                                    stderr=subprocess.STDOUT,
+                                    start_new_session=True)
+        start = time.monotonic()
+        result = {'stressor': stressor, 'attempt': task['attempt'],
+                  'slot': index, 'nodes': slot['nodes'],
+                  'cpus': numa.cpulist(slot['cpus']),
+                  'instances': len(slot['cpus']), 'run_time': run_time,
+                  'bytes_mb': bytes_mb, 'status': None, 'skipped': False,
+                  'seconds': None, 'metrics': None, 'yaml': yaml_path,
+                  'log': log_path, 'start': start,
+                  'end': start + run_time * self.kill_ratio}
+        self.running[index] = (proc, result)
+
+    def _finish(self, index, status):
+        _, result = self.running.pop(index)
+        if status < 0:
+            # timeout -s 9 kills itself too, report it like a shell
+            status = 128 - status
+        result['status'] = status
+        result['seconds'] = round(time.monotonic() - result.pop('start'), 1)
+        del result['end']
+        if status != KILLED:
+            try:
+                result['metrics'] = load_metrics(
+                    result['yaml']).get(result['stressor'])
+            except ValueError as details:
+                self.log.warning("No stress-ng metrics: %s", details)
+        if status == KILLED:
+            self.log.error("stress-ng %s timed out and was killed",
+                           result['stressor'])
+        elif status:
+            self.log.error("stress-ng %s failed with status %s, see %s",
+                           result['stressor'], status, result['log'])
+        else:
+            self.log.info("stress-ng %s passed in %ss", result['stressor'],
+                          result['seconds'])
+        self.results.append(result)
+        if status and result['attempt'] <= self.retries:
+            self.pending.append({'stressor': result['stressor'],
+                                 'run_time': result['run_time'],
+                                 'attempt': result['attempt'] + 1,
+                                 'avoid': index})
+
+    def _skip(self, task):
+        self.log.warning("No time left in the budget to run stress-ng %s",
+                         task['stressor'])
+        if task['attempt'] > 1:
+            # the failure of the previous attempt stands
+            return
+        self.results.append({'stressor': task['stressor'],
+                             'attempt': task['attempt'], 'slot': None,
+                             'nodes': [], 'cpus': '', 'instances': 0,
+                             'run_time': 0, 'bytes_mb': None, 'status': None,
+                             'skipped': True, 'seconds': None,
+                             'metrics': None, 'yaml': None, 'log': None})
+
+    def run(self):
+        """Run all the stressors.
+
+        :return: list of the results of every attempt, with the
+                 'stressor', its 'attempt' number, the 'slot' index, its
+                 'nodes' and 'cpus', the number of stress-ng 'instances',
+                 the 'run_time' given, the 'bytes_mb' of the memory
+                 option, the exit 'status', None when 'skipped' for lack
+                 of time, the 'seconds' it took, its 'metrics', see
+                 :func:`load_metrics`, and its 'yaml' and 'log' files
+        """
+        if self.budget:
+            self.deadline = time.monotonic() + self.budget
+        try:
+            while self.pending or self.running:
+                free = [index for index in range(len(self.slots))
+                        if index not in self.running]
+                for task in list(self.pending):
+                    if not free:
+                        break
+                    # a stressor which failed runs again on other nodes,
+                    # it waits for one of them unless there is no other
+                    slots = [index for index in free
+                             if index != task['avoid']]
+                    if not slots and len(self.slots) > 1:
+                        continue
+                    self.pending.remove(task)
+                    run_time = self._run_time(task)
+                    if run_time is None:
+                        self._skip(task)
+                        continue
+                    index = (slots or free)[0]
+                    free.remove(index)
+                    self._start(index, task, run_time)
+                for index, (proc, _) in list(self.running.items()):
+                    status = proc.poll()
+                    if status is not None:
+                        self._finish(index, status)
+                if self.running:
+                    time.sleep(POLL_INTERVAL)
+        finally:
+            for proc, result in self.running.values():
+                self.log.warning("Killing stress-ng %s", result['stressor'])
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                proc.wait()
+        return self.results
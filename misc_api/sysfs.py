@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+In process sysfs/procfs reader.
+
+Reads pseudo files without forking ``cat``, and snapshots whole subtrees
+like all the memory blocks or all the CPUs in one pass: every directory is
+opened once and listed with ``os.scandir``, and its files are opened
+relative to the directory fd, so a snapshot of thousands of memory blocks
+costs no fork and no repeated path lookup.
+
+Usage::
+
+    blocks = snapshot('memory', include=['removable', 'state'])
+    online = [name for name, block in blocks.items()
+              if block.get('state') == 'online']
+    before = snapshot('cpu', depth=3)
+    ...
+    changes = diff(before, snapshot('cpu', depth=3))
+"""
+
+import os
+
+__all__ = ['SUBTREES', 'read', 'snapshot', 'flatten', 'diff']
+
+# subtrees known by name
+SUBTREES = {'cpu': '/sys/devices/system/cpu',
+            'node': '/sys/devices/system/node',
+            'memory': '/sys/devices/system/memory',
+            'net': '/sys/class/net',
+            'block': '/sys/block'}
+# pseudo files are a page at most, bigger files are binary blobs
+MAX_SIZE = 4096
+
+
+def read(path, default=None):
+    """Return the stripped content of a pseudo file, default on error."""
+    try:
+        with open(path) as pseudo_file:
+            return pseudo_file.read(MAX_SIZE).strip()
+    except (OSError, UnicodeDecodeError):
+        return default
+
+
+def _read_at(name, dir_fd):
+    try:
+        fd = os.open(name, os.O_RDONLY | os.O_NONBLOCK, dir_fd=dir_fd)
+    except OSError:
+        # write only attributes and the ones the kernel refuses
+        return None
+    try:
+        return os.read(fd, MAX_SIZE).decode('utf-8').strip()
+    except (OSError, UnicodeDecodeError):
+        return None
+    finally:
+        os.close(fd)
+
+
+def _walk(dir_fd, depth, include, follow):
+    tree = {}
+    with os.scandir(dir_fd) as entries:
+        for entry in entries:
+            try:
+                is_link = entry.is_symlink()
+                is_dir = entry.is_dir(follow_symlinks=follow)
+            except OSError:
+                continue
+            if is_dir and (follow or not is_link):
+                if depth <= 1:
+                    continue
+                try:
+                    sub_fd = os.open(entry.name, os.O_RDONLY | os.O_DIRECTORY,
+                                     dir_fd=dir_fd)
+                except OSError:
+                    continue
+                try:
+                    # only the entries of the root are followed, the
+                    # sysfs back links below it would loop
+                    tree[entry.name] = _walk(sub_fd, depth - 1, include,
+                                             False)
+                finally:
+                    os.close(sub_fd)
+            elif not is_link and (include is None or entry.name in include):
+                value = _read_at(entry.name, dir_fd)
+                if value is not None:
+                    tree[entry.name] = value
+    return tree
+
+
+def snapshot(root, depth=2, include=None):
+    """Read the files of a sysfs or procfs subtree.
+
+    Symlinked directories directly under root, like the devices of
+    /sys/class/net, are followed, the symlinks below them are not.
+
+    :param root: directory, or one of the :data:`SUBTREES` names
+    :param depth: number of directory levels read, 1 reads only the
+                  files of root
+    :param include: file names to read, all the readable files when None
+    :return: nested dict of directory name to dict and file name to its
+             stripped content, {} when root does not exist
+    """
+    root = SUBTREES.get(root, root)
+    try:
+        root_fd = os.open(root, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return {}
+    try:
+        return _walk(root_fd, depth, set(include) if include else None,
+                     True)
+    finally:
+        os.close(root_fd)
+
+
+def flatten(tree, prefix=''):
+    """Return a snapshot as a flat dict of relative path to content."""
+    flat = {}
+    for name, value in tree.items():
+        path = os.path.join(prefix, name)
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        else:
+            flat[path] = value
+    return flat
+
+
+def diff(before, after):
+    """Compare two snapshots.
+
+    :return: dict with the 'added' and 'removed' paths and their content,
+             and the 'changed' paths with their (before, after) contents
+    """
+    old, new = flatten(before), flatten(after)
+    return {'added': dict((path, new[path]) for path in new
+                          if path not in old),
+            'removed': dict((path, old[path]) for path in old
+                            if path not in new),
+            'changed': dict((path, (old[path], new[path])) for path in new
+                            if path in old and old[path] != new[path])}
@@ -16,12 +16,18 @@
 # Modified by: Samir A Mulani <samir@linux.vnet.ibm.com>
 #
 
+import json
 import os
+import sys
 from datetime import datetime
 from avocado import Test
 from avocado.utils import process, archive, build
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import repetition
+
 
 class Hackbench(Test):
 
@@ -85,38 +91,32 @@ class Hackbench(Test):
         self.num_groups = self.params.get("num_groups", default="10")
         self.test_type = self.params.get("test_type", default="thread")
         self.loop = self.params.get("loops", default="100000")
-
-    def parse_hackbench_data(self, file_path):
+        self.warmup = int(self.params.get("warmup", default=1))
+        self.min_runs = int(self.params.get("min_runs", default=3))
+        self.target_ci = float(self.params.get("target_ci", default=2))
+        self.max_runs = int(self.params.get("max_runs", default=30))
+        self.time_cap = float(self.params.get("time_cap", default=600))
+        self.noise = repetition.NoiseControl(
+            self.params.get("pin_cpus", default=""),
+            self.params.get("governor", default=""),
+            self.params.get("drop_caches", default=False), log=self.log)
+
+    @staticmethod
+    def parse_hackbench_data(lines):
         """
-        Parse hackbench output data to extract performance metrics.
+        Parse the output of one hackbench run.
 
-        This function reads the benchmark output and computes the following:
-        - min: Minimum time taken to run hackbench across all iterations
-        - max: Maximum time taken to run hackbench across all iterations
-        - avg: Average time across all iterations
+        Returns the time taken to run hackbench in seconds, None when the
+        output has no time.
         """
-        hackbench_times = []
-        with open(file_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith("Time:"):
-                    try:
-                        time_value = float(line.split("Time:")[1].strip())
-                        hackbench_times.append(time_value)
-                    except ValueError:
-                        continue  # Skip malformed lines
-        if not hackbench_times:
-            print("No time values found.")
-            return
-
-        min_time = min(hackbench_times)
-        max_time = max(hackbench_times)
-        avg_time = sum(hackbench_times) / len(hackbench_times)
-
-        self.log.info(f"Parsed {len(hackbench_times)} iterations.")
-        self.log.info(f"Min Time: {min_time:.3f} sec")
-        self.log.info(f"Max Time: {max_time:.3f} sec")
-        self.log.info(f"Avg Time: {avg_time:.3f} sec")
+        for line in lines:
+            line = line.strip()
+            if line.startswith("Time:"):
+                try:
+                    return float(line.split("Time:")[1].strip())
+                except ValueError:
+                    continue  # Skip malformed lines
+        return None
 
     def test(self):
         """
@@ -145,7 +145,7 @@ class Hackbench(Test):
             cmd = "./hackbench " + self.num_groups + " " + self.test_type + \
                 " " + self.loop
 
-        for ite in range(1, int(self.workload_iteration) + 1):
+        def run(ite):
             self.log.info(f"Running hackbench iteration {ite}...")
 
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -166,5 +166,19 @@ class Hackbench(Test):
                 for info in data:
                     fd.write(info)
                     fd.write("\n")
-
-        self.parse_hackbench_data(payload_file)
+            time_value = self.parse_hackbench_data(data)
+            if time_value is None:
+                return None
+            return {'time': time_value}
+
+        # warmup runs are discarded, then the runs go on until the 95%
+        # confidence interval of the mean time is within target_ci percent
+        summary = repetition.Repeater(
+            run, warmup=self.warmup, min_runs=self.min_runs,
+            max_runs=self.max_runs, target_ci=self.target_ci,
+            runs=int(self.workload_iteration),
+            time_cap=self.time_cap, noise=self.noise, log=self.log).run()
+        repetition.report(summary, log=self.log)
+        self.whiteboard = json.dumps(summary)
+        if not summary['runs']:
+            self.fail("No hackbench time found in %s" % payload_file)
@@ -15,10 +15,16 @@
 # Author: Nageswara R Sastry <rnsastry@linux.vnet.ibm.com>
 
 import os
+import sys
+import json
 import platform
 from avocado import Test
-from avocado.utils import cpu, distro, process, dmesg
-from avocado.utils.software_manager.manager import SoftwareManager
+from avocado.utils import cpu, process, dmesg
+from perf_api.events import EventBatch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import facts
 
 
 class hv_24x7_all_events(Test):
@@ -39,8 +45,7 @@ class hv_24x7_all_events(Test):
         3. 24x7 is present
         4. Performance measurement is enabled in LPAR through BMC
         """
-        smm = SoftwareManager()
-        detected_distro = distro.detect()
+        detected_distro = facts.detect_distro()
         if 'ppc64' not in detected_distro.arch:
             self.cancel("Processor is not PowerPC")
         deps = ['gcc', 'make']
@@ -52,9 +57,8 @@ class hv_24x7_all_events(Test):
         else:
             self.cancel("Install the package for perf supported by %s"
                         % detected_distro.name)
-        for package in deps:
-            if not smm.check_installed(package) and not smm.install(package):
-                self.cancel('%s is needed for the test to be run' % package)
+        for package in facts.install_packages(deps):
+            self.cancel('%s is needed for the test to be run' % package)
 
         self.rev = cpu.get_revision()
         perf_args = "perf stat -v -e"
@@ -87,9 +91,10 @@ class hv_24x7_all_events(Test):
                         " the 24x7 counters info")
 
         # Getting the number of cores and chips available in the machine
-        self.chips = cpu.lscpu()["chips"]
-        self.phys_cores = cpu.lscpu()["physical_cores"]
-        self.vir_cores = cpu.lscpu()["virtual_cores"]
+        lscpu = facts.lscpu()
+        self.chips = lscpu["chips"]
+        self.phys_cores = lscpu["physical_cores"]
+        self.vir_cores = lscpu["virtual_cores"]
 
         # Collect all hv_24x7 events
         self.list_of_hv_24x7_events = []
@@ -104,7 +109,7 @@ class hv_24x7_all_events(Test):
         dmesg.clear_dmesg()
 
     def test_all_events(self):
-        perf_args = "-v -e"
+        events = []
         for line in self.list_of_hv_24x7_events:
             if line.startswith('HP') or line.startswith('CP'):
                 # Running for domain range from 1-6
@@ -114,19 +119,31 @@ class hv_24x7_all_events(Test):
                     else:
                         core_range = self.vir_cores
                     for core in range(0, core_range):
-                        events = "hv_24x7/%s,domain=%s,core=%s/" % \
-                                 (line, domain, core)
-                        cmd = 'perf stat %s %s sleep 1' % (perf_args, events)
-                        res = process.run(cmd, ignore_status=True)
-                        if res.exit_status != 0 or b"not supported" in res.stderr:
-                            self.fail_cmd.append(cmd)
+                        events.append("hv_24x7/%s,domain=%s,core=%s/" %
+                                      (line, domain, core))
             else:
                 for chip_item in range(0, self.chips):
-                    events = "hv_24x7/%s,domain=1,chip=%s/" % (line, chip_item)
-                    cmd = "perf stat %s %s sleep 1" % (perf_args, events)
-                    res = process.run(cmd, ignore_status=True)
-                    if res.exit_status != 0 or b"not supported" in res.stderr:
-                        self.fail_cmd.append(cmd)
+                    events.append("hv_24x7/%s,domain=1,chip=%s/" %
+                                  (line, chip_item))
+
+        # Count the events in batches, only failing batches are bisected.
+        # The counters are read only and independent per core and chip, so
+        # the batches are spread over a capped number of workers.
+        batch = EventBatch(events, self.params.get('batch_size', default=127),
+                           workers=self.params.get('workers', default=4))
+        for event in batch.run():
+            self.fail_cmd.append(batch.command([event], verbose=True))
+
+        # Report the counts per event and domain/core or chip
+        report = batch.report()
+        counts = {}
+        for event, value in report['counts'].items():
+            name, _, location = event.split('/')[1].partition(',')
+            counts.setdefault(name, {})[location] = value
+        report['counts'] = counts
+        with open(os.path.join(self.outputdir, 'hv_24x7_events.json'),
+                  'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
 
         if len(self.fail_cmd) > 0:
             for cmd in range(len(self.fail_cmd)):
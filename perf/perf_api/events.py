@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Batched perf stat helpers.
+
+Instead of running one ``perf stat -e <event> sleep 1`` per event, the
+events are packed into batches and counted in a single ``perf stat``
+invocation.  The per-event values are parsed from the machine readable
+(``-x``) output and only a batch that reports a failure is bisected to
+find the offending events, so the run time grows with the number of
+batches rather than with the number of events.  Batches can be counted
+by a pool of workers, for read only counters like hv_24x7 that are
+independent per core and chip.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from avocado.utils import process
+
+__all__ = ['FIELD_SEP', 'NOT_COUNTED', 'NOT_SUPPORTED', 'PMU_BATCH_LIMITS',
+           'EventBatch']
+
+LOG = logging.getLogger('avocado.test')
+
+# Event strings of PMUs like hv_24x7 carry commas
+# (hv_24x7/EVENT,domain=2,core=1/) so ',' can not be used as separator
+FIELD_SEP = ';'
+NOT_COUNTED = '<not counted>'
+NOT_SUPPORTED = '<not supported>'
+# perf stat error when the hypervisor refuses or throttles the counter hcall
+OPS_LIMITED = 'operations is limited'
+
+# Upper bound of events opened together per PMU. hv_24x7 reads the
+# counters through a 4K H_GET_24X7_DATA request buffer, which holds 127
+# requests with interface version 2.
+PMU_BATCH_LIMITS = {'hv_24x7': 127,
+                    'hv_gpci': 127}
+DEFAULT_BATCH_SIZE = 64
+
+
+class EventBatch:
+    """Count a list of perf events with as few perf stat runs as possible.
+
+    An event fails when perf stat exits non zero, or reports the event as
+    not counted or not supported. Passing ``-a`` in perf_args counts the
+    events system wide, so that every event of a batch gets multiplexed
+    onto the PMU counters for the whole run of the workload.
+
+    :param events: list of event strings as accepted by ``perf stat -e``
+    :param batch_size: maximum number of events per perf stat invocation
+    :param workload: command perf stat counts the events for
+    :param perf_args: extra arguments passed to perf stat
+    :param workers: number of perf stat runs in flight at the same time
+    :param retries: times a run is retried, backing off exponentially,
+                    when the hypervisor reports the operations as limited
+    """
+
+    def __init__(self, events, batch_size=DEFAULT_BATCH_SIZE,
+                 workload='sleep 1', perf_args='', workers=1, retries=3):
+        self.events = list(events)
+        self.batch_size = max(1, self._pmu_limit(int(batch_size)))
+        self.workload = workload
+        self.perf_args = perf_args
+        self.workers = max(1, int(workers))
+        self.retries = retries
+        self.counts = {}
+        self.failed = []
+        self.runs = 0
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def _pmu_limit(self, batch_size):
+        """Clamp batch_size to the limits of the PMUs in the event list."""
+        pmus = set(event.split('/')[0] for event in self.events
+                   if '/' in event)
+        return min([batch_size] + [PMU_BATCH_LIMITS[pmu] for pmu in pmus
+                                   if pmu in PMU_BATCH_LIMITS])
+
+    def command(self, events, verbose=False):
+        """Return the perf stat command line counting the given events."""
+        cmd = 'perf stat'
+        if verbose:
+            cmd += ' -v'
+        else:
+            cmd += " -x '%s'" % FIELD_SEP
+        if self.perf_args:
+            cmd += ' %s' % self.perf_args
+        cmd += ''.join(' -e %s' % event for event in events)
+        return '%s %s' % (cmd, self.workload)
+
+    @staticmethod
+    def parse(output, events):
+        """Parse the ``-x`` output of perf stat.
+
+        :param output: perf stat stderr text
+        :param events: events in the order they were given to perf stat
+        :return: dict of event to counter value, NOT_COUNTED or
+                 NOT_SUPPORTED. Events missing from the output are left out.
+        """
+        lines = []
+        for line in output.splitlines():
+            fields = line.split(FIELD_SEP)
+            if len(fields) < 3 or line.startswith('#'):
+                continue
+            lines.append((fields[2], fields[0].strip()))
+
+        result = {}
+        if len(lines) == len(events):
+            # perf stat reports the counters in command line order
+            for event, (_, value) in zip(events, lines):
+                result[event] = value
+            return result
+        for name, value in lines:
+            if name in events:
+                result[name] = value
+        return result
+
+    def _run(self, events):
+        """Run one perf stat for events and return the parsed counts."""
+        cmd = self.command(events)
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.runs += 1
+            res = process.run(cmd, ignore_status=True, verbose=False)
+            output = res.stderr.decode('utf-8', 'ignore')
+            if OPS_LIMITED not in output or attempt == self.retries:
+                break
+            with self._lock:
+                self.limited += 1
+            LOG.debug('Hypervisor limited the operations, retrying: %s', cmd)
+            time.sleep(2 ** attempt)
+        return res.exit_status, self.parse(output, events)
+
+    def _bisect(self, events):
+        """Count events, splitting the batch only when it reports failures."""
+        status, counts = self._run(events)
+        bad = [event for event in events
+               if counts.get(event) in (None, NOT_COUNTED, NOT_SUPPORTED)]
+        if status == 0:
+            with self._lock:
+                for event in events:
+                    if event not in bad:
+                        self.counts[event] = counts[event]
+            if not bad:
+                return
+        if len(events) == 1:
+            with self._lock:
+                self.counts[events[0]] = counts.get(events[0])
+                self.failed.append(events[0])
+            return
+        if status == 0 and len(bad) < len(events):
+            # The healthy events are accounted for, retry only the rest
+            self._bisect(bad)
+            return
+        half = len(events) // 2
+        self._bisect(events[:half])
+        self._bisect(events[half:])
+
+    def run(self):
+        """Count all events.
+
+        :return: list of events that failed to be counted
+        """
+        batches = [self.events[start:start + self.batch_size]
+                   for start in range(0, len(self.events), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # list() re-raises the exceptions of the workers
+            list(pool.map(self._bisect, batches))
+        # keep the failures in event list order whatever the workers did
+        order = dict((event, index) for index, event in enumerate(self.events))
+        self.failed.sort(key=order.get)
+        LOG.info('Counted %d events with %d perf stat runs on %d workers, '
+                 '%d failed', len(self.events), self.runs, self.workers,
+                 len(self.failed))
+        return self.failed
+
+    def report(self):
+        """Return the results of the last run as a dict."""
+        return {'events': len(self.events),
+                'batch_size': self.batch_size,
+                'workers': self.workers,
+                'runs': self.runs,
+                'limited': self.limited,
+                'failed': list(self.failed),
+                'counts': dict(self.counts)}
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+PMU event encoding helpers.
+
+Resolves the perf_event_attr config of events without running perf stat,
+from the sysfs events and format descriptors of every PMU and from one
+``perf list -j`` dump for the events perf only knows from its JSON files.
+"""
+
+import json
+import logging
+import os
+from avocado.utils import genio, process
+
+__all__ = ['SYSFS_PMU', 'parse_terms', 'parse_format', 'EventDecoder']
+
+LOG = logging.getLogger('avocado.test')
+
+SYSFS_PMU = '/sys/bus/event_source/devices'
+
+
+def parse_terms(text):
+    """Parse an event string like ``event=0x600f4,umask=1``.
+
+    :return: dict of term to integer value, terms without value are 1
+    """
+    terms = {}
+    for term in text.strip().strip('/').split(','):
+        if not term:
+            continue
+        name, _, value = term.partition('=')
+        try:
+            terms[name.strip()] = int(value, 0) if value else 1
+        except ValueError:
+            # symbolic values like name=... carry no encoding
+            continue
+    return terms
+
+
+def parse_format(text):
+    """Parse a format descriptor like ``config:0-7,32-35``.
+
+    :return: tuple of attr field name and list of (low, high) bit ranges
+    """
+    field, _, bits = text.strip().partition(':')
+    ranges = []
+    for bit_range in bits.split(','):
+        low, _, high = bit_range.partition('-')
+        ranges.append((int(low), int(high or low)))
+    return field, ranges
+
+
+class EventDecoder:
+    """In memory index of event name to perf_event_attr config value."""
+
+    def __init__(self, sysfs=SYSFS_PMU):
+        self.sysfs = sysfs
+        self.index = {}
+        self._formats = {}
+
+    def formats(self, pmu):
+        """Return the format descriptors of a PMU, read once."""
+        if pmu not in self._formats:
+            formats = {}
+            fmt_dir = os.path.join(self.sysfs, pmu, 'format')
+            if os.path.isdir(fmt_dir):
+                for name in os.listdir(fmt_dir):
+                    formats[name] = parse_format(
+                        genio.read_one_line(os.path.join(fmt_dir, name)))
+            self._formats[pmu] = formats
+        return self._formats[pmu]
+
+    def encode(self, pmu, terms):
+        """Encode the terms of an event of pmu into its config value."""
+        config = 0
+        for term, value in terms.items():
+            field, ranges = self.formats(pmu).get(term, (None, []))
+            if field != 'config':
+                continue
+            for low, high in ranges:
+                width = high - low + 1
+                config |= (value & ((1 << width) - 1)) << low
+                value >>= width
+        return config
+
+    def load_sysfs(self):
+        """Index the events every PMU exports in sysfs."""
+        if not os.path.isdir(self.sysfs):
+            return
+        # Prefer the core PMU when an event name is exported by several
+        pmus = sorted(os.listdir(self.sysfs), key=lambda pmu: pmu != 'cpu')
+        for pmu in pmus:
+            ev_dir = os.path.join(self.sysfs, pmu, 'events')
+            if not os.path.isdir(ev_dir):
+                continue
+            for name in os.listdir(ev_dir):
+                # skip the .scale/.unit companion files
+                if '.' in name:
+                    continue
+                terms = parse_terms(
+                    genio.read_one_line(os.path.join(ev_dir, name)))
+                self.index.setdefault(name.lower(), self.encode(pmu, terms))
+
+    def load_perf_list(self):
+        """Index the events of one ``perf list -j`` dump."""
+        res = process.run('perf list -j', ignore_status=True, verbose=False)
+        try:
+            entries = json.loads(res.stdout_text)
+        except ValueError:
+            LOG.debug('perf list -j is not supported by this perf')
+            return
+        for entry in entries:
+            name = entry.get('EventName')
+            encoding = entry.get('Encoding')
+            if not name or not encoding or '/' not in encoding:
+                continue
+            pmu, _, terms = encoding.partition('/')
+            self.index.setdefault(name.lower(),
+                                  self.encode(pmu, parse_terms(terms)))
+
+    def load(self):
+        """Build the index from sysfs and perf list."""
+        self.load_sysfs()
+        self.load_perf_list()
+        LOG.info('Decoded %d event encodings', len(self.index))
+        return self
+
+    def config(self, event):
+        """Return the config value of event, None when it is unknown."""
+        return self.index.get(event.lower())
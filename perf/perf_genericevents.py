@@ -21,6 +21,7 @@ import os
 import configparser
 from avocado import Test
 from avocado.utils import cpu, process
+from perf_api.events import EventBatch
 
 
 class test_generic_events(Test):
@@ -105,3 +106,22 @@ class test_generic_events(Test):
                               '%s' % (self.hex_to_int(val), val, raw_code))
         if nfail != 0:
             self.fail('Failed to verify generic PMU event codes')
+
+    def test_count(self):
+        """
+        Count every generic event exported by the cpu PMU, the events
+        are multiplexed in batches and failing batches are bisected
+        """
+        dir = "/sys/bus/event_source/devices/cpu/events"
+        if not os.path.isdir(dir):
+            self.cancel("%s does not exist" % dir)
+        if process.system("perf --version", ignore_status=True) != 0:
+            self.cancel("perf is needed for the test to be run")
+        events = ["cpu/%s/" % name for name in sorted(os.listdir(dir))]
+        batch = EventBatch(events, self.params.get('batch_size', default=64),
+                           perf_args='-a')
+        failed = batch.run()
+        for event in failed:
+            self.log.info("Failed command: %s", batch.command([event]))
+        if failed:
+            self.fail("Failed to count generic events: %s" % failed)
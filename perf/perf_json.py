@@ -21,6 +21,8 @@ import shutil
 from avocado import Test
 from avocado.utils import cpu, distro, dmesg, process, archive
 from avocado.utils.software_manager.manager import SoftwareManager
+from perf_api.events import EventBatch
+from perf_api.pmu import EventDecoder
 
 # Global variable to track whether the kernel has been built
 kernel_built = False
@@ -117,12 +119,12 @@ class perf_json(Test):
         dmesg.clear_dmesg()
 
     def test_pmu_events(self):
-        # run all pmu events with perf stat
-        for event in self.perf_list_pmu_events:
-            cmd = "perf stat -e %s -I 1000 sleep 1" % event
-            res = process.run(cmd, shell=True, verbose=True)
-            if (b"not counted" in res.stderr) or (b"not supported" in res.stderr):
-                self.fail_cmd.append(cmd)
+        # run all pmu events with perf stat, multiplexed in batches
+        batch = EventBatch(sorted(self.perf_list_pmu_events),
+                           self.params.get('batch_size', default=64),
+                           perf_args='-a')
+        for event in batch.run():
+            self.fail_cmd.append(batch.command([event]))
         if self.fail_cmd:
             self.fail("perf pmu events failed are %s" % self.fail_cmd)
 
@@ -140,7 +142,9 @@ class perf_json(Test):
         if self.perf_list_pmu_events != self.json_pmu_events:
             self.fail("mismatch in event list between perf list and json files")
 
-        # compare event code from perf and json files
+        # compare event code from perf and json files, the encodings of
+        # all events are decoded once from sysfs and perf list
+        self.decoder = EventDecoder().load()
         for event in self.perf_list_pmu_events:
             perf_event_code = self._get_perf_event_code(event)
             json_event_code = self.json_event_info.get(event, None)
@@ -157,7 +161,11 @@ class perf_json(Test):
                         f"Mismatch in event code for event {event} Perf code={perf_event_code}, JSON code={json_event_code}")
 
     def _get_perf_event_code(self, event):
-        # Helper function to get event code from perf stat command
+        # Helper function to get event code, perf stat is used only for
+        # events the decoder could not resolve
+        config = self.decoder.config(event)
+        if config is not None:
+            return hex(config)
         cmd = "perf stat -vv -e %s sleep 1" % event
         output = process.run(cmd, shell=True)
         res = output.stdout.decode() + output.stderr.decode()
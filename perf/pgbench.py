@@ -14,8 +14,10 @@
 # Copyright: 2023 IBM
 # Author: Gautam Menghani <gautam@linux.ibm.com>
 
+import json
 import os
 import re
+import sys
 from datetime import datetime
 
 from avocado import Test
@@ -23,6 +25,10 @@ from avocado.utils import process, cpu, distro
 from avocado.utils.service import ServiceManager
 from avocado.utils.software_manager.manager import SoftwareManager
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import repetition
+
 
 class Pgbench(Test):
 
@@ -113,6 +119,15 @@ class Pgbench(Test):
                                                  default=0)
         self.workload_iteration = self.params.get("workload_iteration",
                                                   default=10)
+        self.warmup = int(self.params.get("warmup", default=1))
+        self.min_runs = int(self.params.get("min_runs", default=3))
+        self.target_ci = float(self.params.get("target_ci", default=2))
+        self.max_runs = int(self.params.get("max_runs", default=20))
+        self.time_cap = float(self.params.get("time_cap", default=3600))
+        self.noise = repetition.NoiseControl(
+            self.params.get("pin_cpus", default=""),
+            self.params.get("governor", default=""),
+            self.params.get("drop_caches", default=False), log=self.log)
 
         # validation: pgbench cannot accept both transaction
         # count and duration
@@ -131,44 +146,24 @@ class Pgbench(Test):
         # setup tables
         self.run_cmd(f"pgbench -i -s {self.scaling_factor} -n pgbench", False)
 
-    def extract_tps_stats(self, log_file="test.log"):
+    @staticmethod
+    def extract_tps_stats(output):
         """
-        Parse pgbench output data to extract performance metrics.
+        Parse the output of one pgbench run.
 
-        This function reads the benchmark output and computes the following:
-        - min: Minimum tps across all iterations
-        - max: Maximum tps across all iterations
-        - avg: Average tps across all iterations
+        Returns the tps of the run, None when the output has none.
         """
-
-        tps_pattern = re.compile(r"tps\s*=\s*([\d.]+)")
-
-        try:
-            with open(log_file, "r") as f:
-                tps_values = [float(match.group(1))
-                              for line in f
-                              if (match:= tps_pattern.search(line))]
-        except FileNotFoundError:
-            print(f"File not found: {log_file}")
-            return
-
-        if tps_values:
-            print(f"Captured TPS values: {tps_values}")
-            print("\nTPS Statistics")
-            print("{:<15}{:<15}{:<15}".format("Min", "Max", "Average"))
-            print("-" * 45)
-            print("{:<15.2f}{:<15.2f}{:<15.2f}".format(
-                min(tps_values), max(tps_values), sum(tps_values) / len(tps_values)))   # noqa
-        else:
-            print("No TPS values found in the log file.")
+        match = re.search(r"tps\s*=\s*([\d.]+)", output)
+        if match:
+            return float(match.group(1))
+        return None
 
     def test(self):
         pgbench = self.logdir + "/pgbench_logs"
         os.makedirs(pgbench, exist_ok=True)
         payload_file = os.path.join(pgbench, "pgbench_payload.log")
 
-        # run the benchmark
-        for ite in range(1, int(self.workload_iteration) + 1):
+        def run(ite):
             self.log.info(f"Running pgbench iteration {ite}...")
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             log_filename = f"pgbench_run_{ite}_{timestamp}.log"
@@ -178,21 +173,34 @@ class Pgbench(Test):
             else:
                 result = self.run_cmd(f"pgbench --protocol={self.protocol} --jobs={self.worker_threads} --scale={self.scaling_factor} --client={self.db_clients}  -n --transactions={self.transaction_count} -r pgbench", False)   # noqa
             self.log.info("===== Pgbench benchmark results ======")
-            if not result[0]:
-                self.log.info(result[1])
-                with open(payload_file, "a") as fd:
-                    fd.write("==================Iteration {}=============\
-                            \n".format(str(ite)))
-                    # for info in data:
-                    fd.write(result[1])
-                    fd.write("\n")
-
-                with open(log_path, "w") as fd:
-                    # for info in data:
-                    fd.write(result[1])
-                    fd.write("\n")
-
-        self.extract_tps_stats(payload_file)
+            if result[0]:
+                return None
+            self.log.info(result[1])
+            with open(payload_file, "a") as fd:
+                fd.write("==================Iteration {}=============\
+                        \n".format(str(ite)))
+                fd.write(result[1])
+                fd.write("\n")
+
+            with open(log_path, "w") as fd:
+                fd.write(result[1])
+                fd.write("\n")
+            tps = self.extract_tps_stats(result[1])
+            if tps is None:
+                return None
+            return {'tps': tps}
+
+        # warmup runs are discarded, then the runs go on until the 95%
+        # confidence interval of the mean tps is within target_ci percent
+        summary = repetition.Repeater(
+            run, warmup=self.warmup, min_runs=self.min_runs,
+            max_runs=self.max_runs, target_ci=self.target_ci,
+            runs=int(self.workload_iteration),
+            time_cap=self.time_cap, noise=self.noise, log=self.log).run()
+        repetition.report(summary, log=self.log)
+        self.whiteboard = json.dumps(summary)
+        if not summary['runs']:
+            self.fail("No TPS values found in %s" % payload_file)
 
     def tearDown(self):
         # destroy the db
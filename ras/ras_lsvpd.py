@@ -17,16 +17,20 @@
 # Author: R Nageswara Sastry <rnsastry@linux.ibm.com>
 
 import os
+import sys
 import shutil
 import fnmatch
 from avocado.utils import pci
 from avocado import Test
-from avocado.utils import process, distro, build, archive
+from avocado.utils import process, build, archive
 from avocado import skipIf
-from avocado.utils.software_manager.manager import SoftwareManager
 
-IS_POWER_NV = 'PowerNV' in open('/proc/cpuinfo', 'r').read()
-IS_KVM_GUEST = 'qemu' in open('/proc/cpuinfo', 'r').read()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import facts
+
+IS_POWER_NV = facts.is_power_nv()
+IS_KVM_GUEST = facts.is_kvm_guest()
 
 
 class RASToolsLsvpd(Test):
@@ -49,15 +53,13 @@ class RASToolsLsvpd(Test):
         """
         Ensure corresponding packages are installed
         """
-        if "ppc" not in distro.detect().arch:
+        if "ppc" not in facts.detect_distro().arch:
             self.cancel("supported only on Power platform")
         self.run_type = self.params.get('type', default='distro')
-        self.sm = SoftwareManager()
-        for package in ("lsvpd", "sysfsutils", "pciutils"):
-            if not self.sm.check_installed(package) and not \
-                    self.sm.install(package):
-                self.cancel("Fail to install %s required for this"
-                            " test." % package)
+        for package in facts.install_packages(["lsvpd", "sysfsutils",
+                                               "pciutils"]):
+            self.cancel("Fail to install %s required for this"
+                        " test." % package)
         self.var_lib_lsvpd_dir = "/var/lib/lsvpd/"
 
     @staticmethod
@@ -73,7 +75,7 @@ class RASToolsLsvpd(Test):
         lsvpd package binaries with upstream code.
         """
         if self.run_type == 'upstream':
-            self.detected_distro = distro.detect()
+            self.detected_distro = facts.detect_distro()
             deps = ['gcc', 'make', 'automake', 'autoconf', 'bison', 'flex',
                     'libtool', 'zlib-devel', 'ncurses-devel', 'librtas-devel']
             if 'SuSE' in self.detected_distro.name:
@@ -84,11 +86,9 @@ class RASToolsLsvpd(Test):
                              'sg3_utils-devel'])
             else:
                 self.cancel("Unsupported Linux distribution")
-            for package in deps:
-                if not self.sm.check_installed(package) and not \
-                        self.sm.install(package):
-                    self.cancel("Fail to install %s required for this test." %
-                                package)
+            for package in facts.install_packages(deps):
+                self.cancel("Fail to install %s required for this test." %
+                            package)
             url = self.params.get(
                 'lsvpd_url', default='https://github.com/power-ras/'
                 'lsvpd/archive/refs/heads/master.zip')
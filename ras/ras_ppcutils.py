@@ -21,13 +21,16 @@ import re
 import pexpect
 import sys
 from avocado import Test
-from avocado.utils import process, distro, build, archive, disk
+from avocado.utils import process, build, archive, disk
 from avocado import skipIf, skipUnless
-from avocado.utils.software_manager.manager import SoftwareManager
 from avocado.utils import pci
 
-IS_POWER_NV = 'PowerNV' in open('/proc/cpuinfo', 'r').read()
-IS_KVM_GUEST = 'qemu' in open('/proc/cpuinfo', 'r').read()
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from misc_api import facts
+
+IS_POWER_NV = facts.is_power_nv()
+IS_KVM_GUEST = facts.is_kvm_guest()
 
 
 class RASToolsPpcutils(Test):
@@ -53,19 +56,16 @@ class RASToolsPpcutils(Test):
                 self.log.info("Failed command: %s" % self.fail_cmd[cmd])
             self.fail("RAS: Failed commands are: %s" % self.fail_cmd)
 
-    @skipUnless("ppc" in distro.detect().arch,
+    @skipUnless("ppc" in facts.detect_distro().arch,
                 "supported only on Power platform")
     def setUp(self):
         """
         Ensure packages are installed
         """
-        self.sm = SoftwareManager()
         self.run_type = self.params.get('type', default='distro')
-        for package in ['ppc64-diag', 'powerpc-utils']:
-            if not self.sm.check_installed(package) and not \
-                    self.sm.install(package):
-                self.cancel("Fail to install %s required for this test." %
-                            package)
+        for package in facts.install_packages(['ppc64-diag', 'powerpc-utils']):
+            self.cancel("Fail to install %s required for this test." %
+                        package)
         # get the disk name
         self.disk_name = ''
         output = process.system_output("df -h", shell=True).decode().splitlines()
@@ -90,7 +90,7 @@ class RASToolsPpcutils(Test):
         lsvpd Tool binaries with upstream code.
         """
         if self.run_type == 'upstream':
-            self.detected_distro = distro.detect()
+            self.detected_distro = facts.detect_distro()
             deps = ['gcc', 'make', 'automake', 'autoconf', 'bison', 'flex',
                     'libtool', 'zlib-devel', 'ncurses-devel', 'librtas-devel']
             if 'SuSE' in self.detected_distro.name:
@@ -99,11 +99,9 @@ class RASToolsPpcutils(Test):
                 deps.extend(['numactl-devel'])
             else:
                 self.cancel("Unsupported Linux distribution")
-            for package in deps:
-                if not self.sm.check_installed(package) and not \
-                        self.sm.install(package):
-                    self.cancel("Fail to install %s required for this test." %
-                                package)
+            for package in facts.install_packages(deps):
+                self.cancel("Fail to install %s required for this test." %
+                            package)
             url = self.params.get(
                 'ppcutils_url', default='https://github.com/'
                 'ibm-power-utilities/powerpc-utils/archive/refs/heads/'
@@ -28,6 +28,11 @@ from avocado.utils import genio
 from avocado.utils import process
 from avocado.utils import linux_modules
 from avocado.utils.software_manager.manager import SoftwareManager
+from trace_api.tracefs import TraceReader
+
+# Return value of a function graph exit, like /* test_retval_init = 0x0 */
+RETVAL_PATTERN = (r'/\*\s*(?:(\w+)(?:\s+\[[\w]+\])?\s*)?=\s*'
+                  r'(0x[0-9a-fA-F]+|-?[0-9]+)\s*\*/')
 
 
 class FunctionGraphRetval(Test):
@@ -95,6 +100,7 @@ class FunctionGraphRetval(Test):
         self.current_tracer = os.path.join(self.tracefs, 'current_tracer')
         self.tracing_on = os.path.join(self.tracefs, 'tracing_on')
         self.trace_file = os.path.join(self.tracefs, 'trace')
+        self.max_lines = self.params.get('max_lines', default=10000)
 
         # Set up module build directory
         self.module_dir = tempfile.mkdtemp()
@@ -254,27 +260,41 @@ class FunctionGraphRetval(Test):
         self.log.info("Capturing function trace with return values")
         self.log.info("=" * 60)
 
-        # Clear trace buffer
-        self._write_file(self.trace_file, '')
+        reader = self._trace_module_load(module_path)
+        if not reader.total:
+            self.failures.append("No trace output captured")
+            return None
 
-        # Enable tracing
-        self._write_file(self.tracing_on, '1')
+        return reader
 
-        # Load module to trigger traced functions
-        self._load_test_module(module_path)
+    def _trace_module_load(self, module_path):
+        """
+        Stream the trace of the module loading, keeping only the lines of
+        the module functions.
+        """
+        # Clear trace buffer
+        self._write_file(self.trace_file, '')
 
-        # Disable tracing immediately to stop buffer from filling
-        self._write_file(self.tracing_on, '0')
+        counters = {'retval': RETVAL_PATTERN, 'graph': r'[{}]'}
+        reader = TraceReader(self.tracefs, pattern=self.module_name,
+                             counters=counters, max_lines=self.max_lines)
+        reader.start()
+        try:
+            # Enable tracing
+            self._write_file(self.tracing_on, '1')
 
-        # Read trace output
-        trace_output = self._read_file(self.trace_file)
-        if not trace_output:
-            self.failures.append("No trace output captured")
-            return None
+            # Load module to trigger traced functions
+            self._load_test_module(module_path)
 
-        return trace_output
+            # Disable tracing immediately to stop buffer from filling
+            self._write_file(self.tracing_on, '0')
+        finally:
+            dropped = reader.stop()
+        if dropped:
+            self.log.warning("The trace ring buffer lost %d events", dropped)
+        return reader
 
-    def _search_module_functions_in_trace(self, trace_output,
+    def _search_module_functions_in_trace(self, trace_lines,
                                           max_samples=None,
                                           log_findings=True):
         """
@@ -284,7 +304,7 @@ class FunctionGraphRetval(Test):
         for test module related functions (containing 'test_retval' in name).
 
         Args:
-            trace_output: The trace output string to search
+            trace_lines: The trace output lines to search
             max_samples: Maximum number of return values to collect before
             stopping (None = no limit)
             log_findings: Whether to log each finding (default: True)
@@ -305,18 +325,14 @@ class FunctionGraphRetval(Test):
         has_graph_output = False
         lines_scanned = 0
 
-        if not trace_output:
+        if not trace_lines:
             return (found_module_functions, retval_count,
                     has_graph_output, lines_scanned)
 
         # Pattern to match return values in a line
-        retval_pattern = re.compile(
-            r'/\*\s*(?:(\w+)(?:\s+\[[\w]+\])?\s*)?=\s*'
-            r'(0x[0-9a-fA-F]+|-?[0-9]+)\s*\*/')
+        retval_pattern = re.compile(RETVAL_PATTERN)
 
-        # Process trace line by line for efficiency
-        lines = trace_output.split('\n')
-        for line_num, line in enumerate(lines, 1):
+        for line_num, line in enumerate(trace_lines, 1):
             lines_scanned = line_num
             # Check for function graph output
             if not has_graph_output and ('{' in line or '}' in line):
@@ -353,7 +369,7 @@ class FunctionGraphRetval(Test):
         return (found_module_functions, retval_count,
                 has_graph_output, lines_scanned)
 
-    def _verify_return_values(self, trace_output):
+    def _verify_return_values(self, reader):
         """
         Verify that return values are present in trace output for our test
         module.
@@ -371,20 +387,23 @@ class FunctionGraphRetval(Test):
         self.log.info("Verifying return values in trace output")
         self.log.info("=" * 60)
 
-        if not trace_output:
+        if not reader:
             self.failures.append("No trace output to verify")
             return
 
-        # Save trace output for debugging
+        # Save the module trace lines for debugging
         trace_log = os.path.join(self.outputdir, 'trace_output.log')
-        genio.write_file(trace_log, trace_output)
+        genio.write_file(trace_log, '\n'.join(reader.lines))
         self.log.info("Trace output saved to: %s", trace_log)
 
         # Search for module functions in trace using helper method
-        (found_module_functions, retval_count,
-         has_graph_output, lines_scanned) = \
+        found_module_functions, _, _, _ = \
             self._search_module_functions_in_trace(
-                trace_output, max_samples=100, log_findings=True)
+                list(reader.lines), max_samples=100, log_findings=True)
+        # The return values and graph output are counted on every line
+        retval_count = reader.counts['retval']
+        has_graph_output = reader.counts['graph'] > 0
+        lines_scanned = reader.total
 
         # Report findings
         self.log.info("=" * 60)
@@ -419,9 +438,9 @@ class FunctionGraphRetval(Test):
             self.failures.append('Test module functions not found in trace - '
                                  'module may not have been traced')
             # Log first 50 lines for debugging
-            self.log.info("First 50 lines of trace output for debugging:")
-            trace_lines = trace_output.split('\n')
-            for i, line in enumerate(trace_lines[:50]):
+            self.log.info("First 50 module lines of trace output for "
+                          "debugging:")
+            for i, line in enumerate(list(reader.lines)[:50]):
                 self.log.info("  %d: %s", i + 1, line)
         else:
             self.log.info("Found %d test module function(s) in trace:",
@@ -509,13 +528,13 @@ class FunctionGraphRetval(Test):
             return
 
         # Capture trace
-        trace_output = self._capture_trace(module_path)
+        reader = self._capture_trace(module_path)
 
         # Unload module
         self._unload_test_module()
 
         # Verify return values
-        self._verify_return_values(trace_output)
+        self._verify_return_values(reader)
 
     def _test_without_retval_option(self):
         """
@@ -539,31 +558,20 @@ class FunctionGraphRetval(Test):
             self._write_file(retval_option, '0')
             self.log.info("Disabled funcgraph-retval option")
 
-        # Clear trace
-        self._write_file(self.trace_file, '')
-
-        # Enable tracing
-        self._write_file(self.tracing_on, '1')
-
-        # Load module to trigger function
-        self._load_test_module(module_path)
-
-        # Disable tracing immediately
-        self._write_file(self.tracing_on, '0')
+        # Stream the trace of the module loading
+        reader = self._trace_module_load(module_path)
 
         # Unload module
         self._unload_test_module()
 
-        # Read trace
-        trace_output = self._read_file(self.trace_file)
-
         # Verify return values are NOT present using helper method
-        if trace_output:
+        if reader.total:
             # Search for module functions (should find none with return values)
-            found_module_functions, retval_count, _, _ = \
-                self._search_module_functions_in_trace(trace_output,
+            found_module_functions, _, _, _ = \
+                self._search_module_functions_in_trace(list(reader.lines),
                                                        max_samples=10,
                                                        log_findings=False)
+            retval_count = reader.counts['retval']
 
             # Convert to the format expected by the rest of the code
             found_module_retvals = []
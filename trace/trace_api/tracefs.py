@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See LICENSE for more details.
+#
+# Copyright: 2024 IBM
+
+"""
+Streaming tracefs reader.
+
+Reading the formatted ``trace`` file once the workload is over renders the
+whole ring buffer in one go, and whatever overflowed the buffer during the
+run is lost. :class:`TraceReader` instead consumes the per CPU
+``trace_pipe`` files while the workload runs, one thread per CPU, and only
+keeps the lines matching a pattern, in a bounded buffer. The events the
+ring buffer dropped are reported from the per CPU ``stats`` files.
+
+Usage::
+
+    reader = TraceReader(pattern='u_malloc')
+    reader.start()
+    ... run the workload ...
+    reader.stop()
+    if not reader.matched:
+        self.fail('probe was not hit')
+"""
+
+import errno
+import logging
+import os
+import re
+import select
+import threading
+from collections import deque
+
+__all__ = ['TRACEFS', 'cpu_stats', 'TraceReader']
+
+LOG = logging.getLogger('avocado.test')
+
+TRACEFS = '/sys/kernel/debug/tracing'
+READ_SIZE = 64 * 1024
+POLL_TIMEOUT = 0.2
+# per CPU stats counting the events lost by the ring buffer
+LOST_STATS = ('overrun', 'commit overrun', 'dropped events')
+
+
+def _per_cpu(tracefs):
+    """Return the per CPU tracefs directories, by CPU number."""
+    per_cpu = os.path.join(tracefs, 'per_cpu')
+    if not os.path.isdir(per_cpu):
+        return {}
+    return dict((int(name[3:]), os.path.join(per_cpu, name))
+                for name in os.listdir(per_cpu) if name.startswith('cpu'))
+
+
+def cpu_stats(tracefs=TRACEFS):
+    """Return the ring buffer stats of every CPU.
+
+    :return: dict of CPU number to dict of stat name to integer value
+    """
+    stats = {}
+    for cpu, path in _per_cpu(tracefs).items():
+        stats[cpu] = {}
+        try:
+            with open(os.path.join(path, 'stats')) as stats_file:
+                for line in stats_file:
+                    name, _, value = line.partition(':')
+                    try:
+                        stats[cpu][name.strip()] = int(value)
+                    except ValueError:
+                        # the timestamps are not counters
+                        continue
+        except OSError:
+            continue
+    return stats
+
+
+class TraceReader:
+    """Consume the trace pipes of every CPU while a workload runs.
+
+    :param tracefs: tracefs mount point
+    :param pattern: regular expression the kept lines match, all lines
+                    are kept when None
+    :param counters: dict of name to regular expression, the lines matching
+                     each are counted in :attr:`counts` whether they are
+                     kept or not
+    :param max_lines: maximum number of kept lines, the oldest are
+                      discarded first
+    :param callback: called with every kept line, from the reader threads
+                     one line at a time, to aggregate events on the fly
+    :param merged: read the global trace pipe only, the kernel merges the
+                   events of all the CPUs in timestamp order there, for
+                   callbacks pairing events which may come from different
+                   CPUs
+    """
+
+    def __init__(self, tracefs=TRACEFS, pattern=None, counters=None,
+                 max_lines=10000, callback=None, merged=False):
+        self.tracefs = tracefs
+        self.pattern = re.compile(pattern) if pattern else None
+        self.counters = dict((name, re.compile(regex))
+                             for name, regex in (counters or {}).items())
+        self.lines = deque(maxlen=max_lines)
+        self.counts = dict((name, 0) for name in self.counters)
+        self.total = 0
+        self.matched = 0
+        self.stats = {}
+        self.callback = callback
+        self.merged = merged
+        self._threads = []
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def _pipes(self):
+        if self.merged:
+            return [os.path.join(self.tracefs, 'trace_pipe')]
+        pipes = [os.path.join(path, 'trace_pipe')
+                 for _, path in sorted(_per_cpu(self.tracefs).items())]
+        # kernels without per CPU pipes still have the global one
+        return pipes or [os.path.join(self.tracefs, 'trace_pipe')]
+
+    def _consume(self, lines):
+        with self._lock:
+            for line in lines:
+                self.total += 1
+                for name, regex in self.counters.items():
+                    if regex.search(line):
+                        self.counts[name] += 1
+                if self.pattern and not self.pattern.search(line):
+                    continue
+                self.matched += 1
+                self.lines.append(line)
+                if self.callback:
+                    self.callback(line)
+
+    def _read(self, pipe):
+        """Read one pipe until stopped and drained."""
+        fd = os.open(pipe, os.O_RDONLY | os.O_NONBLOCK)
+        partial = ''
+        try:
+            while True:
+                stopping = self._stop.is_set()
+                readable, _, _ = select.select([fd], [], [], POLL_TIMEOUT)
+                try:
+                    data = os.read(fd, READ_SIZE) if readable else b''
+                except OSError as details:
+                    if details.errno != errno.EAGAIN:
+                        raise
+                    data = b''
+                if not data:
+                    # once stopped, an empty read means the pipe is drained
+                    if stopping:
+                        break
+                    continue
+                lines = (partial + data.decode('utf-8', 'replace')).split('\n')
+                partial = lines.pop()
+                self._consume(lines)
+            if partial:
+                self._consume([partial])
+        finally:
+            os.close(fd)
+
+    def start(self):
+        """Start one reader thread per CPU, or one for the merged pipe."""
+        self._stop.clear()
+        for pipe in self._pipes():
+            thread = threading.Thread(target=self._read, args=(pipe,),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Drain the pipes, stop the readers and collect the stats.
+
+        :return: number of events the ring buffer lost
+        """
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.stats = cpu_stats(self.tracefs)
+        dropped = self.dropped()
+        LOG.info('Read %d trace lines, kept %d, %d events lost',
+                 self.total, self.matched, dropped)
+        return dropped
+
+    def dropped(self):
+        """Return the number of events the ring buffer lost on all CPUs."""
+        return sum(stats.get(name, 0) for stats in self.stats.values()
+                   for name in LOST_STATS)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
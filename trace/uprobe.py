@@ -19,6 +19,7 @@ from avocado.utils import genio
 from avocado.utils import distro
 from avocado.utils import process
 from avocado.utils.software_manager.manager import SoftwareManager
+from trace_api.tracefs import TraceReader
 
 
 class Uprobe(Test):
@@ -111,16 +112,16 @@ class Uprobe(Test):
         uprobes_cmd = uprobes % (libc_path, libc_addr, self.uprobes_events_fs)
         self.run_cmd(uprobes_cmd)
         if self.is_fail:
-            self.fail("Cannot plant a uprobes with %s", uprobes_cmd)
+            self.fail("Cannot plant a uprobes with %s" % uprobes_cmd)
 
-        self.ena_dis_uprobes(self.enable_prob)
-        cmd_list = ["date", "ls"]
-        for cmd in cmd_list:
-            self.run_cmd(cmd)
-        cmd_trace = "cat /sys/kernel/debug/tracing/trace"
-        if "u_malloc" not in (self.run_cmd_out(cmd_trace)):
+        with TraceReader(self.debugfs, pattern="u_malloc") as reader:
+            self.ena_dis_uprobes(self.enable_prob)
+            cmd_list = ["date", "ls"]
+            for cmd in cmd_list:
+                self.run_cmd(cmd)
+            self.ena_dis_uprobes(self.disable_prob)
+        if not reader.matched:
             self.fail("Uprobe probe was not hit.")
-        self.ena_dis_uprobes(self.disable_prob)
         self.clear_trace()
 
     def test(self):